@@ -1,125 +1,224 @@
 import os
-import cv2
-import numpy as np
+import argparse
 import redis
 import time
-import json
 import grpc
-from deepface import DeepFace
 from datetime import datetime
-from ultralytics import YOLO
 
 from utils import aggregator_pb2
 from utils import aggregator_pb2_grpc
 from utils import logger
+from utils import inference
+from utils import metrics
+from utils import profiling
+from utils import tracing
+from utils.agegender_engine import AgeGenderEngine
+from utils.blob_lifecycle import BlobLifecycle
+from utils.face_cache import FACE_CACHE_ENABLED, FaceAttributeCache
+from utils.face_task import decode_for_crops, iter_crops
+from utils.result_codec import encode_result
+from utils.task_queue import LaneQueue, lane_streams
+from utils.worker_pool import WorkerPool, supervise
 
 # Config
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 GRPC_ADDRESS = os.getenv("GRPC_ADDRESS", "localhost:50051")
+BATCH_IMAGES = int(os.getenv("AGEGEN_BATCH_IMAGES", 4))
+NUM_WORKERS = int(os.getenv("AGEGEN_WORKERS", 0))
+CROP_MIN_SIDE = int(os.getenv("AGEGEN_CROP_MIN_SIDE", 224))  # age/gender model input size
+FACE_CACHE_REDIS = os.getenv("FACE_CACHE_REDIS", "0") == "1"
+METRICS_PORT = int(os.getenv("AGEGEN_METRICS_PORT", 9103))
 
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=False)
-face_detector = YOLO("model.pt").to("cpu")  # TODO: Share across services later
-
-def parse_gender(gender_raw):
-    if isinstance(gender_raw, str):
-        return gender_raw.lower()
-    if isinstance(gender_raw, dict):
-        return max(gender_raw, key=gender_raw.get).lower()
-    return "unknown"
-
-def detect_faces(image):
-    results = face_detector(image)[0]
-    boxes = results.boxes.xyxy.cpu().numpy().astype(int)
-    return boxes
-
-def analyze_faces(image_bytes, image_hash):
-    image_np = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
-
-    boxes = detect_faces(image)
-    logger.log_info(f"[AGEGEN] Detected {len(boxes)} face(s) for image {image_hash}")
-    results = []
-
-    for idx, (x1, y1, x2, y2) in enumerate(boxes):
-        face_crop = image[y1:y2, x1:x2]
-        try:
-            result = DeepFace.analyze(face_crop, actions=['age', 'gender'], enforce_detection=False)[0]
-            age = int(result['age'])
-            gender = parse_gender(result['gender'])
-
-            logger.log_info(f"[AGEGEN] Face {idx} — age: {age}, gender: {gender} (image: {image_hash})")
+queue = LaneQueue(r, "task:agegender", "agegender", holder="agegender")
+blobs = BlobLifecycle(r)
+engine = None
+
+def get_engine():
+    # built on first use so a supervisor parent never loads the models itself
+    global engine
+    if engine is None:
+        cache = None
+        if FACE_CACHE_ENABLED:
+            cache = FaceAttributeCache(r=r if FACE_CACHE_REDIS else None)
+        models = inference.load_attribute_models()
+        models.warmup()
+        engine = AgeGenderEngine(models.age, models.gender, cache=cache)
+    return engine
+
+def warm_up():
+    get_engine()
+
+def analyze_faces(images):
+    # images: list of (image_hash, decoded image, faces, scale); all crops go through the models in one batch.
+    # Returns None when the batch failed: nothing is sent, so the entries are redelivered
+    items = []
+    boxes = {}
+    for image_hash, image, faces, scale in images:
+        logger.log_info("[AGEGEN] Received %s face(s) for image %s", len(faces), image_hash, image_hash=image_hash)
+        for face, face_crop in iter_crops(image, faces, scale):
+            items.append((image_hash, face["face_index"], face_crop))
+            boxes[(image_hash, face["face_index"])] = face["box"]
 
-            results.append({
+    try:
+        with metrics.timed("agegender", "agegender"):
+            grouped = get_engine().analyze(items)
+        metrics.inc("faces_processed_total", len(items), service="agegender")
+    except Exception as e:
+        logger.log_error("[AGEGEN] Age/gender batch of %s face(s) failed: %s", len(items), e)
+        return None
+
+    if engine is not None and engine.cache is not None:
+        logger.log_info("[AGEGEN] Face cache: %s", engine.cache.stats())
+
+    results = {}
+    for image_hash, *_ in images:
+        faces = []
+        for face in grouped.get(image_hash, []):
+            idx = face["face_index"]
+            ag = face["agegender"]
+            logger.log_sampled("[AGEGEN] Face %s — age: %s, gender: %s (image: %s)", idx, ag['age'], ag['gender'], image_hash, image_hash=image_hash)
+            faces.append({
                 "face_index": idx,
-                "box": {"x1": int(x1), "y1": int(y1), "x2": int(x2), "y2": int(y2)},
-                "agegender": {"age": age, "gender": gender}
+                "box": boxes[(image_hash, idx)],
+                "agegender": ag
             })
-        except Exception as e:
-            logger.log_error(f"[AGEGEN] DeepFace failed on face {idx} in {image_hash}: {e}")
-            continue
-
+        results[image_hash] = faces
     return results
 
-def send_to_storage(image_bytes, redis_key, metadata_dict):
+def send_to_storage(image_hash, redis_key, metadata_dict, traceparent=None):
+    # only the hash and our part travel; storage fetches the image from the blob store
     try:
-        r.set(redis_key, json.dumps(metadata_dict))
         with grpc.insecure_channel(GRPC_ADDRESS) as channel:
             stub = aggregator_pb2_grpc.AggregatorStub(channel)
             request = aggregator_pb2.FaceResult(
                 time=datetime.utcnow().isoformat(),
-                frame=image_bytes,
-                redis_key=redis_key
+                redis_key=redis_key,
+                image_hash=image_hash,
+                part_type="agegender",
+                payload=encode_result(metadata_dict)
             )
-            response = stub.SaveFaceAttributes(request)
+            with metrics.timed("grpc_send", "agegender"):
+                response = stub.SaveFaceAttributes(request, metadata=tracing.grpc_metadata(traceparent))
             if response.response:
-                logger.log_info(f"[AGEGEN] Sent to storage for key {redis_key}")
+                logger.log_info("[AGEGEN] Sent to storage for key %s", redis_key, image_hash=image_hash)
             else:
-                logger.log_warning(f"[AGEGEN] Storage service returned failure for key {redis_key}")
+                logger.log_warning("[AGEGEN] Storage service returned failure for key %s", redis_key, image_hash=image_hash)
+            return response.response
     except Exception as e:
-        logger.log_error(f"[AGEGEN] Failed to send to storage: {e}")
-
-def process_image(image_hash):
-    image_bytes = r.get(f"image:{image_hash}")
-    if image_bytes is None:
-        logger.log_warning(f"[AGEGEN] Image not found in Redis for key: {image_hash}")
-        return
-
-    start = time.time()
-    face_data = analyze_faces(image_bytes, image_hash)
-    duration = time.time() - start
+        logger.log_error("[AGEGEN] Failed to send to storage: %s", e)
+        return False
 
+def finish_image(image_hash, faces, duration, traceparent=None):
+    # returns True once the part reached storage and the task may be acked
     metadata = {
-        "num_faces": len(face_data),
-        "faces": face_data,
+        "num_faces": len(faces),
+        "faces": faces,
         "processing_time_sec": round(duration, 3)
     }
 
     redis_key = f"combined:{image_hash}:agegender"
-    logger.log_info(f"[AGEGEN] Processed image {image_hash} in {duration:.2f}s")
+    logger.log_info("[AGEGEN] Processed image %s in %.2fs", image_hash, duration, image_hash=image_hash)
 
+    if not send_to_storage(image_hash, redis_key, metadata, traceparent):
+        return False
     try:
-        send_to_storage(image_bytes, redis_key, metadata)
-        # Only delete if everything else above succeeded
-        r.delete(f"image:{image_hash}")
-        logger.log_info(f"[AGEGEN] Deleted image:{image_hash} from Redis after processing")
+        left = blobs.release(image_hash, "agegender")
+        logger.log_info("[AGEGEN] Released image:%s (%s holder(s) left)", image_hash, max(left, 0), image_hash=image_hash)
     except Exception as e:
-        logger.log_error(f"[AGEGEN] Failed during final cleanup: {e}")
+        logger.log_error("[AGEGEN] Failed during final cleanup: %s", e)
+    return True
 
-def main():
+def fetch_image(task):
+    with metrics.timed("redis_io", "agegender"):
+        image_bytes = r.get(f"image:{task['image_hash']}")
+    if image_bytes is None:
+        logger.log_warning("[AGEGEN] Image not found in Redis for key: %s", task['image_hash'], image_hash=task['image_hash'])
+    return image_bytes
+
+def process_images(batch):
+    # batch: list of (msg_id, task); entries are acked once their part reached storage
+    images = []
+    msg_ids = {}
+    spans = {}
+    done = []
+    for msg_id, task in batch:
+        image_hash = task["image_hash"]
+        if image_hash in msg_ids:  # duplicate upload in the same batch
+            msg_ids[image_hash].append(msg_id)
+            continue
+        spans[image_hash] = tracing.Span("agegender", "agegender", task.get("traceparent"), image_hash=image_hash)
+        image_bytes = fetch_image(task)
+        if image_bytes is None:
+            done.append(msg_id)
+            continue
+        msg_ids[image_hash] = [msg_id]
+        with metrics.timed("decode", "agegender"):
+            image, scale = decode_for_crops(image_bytes, task["faces"], CROP_MIN_SIDE)
+        images.append((image_hash, image, task["faces"], scale))
+
+    if images:
+        start = time.time()
+        face_data = analyze_faces(images)
+        duration = time.time() - start
+        if face_data is None:
+            # left unacked: the stream hands these out again after the claim timeout
+            for span in spans.values():
+                span.end(error="batch failed")
+            queue.ack(*done)
+            return
+        metrics.inc("images_processed_total", len(images), service="agegender")
+
+        for image_hash, faces in face_data.items():
+            span = spans[image_hash]
+            if finish_image(image_hash, faces, duration, span.traceparent):
+                done.extend(msg_ids[image_hash])
+            span.end(batch_size=len(images), faces=len(faces))
+
+    queue.ack(*done)
+
+def analyze_image(image, faces, image_hash, scale=1.0):
+    # worker-process entry point for supervisor mode
+    start = time.time()
+    results = analyze_faces([(image_hash, image, faces, scale)])
+    if results is None:
+        raise RuntimeError("age/gender models failed")
+    return results[image_hash], time.time() - start
+
+def finish_task(task, image_bytes, result):
+    faces, duration = result
+    return finish_image(task["image_hash"], faces, duration, task.get("traceparent"))
+
+def main_loop():
     logger.log_info("[AGEGEN] Age/Gender Detection Service started...")
     while True:
         try:
-            task = r.brpop("task:agegender", timeout=10)
-            if task is None:
+            batch = queue.read(count=BATCH_IMAGES, block_ms=5000)
+            if not batch:
                 continue
-            _, image_hash_bytes = task
-            image_hash = image_hash_bytes.decode()
-            logger.log_info(f"[AGEGEN] Received task for {image_hash}")
-            process_image(image_hash)
+            for _, task in batch:
+                logger.log_info("[AGEGEN] Received task for %s", task['image_hash'], image_hash=task['image_hash'])
+            process_images(batch)
         except Exception as e:
-            logger.log_error(f"[AGEGEN] Main loop error: {e}")
+            logger.log_error("[AGEGEN] Main loop error: %s", e)
             time.sleep(1)
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS,
+                        help="run as a supervisor over this many worker processes (0 = single process)")
+    args = parser.parse_args()
+    metrics.add_queue_collector(r, {s: "agegender" for s in lane_streams("task:agegender")})
+    metrics.start_metrics_server(METRICS_PORT)
+    profiling.install("agegender")
+    if args.workers > 0:
+        logger.log_info("[AGEGEN] Age/Gender Detection Service started with %s worker process(es)", args.workers)
+        supervise(WorkerPool("AGEGEN", args.workers, analyze_image, init=warm_up), queue, fetch_image, finish_task,
+                  stage="agegender", crop_min_side=CROP_MIN_SIDE)
+    else:
+        warm_up()
+        main_loop()
+
 if __name__ == "__main__":
     main()
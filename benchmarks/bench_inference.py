@@ -0,0 +1,83 @@
+# cold start and per-call latency of each inference backend; every (model, backend) pair runs in a
+# fresh interpreter so framework import time counts towards its cold start
+# usage: python -m benchmarks.bench_inference --backends native,onnx --calls 50 [--threads 4] [--int8]
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+
+MODELS = ("detector", "landmarker", "agegender")
+
+def child(model, backend, args):
+    start = time.perf_counter()
+    from utils import inference
+    loader = {"detector": inference.load_detector, "landmarker": inference.load_landmarker,
+              "agegender": inference.load_attribute_models}[model]
+    instance = loader(backend)
+    load_sec = time.perf_counter() - start
+    warmup_sec = instance.warmup()
+
+    rng = np.random.default_rng(0)
+    if model == "detector":
+        w, h = (int(v) for v in args.size.split("x"))
+        images = [rng.integers(0, 256, size=(h, w, 3), dtype=np.uint8) for _ in range(args.batch)]
+
+        def call():
+            instance.detect(images)
+    elif model == "landmarker":
+        crop = rng.integers(0, 256, size=(160, 160, 3), dtype=np.uint8)
+
+        def call():
+            instance.landmarks(crop)
+    else:
+        batch = rng.random((args.batch, 224, 224, 3), dtype=np.float32)
+
+        def call():
+            instance.age(batch)
+            instance.gender(batch)
+
+    times = []
+    for _ in range(args.calls):
+        t = time.perf_counter()
+        call()
+        times.append((time.perf_counter() - t) * 1000)
+    print(json.dumps({"load": load_sec, "warmup": warmup_sec,
+                      "p50": float(np.percentile(times, 50)), "p95": float(np.percentile(times, 95))}))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--backends", default="native,onnx")
+    parser.add_argument("--models", default=",".join(MODELS))
+    parser.add_argument("--calls", type=int, default=50)
+    parser.add_argument("--batch", type=int, default=4, help="images per detector call / faces per age-gender call")
+    parser.add_argument("--size", default="1280x720", help="detector input image size")
+    parser.add_argument("--threads", type=int, default=0, help="INFERENCE_THREADS for the children")
+    parser.add_argument("--int8", action="store_true", help="use *.int8.onnx models where present")
+    parser.add_argument("--child", nargs=2, metavar=("MODEL", "BACKEND"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child, args)
+        return
+
+    env = dict(os.environ, INFERENCE_THREADS=str(args.threads), ONNX_INT8="1" if args.int8 else "0", LOG_CONSOLE="0")
+    print(f"{'model':<11} {'backend':<8} {'load s':>8} {'warm-up s':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    for model in args.models.split(","):
+        for backend in args.backends.split(","):
+            cmd = [sys.executable, "-m", "benchmarks.bench_inference", "--child", model, backend,
+                   "--calls", str(args.calls), "--batch", str(args.batch), "--size", args.size]
+            proc = subprocess.run(cmd, capture_output=True, text=True, env=env)
+            lines = proc.stdout.strip().splitlines()
+            try:
+                res = json.loads(lines[-1])
+            except (IndexError, ValueError):
+                reason = (proc.stderr.strip().splitlines() or ["no output"])[-1]
+                print(f"{model:<11} {backend:<8} unavailable: {reason}")
+                continue
+            print(f"{model:<11} {backend:<8} {res['load']:>8.2f} {res['warmup']:>10.2f} {res['p50']:>8.1f} {res['p95']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
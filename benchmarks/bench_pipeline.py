@@ -0,0 +1,389 @@
+# end-to-end throughput/latency of upload -> detection -> landmark + agegender -> storage,
+# run in process against fakeredis (or a local Redis) with stand-in models of configurable cost,
+# so plumbing regressions (Redis round trips, gRPC channels, payload size) show up without real models;
+# model cost is simulated with sleeps, which release the GIL like the real inference calls mostly do
+# usage: python -m benchmarks.bench_pipeline --sizes 640x480,1920x1080 --faces 1,4 --workers 1,2 --images 100
+# --backfill N queues N images in the bulk lane after the warm-up of each case, to see interactive latency
+# under a backfill (compare with TASK_LANES=interactive:1, a single lane); the per-image counters then
+# include the backfill work done meanwhile
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+import numpy as np
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUM_MESH_POINTS = 468
+
+stats = {"redis_calls": 0, "grpc_channels": 0, "rpc_bytes": 0}
+stats_lock = threading.Lock()
+
+def count(name, value=1):
+    with stats_lock:
+        stats[name] += value
+
+def pause(ms):
+    if ms > 0:
+        time.sleep(ms / 1000.0)
+
+# --- stand-in backends: same interface as the utils.inference detector, landmarker and attribute models ---
+
+class StandInDetector:
+    def __init__(self, call_ms=20.0, image_ms=5.0, faces=1):
+        self.call_ms = call_ms
+        self.image_ms = image_ms
+        self.faces = faces
+
+    def boxes_for(self, shape):
+        h, w = shape[:2]
+        if self.faces < 1:
+            return np.zeros((0, 4), dtype=np.float32)
+        cols = int(np.ceil(np.sqrt(self.faces)))
+        rows = int(np.ceil(self.faces / cols))
+        cw, ch = w // cols, h // rows
+        side = max(8, min(cw, ch) * 3 // 4)
+        boxes = []
+        for i in range(self.faces):
+            x1 = (i % cols) * cw + (cw - side) // 2
+            y1 = (i // cols) * ch + (ch - side) // 2
+            boxes.append((x1, y1, x1 + side, y1 + side))
+        return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+    def detect(self, images):
+        pause(self.call_ms + self.image_ms * len(images))
+        return [self.boxes_for(image.shape).astype(int) for image in images]
+
+class StandInLandmarker:
+    def __init__(self, call_ms=3.0, seed=0):
+        self.call_ms = call_ms
+        self.points = np.random.default_rng(seed).uniform(0.05, 0.95, size=(NUM_MESH_POINTS, 2)).astype(np.float32)
+
+    def landmarks(self, face_img):
+        pause(self.call_ms)
+        return self.points
+
+def stand_in_attribute_models(call_ms=10.0, face_ms=2.0):
+    # the engine calls both models once per batch; the cost is split between them
+    def age_model(batch):
+        pause((call_ms + face_ms * len(batch)) / 2)
+        probs = np.zeros((len(batch), 101), dtype=np.float32)
+        probs[:, 30] = 1.0
+        return probs
+
+    def gender_model(batch):
+        pause((call_ms + face_ms * len(batch)) / 2)
+        return np.tile(np.array([[0.3, 0.7]], dtype=np.float32), (len(batch), 1))
+
+    return age_model, gender_model
+
+class EncodedImage:
+    # stands in for the PIL image gradio hands to upload_image; save() re-emits pre-encoded JPEG bytes
+    def __init__(self, data):
+        self.data = data
+
+    def save(self, buf, format=None):
+        buf.write(self.data)
+
+def make_images(width, height, n, tag, quality=90):
+    import cv2
+    rng = np.random.default_rng(hash(tag) & 0xFFFFFFFF)
+    base = cv2.GaussianBlur(rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8), (0, 0), 3)
+    images = []
+    for i in range(n):
+        frame = base.copy()
+        # a visible stamp keeps every upload distinct after JPEG quantization
+        cv2.putText(frame, f"{tag}:{i}", (4, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (255, 255, 255), 2)
+        ok, encoded = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        images.append(EncodedImage(encoded.tobytes()))
+    return images
+
+# --- wiring ---
+
+def counting_client(base, server=None):
+    class Client(base):
+        def __init__(self, *args, **kwargs):
+            if server is not None:
+                kwargs["server"] = server
+            super().__init__(*args, **kwargs)
+
+        @classmethod
+        def from_url(cls, url, **kwargs):
+            if server is not None:
+                return cls(**kwargs)
+            return super().from_url(url, **kwargs)
+
+        def execute_command(self, *args, **kwargs):
+            # blocking queue reads depend on how long workers sit idle, not on per-image work
+            if args[0] != "XREADGROUP":
+                count("redis_calls")
+            return super().execute_command(*args, **kwargs)
+
+        def pipeline(self, *args, **kwargs):
+            pipe = super().pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def counted(*a, **kw):
+                count("redis_calls")
+                return execute(*a, **kw)
+            pipe.execute = counted
+            return pipe
+    return Client
+
+def install_stand_ins(redis_url):
+    import grpc
+    import redis
+
+    if redis_url:
+        from urllib.parse import urlparse
+        parsed = urlparse(redis_url)
+        os.environ["REDIS_URL"] = redis_url
+        os.environ["REDIS_HOST"] = parsed.hostname or "localhost"
+        os.environ["REDIS_PORT"] = str(parsed.port or 6379)
+        redis.Redis = counting_client(redis.Redis)
+    else:
+        import fakeredis
+        redis.Redis = counting_client(fakeredis.FakeRedis, fakeredis.FakeServer())
+
+    insecure_channel = grpc.insecure_channel
+
+    def counted_channel(*args, **kwargs):
+        count("grpc_channels")
+        return insecure_channel(*args, **kwargs)
+    grpc.insecure_channel = counted_channel
+
+    for name in ("gradio", "PIL"):
+        try:
+            __import__(name)
+        except ImportError:
+            sys.modules[name] = types.SimpleNamespace(Image=None)
+
+def start_storage():
+    from concurrent import futures
+    import grpc
+    import storage_service
+    from utils import aggregator_pb2_grpc
+
+    done = {}
+    save_merged = storage_service.save_merged
+
+    def timed_save(image_hash, *args, **kwargs):
+        saved = save_merged(image_hash, *args, **kwargs)
+        if saved and image_hash in done:
+            done[image_hash][1] = time.perf_counter()
+            done[image_hash][0].set()
+        return saved
+    storage_service.save_merged = timed_save
+
+    class CountingService(storage_service.AggregatorService):
+        def SaveFaceAttributes(self, request, context):
+            count("rpc_bytes", len(request.payload))
+            return super().SaveFaceAttributes(request, context)
+
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+    aggregator_pb2_grpc.add_AggregatorServicer_to_server(CountingService(), server)
+    port = server.add_insecure_port("127.0.0.1:0")
+    server.start()
+    os.environ["GRPC_ADDRESS"] = f"127.0.0.1:{port}"
+    return server, done
+
+def worker_loops(stop):
+    import agegender_service
+    import detection_service
+    import landmark_service
+    from utils import logger
+
+    def run(name, step):
+        def loop():
+            while not stop.is_set():
+                try:
+                    step()
+                except Exception as e:
+                    logger.log_error("[BENCH] %s worker error: %s", name, e)
+                    time.sleep(0.1)
+        return loop
+
+    def detect_step():
+        batch, _ = detection_service.collect_batch()
+        if batch:
+            detection_service.process_batch(batch)
+
+    def landmark_step():
+        for msg_id, task in landmark_service.queue.read(count=1, block_ms=200):
+            if landmark_service.process_task(task):
+                landmark_service.queue.ack(msg_id)
+
+    def agegender_step():
+        batch = agegender_service.queue.read(count=agegender_service.BATCH_IMAGES, block_ms=200)
+        if batch:
+            agegender_service.process_images(batch)
+
+    return {"detection": run("detection", detect_step),
+            "landmark": run("landmark", landmark_step),
+            "agegender": run("agegender", agegender_step)}
+
+def stage_snapshot():
+    from utils import metrics
+    snap = {}
+    for (name, labels), hist in list(metrics.registry.histograms.items()):
+        if name == "stage_latency_seconds":
+            _, total, n = hist.snapshot()
+            snap[dict(labels)["service"] + "/" + dict(labels)["stage"]] = (total, n)
+    return snap
+
+def run_case(args, done, size, faces, workers, tag):
+    import agegender_service
+    import detection_service
+    import input_service
+    import landmark_service
+    from utils.agegender_engine import AgeGenderEngine
+
+    width, height = size
+    detection_service.detector = StandInDetector(args.detect_ms, args.detect_image_ms, faces)
+    landmark_service.landmarker = StandInLandmarker(args.mesh_ms)
+    agegender_service.engine = AgeGenderEngine(*stand_in_attribute_models(args.agegender_ms, args.agegender_face_ms))
+
+    images = make_images(width, height, args.warmup + args.images, tag)
+    stop = threading.Event()
+    loops = worker_loops(stop)
+    threads = [threading.Thread(target=loops["detection"], daemon=True) for _ in range(args.detectors)]
+    threads += [threading.Thread(target=loops[name], daemon=True) for name in ("landmark", "agegender") for _ in range(workers)]
+    for t in threads:
+        t.start()
+
+    latencies = []
+    lock = threading.Lock()
+
+    def run_clients(items):
+        pending = list(items)
+
+        def client():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    i, image = pending.pop(0)
+                image_hash = hashlib.md5(image.data).hexdigest()
+                entry = done[image_hash] = [threading.Event(), None]
+                start = time.perf_counter()
+                input_service.upload_image(image)
+                if entry[0].wait(args.timeout) and i >= args.warmup:
+                    with lock:
+                        latencies.append((start, entry[1]))
+
+        clients = [threading.Thread(target=client) for _ in range(args.concurrency)]
+        for c in clients:
+            c.start()
+        for c in clients:
+            c.join()
+
+    run_clients(list(enumerate(images))[:args.warmup])
+    if args.backfill:
+        from utils.ingest import Ingester
+        backfill = make_images(width, height, args.backfill, f"{tag}:bulk")
+        Ingester(input_service.r, max_queue_depth=args.backfill + 1).ingest(
+            (f"bulk{i}", image.data) for i, image in enumerate(backfill))
+
+    before = dict(stats), stage_snapshot()
+    run_clients(list(enumerate(images))[args.warmup:])
+    after = dict(stats), stage_snapshot()
+    stop.set()
+    for t in threads:
+        t.join(timeout=6)
+    if args.backfill:
+        # whatever is left of the backfill would otherwise spill into the next case
+        from utils.task_queue import BULK_LANE, INTERACTIVE_LANE, lane_stream
+        for stream in ("task:detect", "task:landmark", "task:agegender"):
+            if BULK_LANE != INTERACTIVE_LANE:
+                input_service.r.xtrim(lane_stream(stream, BULK_LANE), maxlen=0)
+
+    measured = len(latencies)
+    row = {"size": f"{width}x{height}", "faces": faces, "workers": workers,
+           "images": measured, "failed": args.images - measured}
+    if measured:
+        starts, ends = zip(*latencies)
+        lat_ms = np.array([(e - s) * 1000 for s, e in latencies])
+        wall = max(ends) - min(starts)
+        total = args.images
+        row.update({
+            "img_s": measured / wall if wall > 0 else float("inf"),
+            "p50": np.percentile(lat_ms, 50), "p95": np.percentile(lat_ms, 95), "p99": np.percentile(lat_ms, 99),
+            "redis": (after[0]["redis_calls"] - before[0]["redis_calls"]) / total,
+            "channels": (after[0]["grpc_channels"] - before[0]["grpc_channels"]) / total,
+            "rpc_kib": (after[0]["rpc_bytes"] - before[0]["rpc_bytes"]) / total / 1024,
+        })
+    stages = {}
+    for key, (total_s, n) in after[1].items():
+        prev_s, prev_n = before[1].get(key, (0.0, 0))
+        if n > prev_n:
+            stages[key] = (total_s - prev_s) / (n - prev_n) * 1000
+    return row, stages
+
+def parse_list(text, cast=int):
+    return [cast(v) for v in text.split(",") if v]
+
+def parse_size(text):
+    w, h = text.lower().split("x")
+    return int(w), int(h)
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="640x480,1920x1080", help="comma separated WxH")
+    parser.add_argument("--faces", default="1,4", help="faces per image reported by the stand-in detector")
+    parser.add_argument("--workers", default="1,2", help="landmark and agegender worker threads per case")
+    parser.add_argument("--detectors", type=int, default=1, help="detection worker threads")
+    parser.add_argument("--images", type=int, default=100, help="measured images per case")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8, help="uploads kept in flight")
+    parser.add_argument("--timeout", type=float, default=60.0, help="seconds to wait for one image")
+    parser.add_argument("--detect-ms", type=float, default=20.0, help="stand-in detector cost per batch call")
+    parser.add_argument("--detect-image-ms", type=float, default=5.0, help="stand-in detector cost per image")
+    parser.add_argument("--mesh-ms", type=float, default=3.0, help="stand-in FaceMesh cost per face")
+    parser.add_argument("--agegender-ms", type=float, default=10.0, help="stand-in age/gender cost per batch")
+    parser.add_argument("--agegender-face-ms", type=float, default=2.0, help="stand-in age/gender cost per face")
+    parser.add_argument("--backfill", type=int, default=0, help="images queued in the bulk lane before each case")
+    parser.add_argument("--redis-url", default="", help="use this Redis instead of an in-process fakeredis")
+    parser.add_argument("--stages", action="store_true", help="print mean per-stage latency for each case")
+    parser.add_argument("--log", action="store_true", help="keep service INFO logging (off by default)")
+    args = parser.parse_args()
+
+    # services write saved_data/ and logs/ relative to the working directory
+    sys.path.insert(0, REPO_ROOT)
+    os.chdir(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    install_stand_ins(args.redis_url)
+    import logging
+    from utils import logger  # noqa: F401 configures the root logger
+    if not args.log:
+        logging.getLogger().setLevel(logging.WARNING)
+    server, done = start_storage()
+
+    print(f"saving to {os.getcwd()}; model cost detect {args.detect_ms}+{args.detect_image_ms}/img ms, "
+          f"mesh {args.mesh_ms}/face ms, agegender {args.agegender_ms}+{args.agegender_face_ms}/face ms")
+    header = (f"{'size':>10} {'faces':>5} {'workers':>7} {'images':>6} {'img/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+              f"{'p99 ms':>8} {'redis/img':>9} {'chan/img':>8} {'rpc KiB/img':>11}")
+    print(header)
+    case = 0
+    try:
+        for size in [parse_size(s) for s in args.sizes.split(",") if s]:
+            for faces in parse_list(args.faces):
+                for workers in parse_list(args.workers):
+                    case += 1
+                    row, stages = run_case(args, done, size, faces, workers, f"{time.time()}:{case}")
+                    if "img_s" not in row:
+                        print(f"{row['size']:>10} {faces:>5} {workers:>7} {0:>6}  no image completed")
+                        continue
+                    print(f"{row['size']:>10} {faces:>5} {workers:>7} {row['images']:>6} {row['img_s']:>8.1f} "
+                          f"{row['p50']:>8.1f} {row['p95']:>8.1f} {row['p99']:>8.1f} {row['redis']:>9.1f} "
+                          f"{row['channels']:>8.1f} {row['rpc_kib']:>11.1f}"
+                          + (f"  ({row['failed']} timed out)" if row["failed"] else ""))
+                    if args.stages:
+                        for key in sorted(stages):
+                            print(f"{'':>12}{key:<28} {stages[key]:>8.2f} ms")
+    finally:
+        server.stop(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+# compare size and encode/decode time of the result formats on a synthetic result
+# usage: python -m benchmarks.bench_result_codec --faces 10 --repeat 200
+import argparse
+import time
+import numpy as np
+
+from utils.result_codec import decode_result, encode_result, msgpack, orjson
+
+def make_result(num_faces, num_points=468, width=4000, height=3000, seed=0):
+    rng = np.random.default_rng(seed)
+    faces = []
+    for idx in range(num_faces):
+        x1, y1 = int(rng.integers(0, width - 300)), int(rng.integers(0, height - 300))
+        points = rng.integers((x1, y1), (x1 + 300, y1 + 300), size=(num_points, 2))
+        faces.append({
+            "face_index": idx,
+            "box": {"x1": x1, "y1": y1, "x2": x1 + 300, "y2": y1 + 300},
+            "landmarks": [{"x": int(x), "y": int(y)} for x, y in points],
+            "agegender": {"age": int(rng.integers(10, 80)), "gender": "man" if idx % 2 else "woman"}
+        })
+    return {
+        "timestamp": "2025-05-13T10:00:00",
+        "image_path": "saved_data/0123456789abcdef.jpg",
+        "redis_key": "image:0123456789abcdef",
+        "num_faces": num_faces,
+        "faces": faces
+    }
+
+def bench(fmt, data, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        blob = encode_result(data, fmt)
+    encode_ms = (time.perf_counter() - start) * 1000 / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode_result(blob)
+    decode_ms = (time.perf_counter() - start) * 1000 / repeat
+    start = time.perf_counter()
+    for _ in range(repeat):
+        decode_result(blob, arrays=True)
+    arrays_ms = (time.perf_counter() - start) * 1000 / repeat
+    return len(blob), encode_ms, decode_ms, arrays_ms
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--faces", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    data = make_result(args.faces)
+    formats = ["json"]
+    if orjson is not None:
+        formats.append("orjson")
+    if msgpack is not None:
+        formats.append("msgpack")
+
+    print(f"{args.faces} face(s), {args.repeat} round(s) per format")
+    print(f"{'format':<8} {'bytes':>10} {'encode ms':>10} {'decode ms':>10} {'arrays ms':>10}")
+    baseline = None
+    for fmt in formats:
+        size, enc, dec, arr = bench(fmt, data, args.repeat)
+        baseline = baseline or size
+        print(f"{fmt:<8} {size:>10} {enc:>10.3f} {dec:>10.3f} {arr:>10.3f}  ({size / baseline:.0%} of json)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+import redis
+import time
+import os
+
+from utils import logger
+from utils import inference
+from utils import metrics
+from utils import profiling
+from utils import tracing
+from utils.blob_lifecycle import BlobLifecycle
+from utils.face_task import decode_for_detection, encode_task, scale_boxes
+from utils.result_cache import ResultCache
+from utils.task_queue import LaneQueue, lane_streams, publish
+
+# Config
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+BATCH_SIZE = int(os.getenv("DETECT_BATCH_SIZE", 8))
+BATCH_WAIT_MS = int(os.getenv("DETECT_BATCH_WAIT_MS", 50))
+METRICS_PORT = int(os.getenv("DETECT_METRICS_PORT", 9101))
+DETECT_QUEUE = "task:detect"
+DOWNSTREAM_QUEUES = ("task:landmark", "task:agegender")
+
+r = redis.Redis.from_url(REDIS_URL)
+queue = LaneQueue(r, DETECT_QUEUE, "detection")
+blobs = BlobLifecycle(r)
+result_cache = ResultCache(r)
+detector = None
+
+def get_detector():
+    global detector
+    if detector is None:
+        detector = inference.load_detector()
+    return detector
+
+def detect_faces(images):
+    return get_detector().detect(images)
+
+def collect_batch(max_size=BATCH_SIZE, max_wait_ms=BATCH_WAIT_MS):
+    # block for the first task, then keep reading until the batch is full or the window closes
+    batch = queue.read(count=max_size, block_ms=5000)
+    if not batch:
+        return [], 0.0
+    start = time.time()
+    deadline = start + max_wait_ms / 1000.0
+    while len(batch) < max_size:
+        remaining_ms = int((deadline - time.time()) * 1000)
+        if remaining_ms <= 0:
+            break
+        more = queue.read(count=max_size - len(batch), block_ms=remaining_ms)
+        if not more:
+            break
+        batch.extend(more)
+    return batch, time.time() - start
+
+def fetch_images(hashes, spans):
+    with metrics.timed("redis_io", "detection"):
+        blobs = r.mget([f"image:{h}" for h in hashes])
+    images, undecodable = [], []
+    for image_hash, image_bytes in zip(hashes, blobs):
+        if image_bytes is None:
+            logger.log_warning("[DETECT] Image not found in Redis for key: %s", image_hash, image_hash=image_hash)
+            spans[image_hash].end(error="image missing")
+            continue
+        with metrics.timed("decode", "detection"):
+            # decoded straight to a reduced size where the detector would downscale anyway
+            image, scale, original_shape = decode_for_detection(image_bytes)
+        if image is None:
+            logger.log_error("[DETECT] Could not decode image %s", image_hash, image_hash=image_hash)
+            undecodable.append(image_hash)
+            spans[image_hash].end(error="decode failed")
+            continue
+        images.append((image_hash, image, scale, original_shape))
+    return images, undecodable
+
+def drop_images(hashes):
+    # no consumer will ever release these, so free the blob and let the hash be uploaded again
+    pipe = r.pipeline()
+    for image_hash in hashes:
+        blobs.release_all(image_hash, pipe=pipe)
+        result_cache.abort(image_hash, pipe=pipe)
+    with metrics.timed("redis_io", "detection"):
+        pipe.execute()
+
+def publish_faces(detections):
+    pipe = r.pipeline()
+    for image_hash, boxes, image_shape, traceparent, task in detections:
+        # downstream tasks stay in the lane of the upload and keep its deadline
+        encoded = encode_task(image_hash, boxes, image_shape, traceparent, deadline=task.get("deadline"))
+        for stream in DOWNSTREAM_QUEUES:
+            publish(pipe, stream, encoded, lane=task.get("lane"))
+    with metrics.timed("redis_io", "detection"):
+        pipe.execute()
+
+def process_batch(batch):
+    spans = {task["image_hash"]: tracing.Span("detect", "detection", task.get("traceparent"), image_hash=task["image_hash"])
+             for _, task in batch}
+    tasks = {task["image_hash"]: task for _, task in batch}
+    images, undecodable = fetch_images([task["image_hash"] for _, task in batch], spans)
+    if undecodable:
+        drop_images(undecodable)
+    if not images:
+        queue.ack(*[msg_id for msg_id, _ in batch])
+        return
+    start = time.time()
+    all_boxes = detect_faces([image for _, image, _, _ in images])
+    duration = time.time() - start
+    metrics.observe("detect", duration, "detection")
+    metrics.inc("images_processed_total", len(images), service="detection")
+
+    detections = []
+    for (image_hash, _, scale, original_shape), boxes in zip(images, all_boxes):
+        detections.append((image_hash, scale_boxes(boxes, scale), original_shape, spans[image_hash].traceparent,
+                           tasks[image_hash]))
+        logger.log_info("[DETECT] Detected %s face(s) in image %s", len(boxes), image_hash, image_hash=image_hash)
+    publish_faces(detections)
+    queue.ack(*[msg_id for msg_id, _ in batch])
+    for (image_hash, *_), boxes in zip(images, all_boxes):
+        spans[image_hash].end(batch_size=len(images), faces=len(boxes))
+    logger.log_info("[DETECT] Ran detector on batch of %s image(s) in %.2fs", len(images), duration)
+
+def main():
+    logger.log_info("[DETECT] Face Detection Service started (batch size %s, wait %s ms)", BATCH_SIZE, BATCH_WAIT_MS)
+    metrics.add_queue_collector(r, {s: "detection" for s in lane_streams(DETECT_QUEUE)})
+    metrics.start_metrics_server(METRICS_PORT)
+    profiling.install("detection")
+    get_detector().warmup()
+    while True:
+        try:
+            batch, waited = collect_batch()
+            if not batch:
+                continue
+            logger.log_info("[DETECT] Collected batch of %s task(s) after %.0f ms", len(batch), waited * 1000)
+            metrics.observe("batch_wait", waited, "detection")
+            metrics.registry.histogram("detect_batch_size", service="detection").observe(len(batch))
+            process_batch(batch)
+        except Exception as e:
+            logger.log_error("[DETECT] Main loop error: %s", e)
+            time.sleep(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+# bulk ingestion CLI: python ingest_service.py <dir | archive.tar[.gz] | archive.zip | -> ...
+import argparse
+import os
+import time
+import redis
+
+from utils import logger
+from utils.ingest import Ingester, iter_source
+from utils.task_queue import BULK_LANE, LANES
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
+
+def main():
+    parser = argparse.ArgumentParser(description="Enqueue images in bulk for face analysis")
+    parser.add_argument("sources", nargs="+", help="directories, tar/zip archives, or - for a tar stream on stdin")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("INGEST_BATCH_SIZE", 100)))
+    parser.add_argument("--max-queue-depth", type=int, default=int(os.getenv("INGEST_MAX_QUEUE_DEPTH", 5000)),
+                        help="pause while the lane's detection stream holds more entries than this")
+    parser.add_argument("--lane", choices=LANES, default=BULK_LANE, help="priority lane for the ingested images")
+    args = parser.parse_args()
+
+    r = redis.Redis.from_url(REDIS_URL)
+    ingester = Ingester(r, batch_size=args.batch_size, max_queue_depth=args.max_queue_depth, lane=args.lane)
+    start = time.time()
+    for source in args.sources:
+        logger.log_info("[INGEST] Ingesting %s", source)
+        ingester.ingest(iter_source(source))
+    duration = time.time() - start
+    stats = ingester.stats
+    logger.log_info("[INGEST] Done in %.1fs (%.0f images/s): %s", duration, stats['seen'] / max(duration, 1e-9), stats)
+
+if __name__ == "__main__":
+    main()
@@ -6,8 +6,16 @@ import time
 
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-from utils.logger import log_info
+METRICS_PORT = int(os.getenv("INPUT_METRICS_PORT", 9100))
+from utils import metrics
+from utils import tracing
+from utils.blob_lifecycle import BlobLifecycle
+from utils.logger import log_info, log_warning
+from utils.result_cache import ResultCache
+from utils.task_queue import INTERACTIVE_LANE, admit, lane_streams, publish
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+result_cache = ResultCache(r)
+blobs = BlobLifecycle(r)
 
 def get_image_hash(image_bytes):
     return hashlib.md5(image_bytes).hexdigest()
@@ -20,23 +28,52 @@ def upload_image(image):
     image_bytes = buf.getvalue()
 
     image_hash = get_image_hash(image_bytes)
+    span = tracing.Span("upload", "input", image_hash=image_hash)
 
-    # Store original image
-    r.set(f"image:{image_hash}", image_bytes)
-    r.set(f"image:result:{image_hash}", image_bytes)
-    r.lpush("task:landmark", image_hash) 
-    r.lpush("task:agegender", image_hash)
+    cached_path = result_cache.lookup(image_hash)
+    if cached_path:
+        log_info("[UPLOAD] Cache hit for %s — result: %s", image_hash, cached_path, image_hash=image_hash)
+        return f"already processed key: {image_hash}, result: {cached_path}"
+    if not result_cache.begin(image_hash):
+        log_info("[UPLOAD] %s is already being processed — attached to running job", image_hash, image_hash=image_hash)
+        return f"already processing key: {image_hash}"
 
-    log_info(f"[UPLOAD] Image uploaded — hash: {image_hash}, redis_key: image:{image_hash}")
-    return f"sent for processing key: {image_hash}"
+    # admission control: move to a lower lane, or turn the upload away, while the queues are backed up
+    with metrics.timed("redis_io", "input"):
+        lane = admit(r, "task:detect", INTERACTIVE_LANE)
+    if lane is None:
+        result_cache.abort(image_hash)
+        span.end(error="rejected")
+        log_warning("[UPLOAD] Rejected %s — detection queue is overloaded", image_hash, image_hash=image_hash)
+        return f"rejected key: {image_hash}, the pipeline is overloaded — try again later"
+
+    # Store original image, held until landmark, agegender and storage have all released it
+    pipe = r.pipeline()
+    blobs.store(image_hash, image_bytes, pipe=pipe)
+    if lane != INTERACTIVE_LANE:
+        result_cache.extend(image_hash, lane, pipe=pipe)
+    publish(pipe, "task:detect", {"image_hash": image_hash, "traceparent": span.traceparent}, lane=lane)
+    with metrics.timed("redis_io", "input"):
+        pipe.execute()
+    metrics.inc("uploads_total", service="input")
+    span.end()
+
+    log_info("[UPLOAD] Image uploaded — hash: %s, redis_key: image:%s, lane: %s", image_hash, image_hash, lane, image_hash=image_hash)
+    return f"sent for processing key: {image_hash}" + ("" if lane == INTERACTIVE_LANE else f" (queued as {lane})")
 
 def main():
+    metrics.add_queue_collector(r, {s: group for stream, group in (("task:detect", "detection"), ("task:landmark", "landmark"),
+                                                                    ("task:agegender", "agegender")) for s in lane_streams(stream)})
+    metrics.start_metrics_server(METRICS_PORT)
     with gr.Blocks() as demo:
         gr.Markdown("Face Attributes Aggregator System --- Input Service")
         image_input = gr.Image(type="pil")
         output_text = gr.Textbox(label="Status")
+        cache_stats = gr.JSON(label="Result cache")
 
-        image_input.upload(fn=upload_image, inputs=image_input, outputs=output_text)
+        image_input.upload(fn=upload_image, inputs=image_input, outputs=output_text).then(
+            fn=result_cache.stats, outputs=cache_stats
+        )
 
     demo.launch()
 
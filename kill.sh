@@ -5,6 +5,9 @@
 echo "[INFO] Stopping input_service..."
 pkill -f input_service.py || echo "input_service not running"
 
+echo "[INFO] Stopping detection_service..."
+pkill -f detection_service.py || echo "detection_service not running"
+
 echo "[INFO] Stopping landmark_service..."
 pkill -f landmark_service.py || echo "landmark_service not running"
 
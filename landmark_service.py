@@ -1,110 +1,164 @@
 import redis
-import cv2
 import numpy as np
 import time
 import os
-from ultralytics import YOLO
-import mediapipe as mp
-import json
+import argparse
 import grpc
 from datetime import datetime
 
 from utils import aggregator_pb2
 from utils import aggregator_pb2_grpc
 from utils import logger
+from utils import inference
+from utils import metrics
+from utils import profiling
+from utils import tracing
+from utils.blob_lifecycle import BlobLifecycle
+from utils.face_task import decode_for_crops, iter_crops
+from utils.landmarks import project_landmarks
+from utils.result_codec import encode_result
+from utils.task_queue import LaneQueue, lane_streams
+from utils.worker_pool import WorkerPool, supervise
 
 # Config
 REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379")
 GRPC_ADDRESS = os.getenv("GRPC_ADDRESS", "localhost:50051")
+NUM_WORKERS = int(os.getenv("LANDMARK_WORKERS", 0))
+CROP_MIN_SIDE = int(os.getenv("LANDMARK_CROP_MIN_SIDE", 192))  # FaceMesh input size
+METRICS_PORT = int(os.getenv("LANDMARK_METRICS_PORT", 9102))
 
 r = redis.Redis.from_url(REDIS_URL)
-face_detector = YOLO("model.pt").to("cpu")
-mp_face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1)
+queue = LaneQueue(r, "task:landmark", "landmark", holder="landmark")
+blobs = BlobLifecycle(r)
+landmarker = None
 
-def get_faces(image):
-    results = face_detector(image)[0]
-    boxes = results.boxes.xyxy.cpu().numpy().astype(int)
-    return boxes
+def get_landmarker():
+    # built on first use so a supervisor parent never loads the model itself
+    global landmarker
+    if landmarker is None:
+        landmarker = inference.load_landmarker()
+    return landmarker
 
 def get_landmarks(face_img):
-    results = mp_face_mesh.process(cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB))
-    if results.multi_face_landmarks:
-        return results.multi_face_landmarks[0].landmark
-    return None
+    return get_landmarker().landmarks(face_img)
 
-def send_to_storage(image_bytes, redis_key, metadata_dict):
+def warm_up():
+    get_landmarker().warmup()
+
+def send_to_storage(image_hash, redis_key, metadata_dict, traceparent=None):
+    # only the hash and our part travel; storage fetches the image from the blob store
     try:
-        r.set(redis_key, json.dumps(metadata_dict))
         with grpc.insecure_channel(GRPC_ADDRESS) as channel:
             stub = aggregator_pb2_grpc.AggregatorStub(channel)
             request = aggregator_pb2.FaceResult(
                 time=datetime.utcnow().isoformat(),
-                frame=image_bytes,
-                redis_key=redis_key
+                redis_key=redis_key,
+                image_hash=image_hash,
+                part_type="landmarks",
+                payload=encode_result(metadata_dict)
             )
-            response = stub.SaveFaceAttributes(request)
+            with metrics.timed("grpc_send", "landmark"):
+                response = stub.SaveFaceAttributes(request, metadata=tracing.grpc_metadata(traceparent))
             if response.response:
-                logger.log_info(f"[LANDMARK] Data sent to storage for key {redis_key}")
+                logger.log_info("[LANDMARK] Data sent to storage for key %s", redis_key, image_hash=image_hash)
             else:
-                logger.log_warning(f"[LANDMARK] Storage service responded with failure for key {redis_key}")
+                logger.log_warning("[LANDMARK] Storage service responded with failure for key %s", redis_key, image_hash=image_hash)
+            return response.response
     except Exception as e:
-        logger.log_error(f"[LANDMARK] Failed to send to storage: {e}")
+        logger.log_error("[LANDMARK] Failed to send to storage: %s", e)
+        return False
 
-def main_loop():
-    logger.log_info("[LANDMARK] Landmark Detection Service started")
-    while True:
-        try:
-            key = r.rpop("task:landmark")
-            if not key:
-                time.sleep(0.5)
+def extract_landmarks(image, faces, key, scale=1.0):
+    # also the worker-process entry point for supervisor mode
+    found = []
+    normalized = []
+    with metrics.timed("mesh", "landmark"):
+        for face, face_crop in iter_crops(image, faces, scale):
+            landmarks = get_landmarks(face_crop)
+            if landmarks is None:
+                logger.log_warning("[LANDMARK] No landmarks found for face %s in image %s", face['face_index'], key, image_hash=key)
                 continue
+            found.append(face)
+            normalized.append(landmarks)
+    if not found:
+        return []
 
-            key = key.decode()
-            logger.log_info(f"[LANDMARK] Processing image with hash: {key}")
-            image_bytes = r.get(f"image:{key}")
-            if not image_bytes:
-                logger.log_warning(f"[LANDMARK] Image not found in Redis for key: {key}")
-                continue
+    # project every face back to image coordinates in one go: (N, 468, 2) int32
+    crops = [[f["crop"][k] for k in ("x1", "y1", "x2", "y2")] for f in found]
+    abs_landmarks = project_landmarks(np.stack(normalized), crops)
+    return [
+        {"face_index": face["face_index"], "box": face["box"], "landmarks": points}
+        for face, points in zip(found, abs_landmarks)
+    ]
 
-            image_np = np.frombuffer(image_bytes, np.uint8)
-            image = cv2.imdecode(image_np, cv2.IMREAD_COLOR)
-            face_boxes = get_faces(image)
-            all_faces_data = []
-
-            for idx, (x1, y1, x2, y2) in enumerate(face_boxes):
-                face_crop = image[y1:y2, x1:x2]
-                landmarks = get_landmarks(face_crop)
-                if not landmarks:
-                    logger.log_warning(f"[LANDMARK] No landmarks found for face {idx} in image {key}")
-                    continue
-                abs_landmarks = [
-                    {"x": int(lm.x * (x2 - x1) + x1), "y": int(lm.y * (y2 - y1) + y1)}
-                    for lm in landmarks
-                ]
-                all_faces_data.append({
-                    "face_index": idx,
-                    "box": {"x1": int(x1), "y1": int(y1), "x2": int(x2), "y2": int(y2)},
-                    "landmarks": abs_landmarks
-                })
-
-            if not all_faces_data:
-                logger.log_warning(f"[LANDMARK] No faces with landmarks found in image {key}")
-                continue
+def fetch_image(task):
+    with metrics.timed("redis_io", "landmark"):
+        image_bytes = r.get(f"image:{task['image_hash']}")
+    if not image_bytes:
+        logger.log_warning("[LANDMARK] Image not found in Redis for key: %s", task['image_hash'], image_hash=task['image_hash'])
+    return image_bytes
 
-            redis_key = f"combined:{key}:landmarks"
-            metadata = {
-                "num_faces": len(all_faces_data),
-                "faces": all_faces_data
-            }
+def finish_task(task, image_bytes, all_faces_data):
+    # returns True once the task is finished and may be acked; an empty part is sent too,
+    # so storage still merges, saves and caches images without faces
+    key = task["image_hash"]
+    if not all_faces_data:
+        logger.log_warning("[LANDMARK] No faces with landmarks found in image %s", key, image_hash=key)
 
-            logger.log_info(f"[LANDMARK] Found {len(all_faces_data)} face(s) in image {key}")
-            send_to_storage(image_bytes, redis_key, metadata)
-            r.delete(f"image:{key}")
-            logger.log_info(f"[LANDMARK] Deleted image:{key} from Redis after processing")
+    redis_key = f"combined:{key}:landmarks"
+    metadata = {
+        "num_faces": len(all_faces_data),
+        "faces": all_faces_data
+    }
 
+    logger.log_info("[LANDMARK] Found %s face(s) in image %s", len(all_faces_data), key, image_hash=key)
+    if not send_to_storage(key, redis_key, metadata, task.get("traceparent")):
+        return False
+    left = blobs.release(key, "landmark")
+    logger.log_info("[LANDMARK] Released image:%s (%s holder(s) left)", key, max(left, 0), image_hash=key)
+    return True
+
+def process_task(task):
+    logger.log_info("[LANDMARK] Processing image with hash: %s", task['image_hash'], image_hash=task['image_hash'])
+    with tracing.span("landmark", "landmark", task.get("traceparent"), image_hash=task["image_hash"]) as span:
+        task["traceparent"] = span.traceparent
+        image_bytes = fetch_image(task)
+        if not image_bytes:
+            return True
+        with metrics.timed("decode", "landmark"):
+            image, scale = decode_for_crops(image_bytes, task["faces"], CROP_MIN_SIDE)
+        all_faces_data = extract_landmarks(image, task["faces"], task["image_hash"], scale)
+        metrics.inc("images_processed_total", service="landmark")
+        metrics.inc("faces_processed_total", len(all_faces_data), service="landmark")
+        span.attrs["faces"] = len(all_faces_data)
+        return finish_task(task, image_bytes, all_faces_data)
+
+def main_loop():
+    logger.log_info("[LANDMARK] Landmark Detection Service started")
+    while True:
+        try:
+            for msg_id, task in queue.read(count=1, block_ms=5000):
+                if process_task(task):
+                    queue.ack(msg_id)
         except Exception as e:
-            logger.log_error(f"[LANDMARK] Unexpected error: {e}")
+            logger.log_error("[LANDMARK] Unexpected error: %s", e)
             time.sleep(1)
 
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=NUM_WORKERS,
+                        help="run as a supervisor over this many worker processes (0 = single process)")
+    args = parser.parse_args()
+    metrics.add_queue_collector(r, {s: "landmark" for s in lane_streams("task:landmark")})
+    metrics.start_metrics_server(METRICS_PORT)
+    profiling.install("landmark")
+    if args.workers > 0:
+        logger.log_info("[LANDMARK] Landmark Detection Service started with %s worker process(es)", args.workers)
+        supervise(WorkerPool("LANDMARK", args.workers, extract_landmarks, init=warm_up), queue, fetch_image, finish_task,
+                  stage="landmark", crop_min_side=CROP_MIN_SIDE)
+    else:
+        warm_up()
+        main_loop()
+
 if __name__ == "__main__":
-    main_loop()
+    main()
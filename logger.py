@@ -1,26 +1,2 @@
-import logging
-import os
-from datetime import datetime
-
-LOG_DIR = "logs"
-os.makedirs(LOG_DIR, exist_ok=True)
-
-log_path = os.path.join(LOG_DIR, f"log_{datetime.now().strftime('%Y-%m-%d')}.log")
-
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(log_path),
-        logging.StreamHandler()
-    ]
-)
-
-def log_info(msg):
-    logging.info(msg)
-
-def log_error(msg):
-    logging.error(msg)
-
-def log_warning(msg):
-    logging.warning(msg)
+# kept for old imports; the logging setup lives in utils/logger.py
+from utils.logger import *  # noqa: F401,F403
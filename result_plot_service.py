@@ -1,37 +1,49 @@
-# these service reads all images and corresponding JSON data for plot and show results in a gradio app 
+# this service pages through the results index and shows the annotated images in a gradio app
 import os
-import json
+from collections import OrderedDict
 import cv2
+import numpy as np
 import gradio as gr
 
-DATA_DIR = "./saved_data"
+from utils.landmarks import draw_landmarks
+from utils.result_codec import decode_result, load_result
+from utils.results_index import ResultsIndex
+from utils.segment_store import SEGMENT_DIR, SegmentStore, is_segment_path, segment_name
 
-def load_all_pairs():
-    files = sorted(os.listdir(DATA_DIR))
-    json_files = [f for f in files if f.endswith(".json")]
-    pairs = []
-    for json_file in json_files:
-        image_file = json_file.replace(".json", ".jpg")
-        json_path = os.path.join(DATA_DIR, json_file)
-        image_path = os.path.join(DATA_DIR, image_file)
-        if os.path.exists(image_path):
-            pairs.append((json_path, image_path))
-    return pairs
+DATA_DIR = "./saved_data"
+CACHE_DIR = os.getenv("VIEWER_CACHE_DIR", os.path.join(DATA_DIR, "annotated"))
+CACHE_ENTRIES = int(os.getenv("VIEWER_CACHE_ENTRIES", 64))
+MAX_SIDE = int(os.getenv("VIEWER_MAX_SIDE", 1280))
 
-pairs = load_all_pairs()
+index = ResultsIndex(DATA_DIR)
+segments = SegmentStore(SEGMENT_DIR, readonly=True) if os.path.isdir(SEGMENT_DIR) else None
+if index.count() == 0:
+    # results saved before the index existed
+    index.rebuild(segments)
+os.makedirs(CACHE_DIR, exist_ok=True)
+annotated = OrderedDict()  # image_hash -> RGB array, most recently shown last
 
-def draw_faces(index):
-    if index >= len(pairs):
-        return None, f"✅ Done! {index} images processed.", index
+def load_row(row):
+    # image and decoded result, from flat files or from the segment store
+    if not is_segment_path(row["result_path"]):
+        return cv2.imread(row["image_path"]), load_result(row["result_path"], arrays=True)
+    raw = segments.get(f"{row['image_hash']}.jpg") if segments else None
+    if raw is None:
+        return None, None
+    image = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+    return image, decode_result(segments.get(segment_name(row["result_path"])), arrays=True)
 
-    json_path, image_path = pairs[index]
+def result_mtime(row):
+    if is_segment_path(row["result_path"]):
+        return (segments.mtime(segment_name(row["result_path"])) if segments else None) or 0
+    return os.path.getmtime(row["result_path"])
 
-    image = cv2.imread(image_path)
+def annotate(row):
+    image, data = load_row(row)
     if image is None:
-        return None, f"[!] Failed to load {image_path}", index
+        return None
 
-    with open(json_path, 'r') as f:
-        data = json.load(f)
+    all_landmarks = []
 
     for face in data.get("faces", []):
         box = face.get("box", {})
@@ -46,21 +58,106 @@ def draw_faces(index):
         cv2.putText(image, label, (x1, y1 - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 0), 2)
 
-        # Draw landmarks
-        for pt in face.get("landmarks", []):
-            x, y = pt.get("x"), pt.get("y")
-            cv2.circle(image, (x, y), 1, (0, 0, 255), -1)
+        if face.get("landmarks") is not None:
+            all_landmarks.append(face["landmarks"])
+
+    # Draw landmarks of all faces in one pass
+    if all_landmarks:
+        draw_landmarks(image, np.concatenate(all_landmarks), (0, 0, 255))
 
+    scale = MAX_SIDE / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return image
+
+def load_annotated(row):
+    # memory LRU, then the on-disk cache of annotated, downscaled images, then draw from scratch
+    image_hash = row["image_hash"]
+    if image_hash in annotated:
+        annotated.move_to_end(image_hash)
+        return annotated[image_hash]
+    cache_path = os.path.join(CACHE_DIR, f"{image_hash}.jpg")
+    image = None
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= result_mtime(row):
+        image = cv2.imread(cache_path)
+    if image is None:
+        image = annotate(row)
+        if image is None:
+            return None
+        cv2.imwrite(cache_path, image)
     image_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-    return image_rgb, f"Image {index+1}/{len(pairs)}: {os.path.basename(image_path)}", index + 1
+    annotated[image_hash] = image_rgb
+    while len(annotated) > CACHE_ENTRIES:
+        annotated.popitem(last=False)
+    return image_rgb
+
+def optional_int(value):
+    return None if value is None or value == "" else int(value)
+
+def build_filters(since, until, min_faces, max_faces, min_age, max_age, gender):
+    return {
+        "since": since or None,
+        "until": until or None,
+        "min_faces": optional_int(min_faces),
+        "max_faces": optional_int(max_faces),
+        "min_age": optional_int(min_age),
+        "max_age": optional_int(max_age),
+        "gender": None if gender in (None, "", "any") else gender,
+    }
+
+FIRST = {"position": 0, "key": None}  # nothing shown yet
+
+def draw_faces(state, *filter_values, backwards=False):
+    # state: 1-based position and (timestamp, image_hash) of the image on screen; the next or
+    # previous image is looked up from that key, not by offset
+    if backwards and state["key"] is None:
+        return draw_faces(FIRST, *filter_values)
+    filters = build_filters(*filter_values)
+    total = index.count(**filters)
+    rows = index.query(after=state["key"], limit=1, newest_first=not backwards, **filters)
+    if not rows:
+        if backwards:  # already at the first image
+            return draw_faces(FIRST, *filter_values)
+        return None, f"✅ Done! {total} matching image(s).", state
+    row = rows[0]
+    position = state["position"] - 1 if backwards else state["position"] + 1
+    state = {"position": position, "key": (row["timestamp"], row["image_hash"])}
+
+    image_rgb = load_annotated(row)
+    if image_rgb is None:
+        return None, f"[!] Failed to load {row['image_path']}", state
+    label = f"Image {position}/{total}: {os.path.basename(row['image_path'])} ({row['timestamp']}, {row['num_faces']} face(s))"
+    return image_rgb, label, state
+
+def show_previous(state, *filter_values):
+    return draw_faces(state, *filter_values, backwards=True)
+
+def apply_filters(state, *filter_values):
+    return draw_faces(FIRST, *filter_values)
 
 with gr.Blocks() as demo:
     gr.Markdown("##  Results Visualization")
     image_display = gr.Image(type="numpy", label="Annotated Image")
     label_display = gr.Textbox(label="Info")
-    next_button = gr.Button("Next")
-    counter = gr.State(0)
+    with gr.Row():
+        since = gr.Textbox(label="From (ISO time)")
+        until = gr.Textbox(label="To (ISO time)")
+        gender = gr.Dropdown(["any", "man", "woman"], value="any", label="Gender")
+    with gr.Row():
+        min_faces = gr.Number(label="Min faces", precision=0)
+        max_faces = gr.Number(label="Max faces", precision=0)
+        min_age = gr.Number(label="Min age", precision=0)
+        max_age = gr.Number(label="Max age", precision=0)
+    with gr.Row():
+        filter_button = gr.Button("Apply filters")
+        prev_button = gr.Button("Previous")
+        next_button = gr.Button("Next")
+    counter = gr.State(FIRST)
 
-    next_button.click(fn=draw_faces, inputs=counter, outputs=[image_display, label_display, counter])
+    inputs = [counter, since, until, min_faces, max_faces, min_age, max_age, gender]
+    outputs = [image_display, label_display, counter]
+    filter_button.click(fn=apply_filters, inputs=inputs, outputs=outputs)
+    prev_button.click(fn=show_previous, inputs=inputs, outputs=outputs)
+    next_button.click(fn=draw_faces, inputs=inputs, outputs=outputs)
 
 demo.launch()
\ No newline at end of file
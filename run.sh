@@ -21,6 +21,9 @@ mkdir -p logs
 echo "[INFO] Starting input_service..."
 nohup python input_service.py > logs/input.log 2>&1 &
 
+echo "[INFO] Starting detection_service..."
+nohup python detection_service.py > logs/detection.log 2>&1 &
+
 echo "[INFO] Starting landmark_service..."
 nohup python landmark_service.py > logs/landmark.log 2>&1 &
 
@@ -1,107 +1,305 @@
 import grpc
 from concurrent import futures
+import argparse
+import asyncio
+import threading
+import time
 import redis
 import os
-import json
 from datetime import datetime
 
 from utils import aggregator_pb2
 from utils import aggregator_pb2_grpc
 from utils import logger
+from utils import metrics
+from utils import profiling
+from utils import tracing
+from utils.blob_lifecycle import BlobLifecycle, collect_orphans, memory_report
+from utils.blob_store import DiskBlobStore, RedisBlobStore
+from utils.disk_writer import DiskWriter
+from utils.merge import AsyncMergeEngine, MergeEngine, join_faces, part_keys
+from utils.result_cache import ResultCache
+from utils.result_codec import decode_result, encode_result, result_extension
+from utils.results_index import ResultsIndex
+from utils.segment_store import SegmentBlobStore, SegmentStore
 
 # Config
 REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
 SAVE_DIR = "saved_data"
+USE_AIO = os.getenv("STORAGE_ASYNC", "0") == "1"
+WRITER_THREADS = int(os.getenv("STORAGE_WRITER_THREADS", 2))
+WRITER_MAX_PENDING = int(os.getenv("STORAGE_WRITER_MAX_PENDING", 1000))
+WRITER_FSYNC = os.getenv("STORAGE_WRITER_FSYNC", "0") == "1"
+GC_INTERVAL_SEC = int(os.getenv("STORAGE_GC_INTERVAL_SEC", 600))
+STORAGE_ENGINE = os.getenv("STORAGE_ENGINE", "files")  # files | segments
+METRICS_PORT = int(os.getenv("STORAGE_METRICS_PORT", 9104))
 os.makedirs(SAVE_DIR, exist_ok=True)
 
 # Redis connection
 r = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+redis_blobs = RedisBlobStore(r, prefix="image:")
+blobs = BlobLifecycle(r)
+segments = SegmentStore() if STORAGE_ENGINE == "segments" else None
+disk_blobs = SegmentBlobStore(segments, suffix=".jpg") if segments else DiskBlobStore(SAVE_DIR, suffix=".jpg")
+merger = MergeEngine(r)
+result_cache = ResultCache(r, SAVE_DIR)
+results_index = ResultsIndex(SAVE_DIR)
+
+def build_final_data(image_hash, timestamp, parts):
+    # Decode parts
+    try:
+        landmarks_data = decode_result(parts[0], arrays=True)
+        agegender_data = decode_result(parts[1], arrays=True)
+    except Exception as e:
+        logger.log_error("[STORAGE] Result decode error: %s", e)
+        return None
+
+    # Merge face-wise
+    with metrics.timed("merge", "storage"):
+        merged_faces = join_faces(landmarks_data.get("faces", []), agegender_data.get("faces", []))
+    return {
+        "timestamp": timestamp,
+        # the flat layout path; with segments it exists once exported
+        "image_path": os.path.join(SAVE_DIR, f"{image_hash}.jpg"),
+        "redis_key": f"image:{image_hash}",
+        "num_faces": len(merged_faces),
+        "faces": merged_faces
+    }
+
+def write_result(image_hash, raw):
+    name = f"{image_hash}{result_extension()}"
+    if segments:
+        return segments.put(name, raw)
+    json_path = os.path.join(SAVE_DIR, name)
+    with open(json_path, "wb") as f:
+        f.write(raw)
+    return json_path
+
+def save_merged(image_hash, timestamp, parts, frame=b""):
+    final_data = build_final_data(image_hash, timestamp, parts)
+    if final_data is None:
+        return False
+
+    # Save image once per content hash
+    if not disk_blobs.exists(image_hash):
+        with metrics.timed("redis_io", "storage"):
+            image_bytes = frame or redis_blobs.get(image_hash)
+        if image_bytes is None:
+            logger.log_error("[STORAGE] Image blob not found for %s", image_hash, image_hash=image_hash)
+            return False
+        with metrics.timed("disk_write", "storage"):
+            disk_blobs.put(image_hash, image_bytes)
+    blobs.release(image_hash, "storage")
+
+    # Save final result (JSON unless RESULT_FORMAT selects the binary container)
+    with metrics.timed("disk_write", "storage"):
+        json_path = write_result(image_hash, encode_result(final_data))
+    result_cache.mark_done(image_hash, json_path)
+    results_index.add(image_hash, final_data, json_path)
+
+    logger.log_info("[STORAGE] Merged data for image %s saved to %s", image_hash, json_path, image_hash=image_hash)
+    return True
 
 class AggregatorService(aggregator_pb2_grpc.AggregatorServicer):
     def SaveFaceAttributes(self, request, context):
+        with metrics.in_flight("storage"), metrics.timed("rpc", "storage"), \
+                tracing.span("save", "storage", tracing.from_grpc_context(context),
+                             image_hash=request.image_hash, part=request.part_type):
+            return self._save(request)
+
+    def _save(self, request):
         try:
             redis_key = request.redis_key
             if not redis_key.startswith("combined:"):
-                logger.log_warning(f"[STORAGE] Invalid redis_key format: {redis_key}")
+                logger.log_warning("[STORAGE] Invalid redis_key format: %s", redis_key, image_hash=request.image_hash)
                 return aggregator_pb2.FaceResultResponse(response=False)
 
-            image_hash = redis_key.split(":")[1]
-            part_type = redis_key.split(":")[2]  # "landmarks" or "agegender"
-            image_bytes = request.frame
+            image_hash = request.image_hash or redis_key.split(":")[1]
+            part_type = request.part_type or redis_key.split(":")[2]  # "landmarks" or "agegender"
             timestamp = request.time or datetime.utcnow().isoformat()
 
-            # Save part to temporary merged Redis keys
-            incoming_data_raw = r.get(redis_key)
+            # Save part to temporary merged Redis keys; older clients left it in redis_key
+            incoming_data_raw = request.payload or r.get(redis_key)
             if incoming_data_raw is None:
-                logger.log_error(f"[STORAGE] Redis key not found: {redis_key}")
+                logger.log_error("[STORAGE] Redis key not found: %s", redis_key, image_hash=image_hash)
                 return aggregator_pb2.FaceResultResponse(response=False)
 
-            r.set(f"merged:{image_hash}:{part_type}", incoming_data_raw)
-            logger.log_info(f"[STORAGE] Received {part_type} data for image {image_hash}")
-
-            # Check if both parts are ready
-            part1 = r.get(f"merged:{image_hash}:landmarks")
-            part2 = r.get(f"merged:{image_hash}:agegender")
+            with metrics.timed("merge", "storage"):
+                parts = merger.record_part(image_hash, part_type, incoming_data_raw)
+            metrics.inc("parts_received_total", service="storage", part=part_type)
+            logger.log_info("[STORAGE] Received %s data for image %s", part_type, image_hash, image_hash=image_hash)
 
-            if not (part1 and part2):
-                logger.log_info(f"[STORAGE] Only one part available for image {image_hash} — waiting...")
+            if parts is None:
+                logger.log_info("[STORAGE] Only one part available for image %s — waiting...", image_hash, image_hash=image_hash)
                 return aggregator_pb2.FaceResultResponse(response=True)
 
-            # Decode parts
             try:
-                landmarks_data = json.loads(part1.decode())
-                agegender_data = json.loads(part2.decode())
-            except Exception as e:
-                logger.log_error(f"[STORAGE] JSON decode error: {e}")
+                saved = save_merged(image_hash, timestamp, parts, request.frame)
+            except Exception:
+                merger.release(image_hash)
+                raise
+            if not saved:
+                merger.release(image_hash)
                 return aggregator_pb2.FaceResultResponse(response=False)
 
-            # Merge face-wise
-            merged_faces = []
-            for l_face in landmarks_data.get("faces", []):
-                face_index = l_face.get("face_index")
-                match = next(
-                    (f for f in agegender_data.get("faces", []) if f.get("face_index") == face_index),
-                    {}
-                )
-                merged_faces.append({
-                    "face_index": face_index,
-                    "box": l_face.get("box"),
-                    "landmarks": l_face.get("landmarks"),
-                    "agegender": match.get("agegender", {})
-                })
-
-            # Save image
-            image_path = os.path.join(SAVE_DIR, f"{image_hash}.jpg")
-            with open(image_path, "wb") as f:
-                f.write(image_bytes)
-
-            # Save final JSON
-            final_data = {
-                "timestamp": timestamp,
-                "image_path": image_path,
-                "redis_key": f"image:{image_hash}",
-                "num_faces": len(merged_faces),
-                "faces": merged_faces
-            }
-
-            json_path = os.path.join(SAVE_DIR, f"{image_hash}.json")
-            with open(json_path, "w") as f:
-                json.dump(final_data, f, indent=2)
-
-            logger.log_info(f"[STORAGE] Merged data for image {image_hash} saved to {json_path}")
-
             # Cleanup
-            r.delete(f"merged:{image_hash}:landmarks")
-            r.delete(f"merged:{image_hash}:agegender")
+            merger.complete(image_hash)
+
+            return aggregator_pb2.FaceResultResponse(response=True)
+
+        except Exception as e:
+            logger.log_error("[STORAGE] Exception in SaveFaceAttributes: %s", e)
+            return aggregator_pb2.FaceResultResponse(response=False)
+
+class AsyncAggregatorService(aggregator_pb2_grpc.AggregatorServicer):
+    # grpc.aio variant: the RPC returns once the merged document is stored in Redis,
+    # the .jpg/.json files are written afterwards by the DiskWriter pool
+    def __init__(self, ar, writer):
+        self.ar = ar
+        self.writer = writer
+        self.merger = AsyncMergeEngine(ar)
+
+    async def SaveFaceAttributes(self, request, context):
+        with metrics.in_flight("storage"), metrics.timed("rpc", "storage"), \
+                tracing.span("save", "storage", tracing.from_grpc_context(context),
+                             image_hash=request.image_hash, part=request.part_type):
+            return await self._save(request)
+
+    async def _save(self, request):
+        try:
+            redis_key = request.redis_key
+            if not redis_key.startswith("combined:"):
+                logger.log_warning("[STORAGE] Invalid redis_key format: %s", redis_key, image_hash=request.image_hash)
+                return aggregator_pb2.FaceResultResponse(response=False)
+
+            image_hash = request.image_hash or redis_key.split(":")[1]
+            part_type = request.part_type or redis_key.split(":")[2]  # "landmarks" or "agegender"
+            timestamp = request.time or datetime.utcnow().isoformat()
 
+            incoming_data_raw = request.payload or await self.ar.get(redis_key)
+            if incoming_data_raw is None:
+                logger.log_error("[STORAGE] Redis key not found: %s", redis_key, image_hash=image_hash)
+                return aggregator_pb2.FaceResultResponse(response=False)
+
+            with metrics.timed("merge", "storage"):
+                parts = await self.merger.record_part(image_hash, part_type, incoming_data_raw)
+            metrics.inc("parts_received_total", service="storage", part=part_type)
+            logger.log_info("[STORAGE] Received %s data for image %s", part_type, image_hash, image_hash=image_hash)
+
+            if parts is None:
+                logger.log_info("[STORAGE] Only one part available for image %s — waiting...", image_hash, image_hash=image_hash)
+                return aggregator_pb2.FaceResultResponse(response=True)
+
+            final_data = build_final_data(image_hash, timestamp, parts)
+            image_bytes = None
+            if final_data is not None and not disk_blobs.exists(image_hash):
+                with metrics.timed("redis_io", "storage"):
+                    image_bytes = request.frame or await redis_blobs_async(self.ar, image_hash)
+                if image_bytes is None:
+                    logger.log_error("[STORAGE] Image blob not found for %s", image_hash, image_hash=image_hash)
+                    final_data = None
+            if final_data is None:
+                await self.merger.release(image_hash)
+                return aggregator_pb2.FaceResultResponse(response=False)
+
+            final_json = encode_result(final_data)
+            await self.ar.set(f"merged:{image_hash}:final", final_json, ex=blobs.ttl_sec)
+            await asyncio.get_running_loop().run_in_executor(
+                None, persist_merged, self.writer, image_hash, image_bytes, final_json, final_data
+            )
             return aggregator_pb2.FaceResultResponse(response=True)
 
         except Exception as e:
-            logger.log_error(f"[STORAGE] Exception in SaveFaceAttributes: {e}")
+            logger.log_error("[STORAGE] Exception in SaveFaceAttributes: %s", e)
             return aggregator_pb2.FaceResultResponse(response=False)
 
+async def redis_blobs_async(ar, image_hash):
+    return await ar.get(redis_blobs.key(image_hash))
+
+def persist_merged(writer, image_hash, image_bytes, final_json, final_data=None):
+    # queue both files; the Redis copies are dropped once the JSON is on disk
+    def on_image_done(ok):
+        if ok:
+            blobs.release(image_hash, "storage")
+
+    if segments:
+        # appends are cheap enough to run here, on the executor thread, instead of the writer pool
+        if image_bytes is not None:
+            with metrics.timed("disk_write", "storage"):
+                disk_blobs.put(image_hash, image_bytes)
+        blobs.release(image_hash, "storage")
+        with metrics.timed("disk_write", "storage"):
+            json_path = write_result(image_hash, final_json)
+        on_result_done(image_hash, json_path, final_json, final_data)
+        return
+
+    if image_bytes is not None:
+        writer.submit(disk_blobs.path(image_hash), image_bytes, skip_existing=True, on_done=on_image_done)
+    else:
+        blobs.release(image_hash, "storage")
+    json_path = os.path.join(SAVE_DIR, f"{image_hash}{result_extension()}")
+
+    def on_done(ok):
+        if ok:
+            on_result_done(image_hash, json_path, final_json, final_data)
+
+    writer.submit(json_path, final_json, on_done=on_done)
+
+def on_result_done(image_hash, json_path, final_json, final_data=None):
+    r.delete(*part_keys(image_hash), f"merged:{image_hash}:final")
+    result_cache.mark_done(image_hash, json_path)
+    results_index.add(image_hash, final_data or decode_result(final_json), json_path)
+    logger.log_info("[STORAGE] Merged data for image %s saved to %s", image_hash, json_path, image_hash=image_hash)
+
+def recover_unwritten(writer):
+    # merges acknowledged before a restart but not yet written to disk
+    for key in r.scan_iter(match="merged:*:final"):
+        image_hash = key.decode().split(":")[1]
+        final_json = r.get(key)
+        if final_json is None:
+            continue
+        image_bytes = None if disk_blobs.exists(image_hash) else redis_blobs.get(image_hash)
+        persist_merged(writer, image_hash, image_bytes, final_json)
+        logger.log_info("[STORAGE] Re-queued unwritten result for image %s", image_hash, image_hash=image_hash)
+
+def gc_loop():
+    # ages out intermediates left behind by lost tasks and logs where Redis memory goes
+    while True:
+        try:
+            fixed = collect_orphans(r)
+            if fixed:
+                logger.log_warning("[STORAGE] Gave %s orphaned combined:/merged: key(s) a TTL", fixed)
+            report = memory_report(r)
+            summary = ", ".join(f"{p}{v['keys']} (~{v['approx_bytes'] // 1024} KiB)" for p, v in report["prefixes"].items())
+            logger.log_info("[STORAGE] Redis memory %s: %s", report.get('used_memory_human'), summary)
+            if segments:
+                removed, reclaimed = segments.compact()
+                if removed:
+                    logger.log_info("[STORAGE] Compacted %s segment(s), reclaimed %.1f MiB", removed, reclaimed / 1024 / 1024)
+        except Exception as e:
+            logger.log_error("[STORAGE] GC pass failed: %s", e)
+        time.sleep(GC_INTERVAL_SEC)
+
+def add_segment_collector():
+    if not segments:
+        return
+
+    def collect(reg):
+        stats = segments.stats()
+        reg.set_gauge("segment_store_bytes", stats["bytes"], state="total")
+        reg.set_gauge("segment_store_bytes", stats["live_bytes"], state="live")
+        reg.set_gauge("segment_store_segments", stats["segments"])
+    metrics.registry.add_collector(collect)
+
+def start_gc():
+    threading.Thread(target=gc_loop, daemon=True).start()
+
 def serve():
+    start_gc()
+    add_segment_collector()
+    metrics.start_metrics_server(METRICS_PORT)
+    profiling.install("storage")
     server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
     aggregator_pb2_grpc.add_AggregatorServicer_to_server(AggregatorService(), server)
     server.add_insecure_port('[::]:50051')
@@ -109,5 +307,32 @@ def serve():
     logger.log_info("[STORAGE] Storage Service running on port 50051")
     server.wait_for_termination()
 
+async def serve_async():
+    import redis.asyncio as aioredis
+    ar = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT, db=0)
+    writer = DiskWriter(threads=WRITER_THREADS, max_pending=WRITER_MAX_PENDING, fsync=WRITER_FSYNC)
+    recover_unwritten(writer)
+    start_gc()
+    add_segment_collector()
+    metrics.start_metrics_server(METRICS_PORT)
+    profiling.install("storage")
+    server = grpc.aio.server()
+    aggregator_pb2_grpc.add_AggregatorServicer_to_server(AsyncAggregatorService(ar, writer), server)
+    server.add_insecure_port('[::]:50051')
+    await server.start()
+    logger.log_info("[STORAGE] Async Storage Service running on port 50051")
+    try:
+        await server.wait_for_termination()
+    finally:
+        writer.close()
+        await ar.close()
+
 if __name__ == "__main__":
-    serve()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--aio", action="store_true", default=USE_AIO,
+                        help="serve with grpc.aio and background disk writes")
+    args = parser.parse_args()
+    if args.aio:
+        asyncio.run(serve_async())
+    else:
+        serve()
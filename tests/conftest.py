@@ -0,0 +1,26 @@
+import os
+import tempfile
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+# keep the suite's log files out of the checkout; set before any test imports utils.logger
+os.environ.setdefault("LOG_DIR", os.path.join(tempfile.gettempdir(), "face-pipeline-test-logs"))
+
+@pytest.fixture
+def stand_in_models():
+    # age: the brightest pixel of the letterboxed crop, in years; gender: "man" for bright crops.
+    # calls records the batch size of every age model call
+    calls = []
+
+    def age_model(batch):
+        calls.append(len(batch))
+        ages = np.zeros((len(batch), 101), dtype=np.float32)
+        ages[np.arange(len(batch)), np.rint(batch.max(axis=(1, 2, 3)) * 100).astype(int)] = 1.0
+        return ages
+
+    def gender_model(batch):
+        man = batch.max(axis=(1, 2, 3)) > 0.5
+        return np.stack([~man, man], axis=1).astype(np.float32)
+    return SimpleNamespace(age=age_model, gender=gender_model, calls=calls)
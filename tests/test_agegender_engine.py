@@ -0,0 +1,29 @@
+import numpy as np
+
+from utils.agegender_engine import AgeGenderEngine
+
+def crop(level):
+    return np.full((40, 30, 3), level, dtype=np.uint8)
+
+def expected_age(level):
+    return int(np.rint(level / 255.0 * 100))
+
+def test_batches_span_images_and_keep_face_order(stand_in_models):
+    engine = AgeGenderEngine(stand_in_models.age, stand_in_models.gender, max_batch=4)
+    levels = {"a": [10, 200, 60], "b": [240], "c": [30, 90, 150, 220]}
+    # faces of different images interleaved, as a batch of several images delivers them
+    items = [("a", 0, crop(10)), ("c", 0, crop(30)), ("a", 1, crop(200)), ("b", 0, crop(240)),
+             ("c", 1, crop(90)), ("c", 2, crop(150)), ("a", 2, crop(60)), ("c", 3, crop(220))]
+
+    grouped = engine.analyze(items)
+
+    assert stand_in_models.calls == [4, 4]  # eight crops, max_batch 4: two model calls for all three images
+    assert sorted(grouped) == ["a", "b", "c"]
+    for key, faces in grouped.items():
+        assert [f["face_index"] for f in faces] == list(range(len(levels[key])))
+        assert [f["agegender"]["age"] for f in faces] == [expected_age(v) for v in levels[key]]
+        assert [f["agegender"]["gender"] for f in faces] == ["man" if v > 127 else "woman" for v in levels[key]]
+
+def test_no_items_skips_the_models(stand_in_models):
+    assert AgeGenderEngine(stand_in_models.age, stand_in_models.gender).analyze([]) == {}
+    assert stand_in_models.calls == []
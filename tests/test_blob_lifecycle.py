@@ -0,0 +1,64 @@
+import time
+
+import fakeredis
+
+from utils.blob_lifecycle import CONSUMERS, BlobLifecycle, collect_orphans, memory_report
+
+def test_last_release_deletes_the_blob():
+    r = fakeredis.FakeRedis()
+    blobs = BlobLifecycle(r)
+    blobs.store("h", b"jpeg")
+    assert r.ttl("image:h") > 0 and r.ttl("image:refs:h") > 0
+    for left, consumer in zip((2, 1), CONSUMERS):
+        assert blobs.release("h", consumer) == left
+        assert r.get("image:h") == b"jpeg"
+    assert blobs.release("h", CONSUMERS[-1]) == 0
+    assert not r.exists("image:h", "image:refs:h")
+
+def test_double_release_is_idempotent():
+    r = fakeredis.FakeRedis()
+    blobs = BlobLifecycle(r)
+    blobs.store("h", b"jpeg")
+    assert blobs.release("h", "landmark") == 2
+    assert blobs.release("h", "landmark") == -1  # e.g. a redelivered task
+    assert r.scard("image:refs:h") == 2 and r.exists("image:h")
+    blobs.release("h", "agegender")
+    blobs.release("h", "storage")
+    assert blobs.release("h", "storage") == -1
+    assert not r.exists("image:h", "image:refs:h")
+
+def test_release_all_drops_blob_and_refs():
+    r = fakeredis.FakeRedis()
+    blobs = BlobLifecycle(r)
+    blobs.store("h", b"jpeg")
+    blobs.release_all("h")
+    assert not r.exists("image:h", "image:refs:h")
+    assert blobs.release("h", "storage") == -1
+
+def test_unreleased_blob_expires():
+    r = fakeredis.FakeRedis()
+    BlobLifecycle(r, ttl_sec=1).store("h", b"jpeg")
+    time.sleep(1.1)
+    assert not r.exists("image:h", "image:refs:h")
+
+def test_orphans_get_a_ttl_and_age_out():
+    r = fakeredis.FakeRedis()
+    r.set("combined:a", b"x")
+    r.hset("merged:b", "faces", b"x")
+    r.set("merged:c", b"x", ex=3600)
+    r.set("image:d", b"x")  # not an intermediate, left alone
+    assert collect_orphans(r, ttl_sec=1) == 2
+    assert collect_orphans(r, ttl_sec=1) == 0
+    time.sleep(1.1)
+    assert not r.exists("combined:a", "merged:b")
+    assert r.exists("merged:c") and r.ttl("image:d") == -1
+
+def test_memory_report_counts_keys_per_prefix():
+    r = fakeredis.FakeRedis()
+    BlobLifecycle(r).store("h", b"jpeg")
+    r.set("merged:h", b"x")
+    prefixes = memory_report(r)["prefixes"]
+    assert prefixes["image:"]["keys"] == 1
+    assert prefixes["image:refs:"]["keys"] == 1
+    assert prefixes["merged:"]["keys"] == 1
+    assert prefixes["combined:"]["keys"] == 0
@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+from utils.disk_writer import DiskWriter
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+def test_queued_rewrites_coalesce(tmp_path):
+    writer = DiskWriter(threads=1)
+    writes, done = [], []
+    write = writer._write
+
+    def counting_write(path, data, skip):
+        writes.append(data)
+        return write(path, data, skip)
+    writer._write = counting_write
+    path = str(tmp_path / "a.json")
+    with writer.cond:  # keep the writer from taking anything until all are queued
+        for version in range(5):
+            writer.submit(path, b"v%d" % version, on_done=done.append)
+    writer.close()
+    assert writes == [b"v4"]
+    assert done == [True] * 5
+    assert read(path) == b"v4"
+
+def test_group_is_synced_together(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+
+    def recording_fsync(fd):
+        synced.append(os.path.isdir(f"/proc/self/fd/{fd}"))  # directory or file
+        real_fsync(fd)
+    monkeypatch.setattr(os, "fsync", recording_fsync)
+    writer = DiskWriter(threads=1, fsync=True, group_size=32)
+    with writer.cond:
+        for i in range(10):
+            writer.submit(str(tmp_path / f"{i}.json"), b"{}")
+    writer.close()
+    assert synced.count(False) == 10  # every file
+    assert synced.count(True) == 1  # one directory sync for the group
+
+def test_close_flushes_everything(tmp_path):
+    writer = DiskWriter(threads=3, max_pending=8)
+    paths = [str(tmp_path / f"{i}.json") for i in range(100)]
+    for i, path in enumerate(paths):
+        writer.submit(path, b"%d" % i)
+    writer.close()
+    assert [read(path) for path in paths] == [b"%d" % i for i in range(100)]
+    assert writer.pending == 0
+
+def test_rewrite_does_not_overtake_a_write_in_progress(tmp_path):
+    writer = DiskWriter(threads=4)
+    write, started = writer._write, threading.Event()
+
+    def slow_first_version(path, data, skip):
+        if data == b"old":
+            started.set()
+            time.sleep(0.2)  # the other threads are idle meanwhile
+        return write(path, data, skip)
+    writer._write = slow_first_version
+    path = str(tmp_path / "a.json")
+    writer.submit(path, b"old")
+    started.wait(5)
+    writer.submit(path, b"new")
+    writer.close()
+    assert read(path) == b"new"
+
+def test_concurrent_rewrites_end_with_the_last_version(tmp_path):
+    writer = DiskWriter(threads=4, max_pending=16, group_size=4)
+    paths = [str(tmp_path / f"{i}.json") for i in range(8)]
+
+    def rewrite(path):
+        for version in range(200):
+            writer.submit(path, b"%d" % version)
+    submitters = [threading.Thread(target=rewrite, args=(path,)) for path in paths]
+    for t in submitters:
+        t.start()
+    for t in submitters:
+        t.join()
+    writer.close()
+    assert all(read(path) == b"199" for path in paths)
@@ -0,0 +1,54 @@
+import cv2
+import fakeredis
+import numpy as np
+
+from utils.agegender_engine import AgeGenderEngine
+from utils.face_cache import FaceAttributeCache, face_fingerprint
+
+def face(seed, size=(120, 100)):
+    # stand-in face: a few smooth blobs at seeded positions
+    rng = np.random.default_rng(seed)
+    image = np.full(size + (3,), 90, dtype=np.uint8)
+    for _ in range(6):
+        center = (int(rng.integers(10, size[1] - 10)), int(rng.integers(10, size[0] - 10)))
+        axes = (int(rng.integers(8, 30)), int(rng.integers(8, 30)))
+        cv2.ellipse(image, center, axes, 0, 0, 360, tuple(int(v) for v in rng.integers(0, 255, 3)), -1)
+    return cv2.GaussianBlur(image, (7, 7), 0)
+
+def near_duplicate(image):
+    # the same face in the next frame: re-encoded, slightly brighter, a little noise
+    noisy = image.astype(np.int16) + 6 + np.random.default_rng(1).integers(-4, 5, image.shape)
+    encoded = cv2.imencode(".jpg", np.clip(noisy, 0, 255).astype(np.uint8), [cv2.IMWRITE_JPEG_QUALITY, 80])[1]
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR)
+
+def test_near_duplicate_hits_and_other_face_misses(stand_in_models):
+    cache = FaceAttributeCache(max_entries=10)
+    engine = AgeGenderEngine(stand_in_models.age, stand_in_models.gender, cache=cache)
+    first = face(0)
+
+    analyzed = engine.analyze([("a", 0, first)])
+    again = engine.analyze([("b", 0, near_duplicate(first))])
+    assert stand_in_models.calls == [1]  # served from the cache
+    assert again["b"][0]["agegender"] == analyzed["a"][0]["agegender"]
+
+    engine.analyze([("c", 0, face(7))])
+    assert stand_in_models.calls == [1, 1]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 2
+
+def test_distance_threshold_and_lru():
+    cache = FaceAttributeCache(max_entries=2, max_distance=4)
+    a, b = face_fingerprint(face(0)), face_fingerprint(face(7))
+    assert bin(a ^ face_fingerprint(near_duplicate(face(0)))).count("1") <= 4
+    assert bin(a ^ b).count("1") > 4
+    cache.put(a, {"age": 30})
+    assert cache.get(a ^ 0b111) == {"age": 30}  # three bits off
+    assert cache.get(a ^ 0b11111) is None  # five bits off
+    cache.put(b, {"age": 40})
+    cache.put(face_fingerprint(face(3)), {"age": 50})
+    assert cache.get(a) is None  # least recently used, evicted
+
+def test_shared_redis_serves_other_replicas():
+    r = fakeredis.FakeRedis()
+    fingerprint = face_fingerprint(face(0))
+    FaceAttributeCache(r=r).put(fingerprint, {"age": 30})
+    assert FaceAttributeCache(r=r).get(fingerprint) == {"age": 30}
@@ -0,0 +1,40 @@
+import cv2
+import numpy as np
+
+from utils.face_task import decode_for_detection, decode_image, pick_reduction, scale_boxes
+
+# bright rectangles on a dark, off-multiple-of-8 canvas, as (x1, y1, x2, y2) in original pixels
+FACES = [(101, 203, 301, 463), (1500, 900, 1700, 1150), (3700, 2700, 3990, 2995)]
+
+def jpeg(width, height):
+    image = np.zeros((height, width, 3), dtype=np.uint8)
+    for x1, y1, x2, y2 in FACES:
+        cv2.rectangle(image, (x1, y1), (x2 - 1, y2 - 1), (255, 255, 255), -1)
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 95])[1].tobytes()
+
+def find_boxes(image):
+    # stand-in detector: bounding boxes of the bright regions
+    mask = (cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) > 127).astype(np.uint8)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    boxes = [(x, y, x + w, y + h) for x, y, w, h in map(cv2.boundingRect, contours)]
+    return np.array(sorted(boxes))
+
+def test_pick_reduction_keeps_long_side_and_faces():
+    assert pick_reduction(4001, 3001, 640) == 4
+    assert pick_reduction(3001, 4001, 640) == 4
+    assert pick_reduction(1280, 200, 640) == 2
+    assert pick_reduction(1000, 800, 640) == 1
+    assert pick_reduction(8000, 6000, 640, min_face_px=64, min_face_decoded=16) == 4
+
+def test_reduced_decode_maps_boxes_back():
+    data = jpeg(4001, 3001)
+    image, scale, original_shape = decode_for_detection(data)
+
+    assert scale == 4.0
+    assert image.shape[:2] == (751, 1001)  # libjpeg rounds the reduced size up
+    assert original_shape == (3001, 4001)
+    full = find_boxes(decode_image(data))
+    reduced = scale_boxes(find_boxes(image), scale)
+    assert len(reduced) == len(full) == len(FACES)
+    # a decoded pixel covers scale original pixels, so edges land within one of them
+    assert np.abs(reduced - full).max() <= scale
@@ -0,0 +1,17 @@
+import threading
+
+import fakeredis
+
+from utils.ingest import DETECT_QUEUE, Ingester
+from utils.task_queue import lane_stream, publish
+
+def test_batch_larger_than_the_limit_waits_for_an_empty_queue():
+    r = fakeredis.FakeRedis()
+    ingester = Ingester(r, batch_size=50, max_queue_depth=10, poll_interval_sec=0.01)
+    msg_id = publish(r, DETECT_QUEUE, {"image_hash": "h"}, lane=ingester.lane)
+    threading.Timer(0.1, r.xdel, args=(lane_stream(DETECT_QUEUE, ingester.lane), msg_id)).start()
+
+    ingester.wait_for_capacity(50)
+
+    assert r.xlen(lane_stream(DETECT_QUEUE, ingester.lane)) == 0
+    assert ingester.stats["throttled_sec"] > 0
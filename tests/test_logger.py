@@ -0,0 +1,42 @@
+import json
+import logging
+import multiprocessing as mp
+import os
+
+from utils import logger
+
+def emit_from_worker(q):
+    logger.forward_to(q)
+    logger.log_warning("[LANDMARK] No landmarks found for face %s in image %s", 2, "h" * 32, image_hash="h" * 32)
+
+def test_json_fields_come_from_the_call_site():
+    record = logging.LogRecord("root", logging.INFO, __file__, 1, "[STORAGE] Saved %s to %s", ("abc", "x.json"), None)
+    record.fields = {"image_hash": "abc", "part": ""}
+    entry = json.loads(logger.JsonFormatter().format(record))
+    assert entry["stage"] == "storage"
+    assert entry["msg"] == "Saved abc to x.json"
+    assert entry["image_hash"] == "abc"
+    assert "part" not in entry
+    # no hash is guessed from the text
+    record = logging.LogRecord("root", logging.INFO, __file__, 1, "[QUEUE] %s", ("0" * 32,), None)
+    assert "image_hash" not in json.loads(logger.JsonFormatter().format(record))
+
+def test_one_file_per_service():
+    assert os.path.basename(logger.log_path) == f"log_{logger.LOG_NAME}.log"
+    assert str(os.getpid()) not in os.path.basename(logger.log_path)
+
+def test_worker_records_reach_the_supervisor(monkeypatch):
+    received = []
+    monkeypatch.setattr(logger.queue_handler, "handle", received.append)
+    ctx = mp.get_context("spawn")
+    q = ctx.Queue()
+    listener = logger.serve_queue(q)
+    worker = ctx.Process(target=emit_from_worker, args=(q,))
+    worker.start()
+    worker.join(timeout=30)
+    listener.stop()
+    assert worker.exitcode == 0
+    assert len(received) == 1
+    entry = json.loads(logger.JsonFormatter().format(received[0]))
+    assert entry["stage"] == "landmark" and entry["image_hash"] == "h" * 32
+    assert entry["pid"] == worker.pid
@@ -0,0 +1,44 @@
+import random
+import threading
+from collections import Counter
+
+import fakeredis
+
+from utils.merge import MergeEngine
+
+def test_concurrent_parts_merge_exactly_once():
+    # every hash gets its landmarks and agegender parts from different threads, some of them
+    # twice (a redelivered part); exactly one record_part call per hash may return the pair
+    server = fakeredis.FakeServer()
+    rng = random.Random(0)
+    hashes = [f"h{i}" for i in range(200)]
+    jobs = [(h, part) for h in hashes for part in ("landmarks", "agegender", rng.choice(("landmarks", "agegender")))]
+    rng.shuffle(jobs)
+    merges = Counter()
+    lock = threading.Lock()
+    start = threading.Barrier(8)
+
+    def worker(chunk):
+        engine = MergeEngine(fakeredis.FakeRedis(server=server))
+        start.wait()
+        for image_hash, part in chunk:
+            parts = engine.record_part(image_hash, part, f"{image_hash}:{part}".encode())
+            if parts is not None:
+                assert parts == (f"{image_hash}:landmarks".encode(), f"{image_hash}:agegender".encode())
+                with lock:
+                    merges[image_hash] += 1
+
+    threads = [threading.Thread(target=worker, args=(jobs[i::8],)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert merges == Counter({h: 1 for h in hashes})
+
+def test_released_claim_merges_again():
+    engine = MergeEngine(fakeredis.FakeRedis())
+    assert engine.record_part("h", "landmarks", b"l") is None
+    assert engine.record_part("h", "agegender", b"a") == (b"l", b"a")
+    assert engine.record_part("h", "agegender", b"a") is None
+    engine.release("h")
+    assert engine.record_part("h", "agegender", b"a") == (b"l", b"a")
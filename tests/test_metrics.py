@@ -0,0 +1,37 @@
+import socket
+
+from utils import metrics
+from utils.metrics import Registry
+
+def test_drained_worker_metrics_merge_into_the_supervisor():
+    parent, workers = Registry(), [Registry(), Registry()]
+    for i, worker in enumerate(workers):
+        worker.histogram("stage_latency_seconds", service="landmark", stage="mesh").observe(0.02)
+        worker.inc("faces_processed_total", 3, service="landmark")
+        worker.set_gauge("model_load_seconds", 1.5 + i, model="mesh")
+        parent.merge(worker.drain(), worker=f"landmark-{i}")
+    workers[0].histogram("stage_latency_seconds", service="landmark", stage="mesh").observe(0.2)
+    parent.merge(workers[0].drain(), worker="landmark-0")
+
+    counts, total, count = parent.histogram("stage_latency_seconds", service="landmark", stage="mesh").snapshot()
+    assert count == 3 and abs(total - 0.24) < 1e-9
+    assert parent.counters[("faces_processed_total", (("service", "landmark"),))] == 6
+    text = parent.render()
+    assert 'model_load_seconds{model="mesh",worker="landmark-0"} 1.5' in text
+    assert 'model_load_seconds{model="mesh",worker="landmark-1"} 2.5' in text
+    # nothing new since the last drain
+    assert workers[1].drain()["histograms"] == {}
+
+def test_busy_port_moves_to_the_next_one():
+    taken = socket.socket()
+    taken.bind(("0.0.0.0", 0))
+    taken.listen()
+    port = taken.getsockname()[1]
+    server = metrics.start_metrics_server(port)
+    try:
+        assert server is not None and server.server_address[1] != port
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        taken.close()
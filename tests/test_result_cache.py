@@ -0,0 +1,57 @@
+import time
+
+import fakeredis
+
+from utils.result_cache import ResultCache
+from utils.task_queue import BULK_LANE, INFLIGHT_TTL_SEC, LaneQueue, inflight_ttl, publish
+
+def test_lookup_hits_after_mark_done(tmp_path):
+    r = fakeredis.FakeRedis()
+    cache = ResultCache(r, str(tmp_path))
+    assert cache.lookup("h") is None
+    result = tmp_path / "h.json"
+    result.write_text("{}")
+    cache.mark_done("h", str(result))
+    assert cache.lookup("h") == str(result)
+    assert ResultCache(r, str(tmp_path)).lookup("h") == str(result)  # another replica, via Redis
+    result.unlink()
+    assert cache.lookup("h") is None  # a deleted result is no hit
+    assert cache.stats() == {"hits": 2, "misses": 2, "coalesced": 0}
+
+def test_results_saved_before_the_cache_are_found(tmp_path):
+    (tmp_path / "old.json").write_text("{}")
+    cache = ResultCache(fakeredis.FakeRedis(), str(tmp_path))
+    assert cache.lookup("old") == str(tmp_path / "old.json")
+
+def test_uploads_of_an_in_flight_hash_coalesce(tmp_path):
+    r = fakeredis.FakeRedis()
+    cache = ResultCache(r, str(tmp_path))
+    assert cache.begin("h")
+    assert not cache.begin("h")
+    assert not ResultCache(r, str(tmp_path)).begin("h")
+    assert cache.stats()["coalesced"] == 2
+    cache.mark_done("h", str(tmp_path / "h.json"))
+    assert cache.begin("h")  # done: a new upload starts a new job
+    cache.abort("h")
+    assert cache.begin("h")
+
+def test_in_flight_marker_expires(tmp_path):
+    r = fakeredis.FakeRedis()
+    cache = ResultCache(r, str(tmp_path), inflight_ttl_sec=1)
+    assert cache.begin("h")
+    time.sleep(1.1)
+    assert cache.begin("h")
+
+def test_in_flight_marker_covers_the_lane_wait(tmp_path):
+    r = fakeredis.FakeRedis()
+    cache = ResultCache(r, str(tmp_path))
+    assert cache.begin("i")
+    assert r.ttl("inflight:i") <= inflight_ttl()
+    cache.extend("i", BULK_LANE)  # admitted to bulk, which has no deadline
+    assert r.ttl("inflight:i") > inflight_ttl() and r.ttl("inflight:i") > INFLIGHT_TTL_SEC
+
+    # a stage dequeuing the task renews the marker for its work and the next queue
+    r.set("inflight:b", 1, ex=5)
+    publish(r, "task:detect", {"image_hash": "b"}, lane=BULK_LANE)
+    assert len(LaneQueue(r, "task:detect", "detection").read(count=1, block_ms=None)) == 1
+    assert r.ttl("inflight:b") > inflight_ttl(BULK_LANE) - 5
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from utils import result_codec
+from utils.result_codec import decode_result, encode_result, result_arrays
+
+def sample(max_coord=500):
+    landmarks = [{"x": int(x), "y": int(y)} for x, y in np.linspace(0, max_coord, 20).reshape(-1, 2)]
+    return {
+        "image_hash": "abc",
+        "timestamp": "2026-01-01T00:00:00",
+        "faces": [
+            {"face_index": 0, "box": {"x1": 1, "y1": 2, "x2": 30, "y2": 40}, "landmarks": landmarks,
+             "agegender": {"age": 31, "gender": "woman"}},
+            {"face_index": 1, "box": {"x1": 5, "y1": 6, "x2": 70, "y2": 80}, "landmarks": None},
+        ],
+    }
+
+@pytest.mark.parametrize("fmt", ["json", "orjson", "msgpack"])
+def test_round_trip(fmt):
+    data = sample()
+    raw = encode_result(data, fmt)
+    assert decode_result(raw) == data
+    arrays = decode_result(raw, arrays=True)
+    np.testing.assert_array_equal(arrays["faces"][0]["landmarks"], [[p["x"], p["y"]] for p in data["faces"][0]["landmarks"]])
+    assert arrays["faces"][1]["landmarks"] is None
+
+def test_orjson_format_without_orjson(monkeypatch):
+    monkeypatch.setattr(result_codec, "orjson", None)
+    raw = encode_result(sample(), "orjson")
+    assert b"\n" not in raw  # still compact
+    assert decode_result(raw) == sample()
+
+def test_msgpack_landmarks_fall_back_to_int32():
+    small = decode_result(encode_result(sample(), "msgpack"), arrays=True)["faces"][0]["landmarks"]
+    assert small.dtype == np.dtype("<i2")
+    large = decode_result(encode_result(sample(max_coord=40000), "msgpack"), arrays=True)["faces"][0]["landmarks"]
+    assert large.dtype == np.dtype("<i4")
+    assert large.max() == 40000
+    assert decode_result(encode_result(sample(max_coord=40000), "msgpack")) == sample(max_coord=40000)
+
+def test_format_is_detected_from_the_payload():
+    data = sample()
+    assert decode_result(b" \n\t" + encode_result(data, "json")) == data
+    assert decode_result(encode_result(data, "json").decode()) == data
+    packed = encode_result(data, "msgpack")
+    assert not packed.lstrip().startswith(b"{")
+    assert decode_result(packed) == data
+
+def test_numpy_input_and_result_arrays():
+    data = sample()
+    data["faces"][0]["landmarks"] = np.array([[1, 2], [3, 4]], dtype=np.int64)
+    data["faces"][0]["agegender"]["age"] = np.int64(31)
+    for fmt in ("json", "orjson", "msgpack"):
+        decoded = decode_result(encode_result(data, fmt))
+        assert decoded["faces"][0]["landmarks"] == [{"x": 1, "y": 2}, {"x": 3, "y": 4}]
+        arrays = result_arrays(decoded)
+        assert arrays["boxes"].shape == (2, 4) and arrays["ages"].tolist() == [31, -1]
@@ -0,0 +1,59 @@
+import pytest
+
+from utils.results_index import ResultsIndex
+
+def result(timestamp, *faces):
+    return {"timestamp": timestamp, "image_path": "",
+            "faces": [{"face_index": i, "agegender": {"age": age, "gender": gender}} for i, (age, gender) in enumerate(faces)]}
+
+@pytest.fixture
+def index(tmp_path):
+    index = ResultsIndex(str(tmp_path))
+    index.add("a", result("2026-01-01T10:00:00", (25, "woman"), (60, "man")), "a.json")
+    index.add("b", result("2026-01-02T10:00:00", (60, "woman")), "b.json")
+    index.add("c", result("2026-01-03T10:00:00"), "c.json")
+    index.add("d", result("2026-01-03T10:00:00", (30, "man"), (32, "man"), (35, "woman")), "d.json")
+    yield index
+    index.close()
+
+def hashes(rows):
+    return [row["image_hash"] for row in rows]
+
+def test_age_and_gender_must_match_the_same_face(index):
+    # a has a 25-year-old woman and a 60-year-old man, but no woman over 50
+    assert hashes(index.query(min_age=50, gender="woman")) == ["b"]
+    assert hashes(index.query(min_age=50, max_age=70, gender="man")) == ["a"]
+    assert hashes(index.query(max_age=30, gender="woman", newest_first=False)) == ["a"]
+    assert index.count(gender="man") == 2
+
+def test_time_and_face_count_filters(index):
+    assert hashes(index.query(since="2026-01-02T00:00:00", newest_first=False)) == ["b", "c", "d"]
+    assert hashes(index.query(until="2026-01-02T10:00:00", newest_first=False)) == ["a", "b"]
+    assert hashes(index.query(min_faces=2)) == ["d", "a"]
+    assert hashes(index.query(max_faces=0)) == ["c"]
+    assert index.count(min_faces=1, max_faces=1) == 1
+
+def test_keyset_pages_cover_every_row_once(index):
+    for newest_first in (True, False):
+        seen, after = [], None
+        while True:
+            rows = index.query(after=after, limit=3, newest_first=newest_first)
+            if not rows:
+                break
+            seen += hashes(rows)
+            after = (rows[-1]["timestamp"], rows[-1]["image_hash"])
+        assert seen == (["d", "c", "b", "a"] if newest_first else ["a", "b", "c", "d"])
+    # equal timestamps are ordered by hash, so paging between c and d loses neither
+    assert hashes(index.query(after=("2026-01-03T10:00:00", "d"), limit=1)) == ["c"]
+
+def test_reindexing_replaces_faces(index):
+    index.add("a", result("2026-01-01T10:00:00", (70, "woman")), "a.json")
+    assert hashes(index.query(min_age=50, gender="woman")) == ["b", "a"]
+    assert index.count(gender="man", min_age=50) == 0
+
+def test_paging_walks_the_index(index):
+    plan = index.db.execute(
+        "EXPLAIN QUERY PLAN SELECT image_hash FROM results r WHERE (r.timestamp, r.image_hash) < (?, ?) "
+        "ORDER BY r.timestamp DESC, r.image_hash DESC LIMIT 1", ("2026-01-03", "z")).fetchall()
+    detail = " ".join(row[-1] for row in plan)
+    assert "results_timestamp_hash" in detail and "TEMP B-TREE" not in detail
@@ -0,0 +1,130 @@
+import os
+import struct
+
+import pytest
+
+from utils.segment_store import HINT_HEADER, SegmentBlobStore, SegmentStore, is_segment_path
+
+def value(name, version):
+    return f"{name}:{version}:".encode() * 20
+
+@pytest.fixture
+def directory(tmp_path):
+    return str(tmp_path / "segments")
+
+def fill(store, names, versions=1):
+    for version in range(versions):
+        for name in names:
+            store.put(name, value(name, version))
+
+def segment_files(directory, shard="ab", suffix=".seg"):
+    return sorted(os.path.join(directory, shard, n) for n in os.listdir(os.path.join(directory, shard)) if n.endswith(suffix))
+
+def test_records_survive_reopen(directory):
+    store = SegmentStore(directory, max_bytes=4096)
+    names = [f"ab{i}.json" for i in range(30)] + ["cd.jpg"]
+    fill(store, names, versions=2)
+    store.close()
+
+    store = SegmentStore(directory, max_bytes=4096)
+    assert all(store.get(name) == value(name, 1) for name in names)
+    assert sorted(store.names()) == sorted(names)
+    assert store.get("ab-missing.json") is None
+    store.close()
+
+def test_torn_final_record_is_dropped(directory):
+    store = SegmentStore(directory)
+    fill(store, ["ab1.json", "ab2.json"])
+    store.close()
+    active = segment_files(directory)[-1]
+    os.truncate(active, os.path.getsize(active) - 5)  # crash mid-append
+
+    store = SegmentStore(directory)
+    assert store.get("ab1.json") == value("ab1.json", 0)
+    assert store.get("ab2.json") is None
+    store.put("ab3.json", value("ab3.json", 0))  # appends after the truncated tail
+    store.close()
+    store = SegmentStore(directory, readonly=True)
+    assert sorted(store.names()) == ["ab1.json", "ab3.json"]
+    assert store.get("ab3.json") == value("ab3.json", 0)
+
+@pytest.mark.parametrize("damage", ["corrupt", "stale", "truncated"])
+def test_untrusted_hint_file_is_ignored(directory, damage):
+    store = SegmentStore(directory, max_bytes=2048)
+    names = [f"ab{i}.json" for i in range(20)]
+    fill(store, names)
+    store.close()
+    hint = segment_files(directory, suffix=".idx")[0]
+    with open(hint, "rb") as f:
+        original = f.read()
+    raw = bytearray(original)
+    if damage == "corrupt":
+        raw[HINT_HEADER.size + 2] ^= 0xFF  # an offset now points elsewhere
+    elif damage == "stale":
+        struct.pack_into("<Q", raw, 4, 1)  # written for a segment of another size
+    else:
+        raw = raw[:HINT_HEADER.size - 1]
+    with open(hint, "wb") as f:
+        f.write(raw)
+
+    reader = SegmentStore(directory, readonly=True)
+    assert all(reader.get(name) == value(name, 0) for name in names)
+    # the writer rebuilds the hints from a scan when it loads the shard
+    store = SegmentStore(directory, max_bytes=2048)
+    assert store.get(names[0]) == value(names[0], 0)
+    store.close()
+    with open(hint, "rb") as f:
+        assert f.read() == original
+
+def test_compaction_keeps_latest_values_and_frees_space(directory):
+    store = SegmentStore(directory, max_bytes=2048)
+    names = [f"ab{i}.json" for i in range(5)]
+    fill(store, names, versions=6)
+    before = store.stats()
+
+    removed, reclaimed = store.compact(ratio=0.5)
+
+    after = store.stats()
+    assert removed > 0 and reclaimed > 0
+    assert after["bytes"] == before["bytes"] - reclaimed
+    assert after["live_bytes"] == before["live_bytes"]
+    assert all(store.get(name) == value(name, 5) for name in names)
+    store.close()
+    store = SegmentStore(directory, max_bytes=2048)
+    assert all(store.get(name) == value(name, 5) for name in names)
+    assert store.stats()["bytes"] == after["bytes"]
+
+def test_reader_opened_before_compaction(directory):
+    store = SegmentStore(directory, max_bytes=2048)
+    names = [f"ab{i}.json" for i in range(5)]
+    fill(store, names, versions=6)
+    mapped = SegmentStore(directory, readonly=True)
+    assert all(mapped.get(name) == value(name, 5) for name in names)  # segments mapped
+    indexed = SegmentStore(directory, readonly=True)
+    assert all(indexed.exists(name) for name in names)  # index loaded, nothing mapped
+
+    assert store.compact(ratio=0.5)[0] > 0
+    store.put("ab9.json", value("ab9.json", 0))
+
+    for reader in (mapped, indexed):
+        assert all(reader.get(name) == value(name, 5) for name in names)
+        assert reader.get("ab9.json") == value("ab9.json", 0)
+
+def test_blob_store_and_export(directory, tmp_path):
+    store = SegmentStore(directory)
+    blobs = SegmentBlobStore(store)
+    assert blobs.put("abc", b"jpeg")
+    assert not blobs.put("abc", b"other")  # blobs are immutable
+    assert blobs.get("abc") == b"jpeg" and is_segment_path(blobs.path("abc"))
+    store.put("abc.json", b"{}")
+
+    dest = tmp_path / "flat"
+    assert store.export(str(dest)) == 2
+    assert (dest / "abc.jpg").read_bytes() == b"jpeg"
+    assert store.export(str(dest)) == 0
+
+def test_second_writer_is_refused(directory):
+    store = SegmentStore(directory)
+    with pytest.raises(RuntimeError):
+        SegmentStore(directory)
+    store.close()
@@ -0,0 +1,113 @@
+import json
+import time
+
+import fakeredis
+
+from utils import task_queue
+from utils.blob_lifecycle import BlobLifecycle
+from utils.task_queue import BULK_LANE, INTERACTIVE_LANE, LaneQueue, TaskQueue, admit, publish
+
+def fill(r, stream, lane, n, prefix, **extra):
+    for i in range(n):
+        publish(r, stream, dict({"image_hash": f"{prefix}{i}"}, **extra), lane=lane)
+
+def test_single_reads_drain_lanes_by_weight():
+    r = fakeredis.FakeRedis()
+    queue = LaneQueue(r, "task:test", "test")
+    fill(r, "task:test", "interactive", 200, "i")
+    fill(r, "task:test", "bulk", 200, "b")
+    lanes = []
+    for _ in range(90):
+        for msg_id, task in queue.read(count=1, block_ms=None):
+            lanes.append(task["lane"])
+            queue.ack(msg_id)
+    assert len(lanes) == 90
+    assert lanes.count("interactive") == 80
+    assert lanes.count("bulk") == 10
+
+def test_idle_lane_banks_no_credit():
+    r = fakeredis.FakeRedis()
+    queue = LaneQueue(r, "task:test", "test")
+    fill(r, "task:test", "bulk", 50, "b")
+    for _ in range(40):
+        for msg_id, _ in queue.read(count=1, block_ms=None):
+            queue.ack(msg_id)
+    fill(r, "task:test", "interactive", 50, "i")
+    lanes = []
+    for _ in range(9):
+        for msg_id, task in queue.read(count=1, block_ms=None):
+            lanes.append(task["lane"])
+            queue.ack(msg_id)
+    # interactive comes back at its weighted share, not as a burst of bulk catch-up or starvation
+    assert lanes.count("interactive") == 8
+
+def test_stale_task_releases_only_its_stage():
+    r = fakeredis.FakeRedis()
+    blobs = BlobLifecycle(r)
+    blobs.store("h", b"jpeg")
+    r.set("inflight:h", 1)
+    publish(r, "task:landmark", {"image_hash": "h", "deadline": time.time() - 1}, lane="interactive")
+    queue = LaneQueue(r, "task:landmark", "landmark", holder="landmark")
+
+    assert queue.read(count=1, block_ms=None) == []
+    # agegender still holds the blob, so it and the in-flight marker stay
+    assert r.get("image:h") == b"jpeg"
+    assert r.exists("inflight:h")
+    assert r.smembers("image:refs:h") == {b"agegender"}
+
+    publish(r, "task:agegender", {"image_hash": "h", "deadline": time.time() - 1}, lane="interactive")
+    LaneQueue(r, "task:agegender", "agegender", holder="agegender").read(count=1, block_ms=None)
+    assert not r.exists("image:h", "image:refs:h", "inflight:h")
+
+def test_stale_task_at_detection_releases_everything():
+    r = fakeredis.FakeRedis()
+    BlobLifecycle(r).store("h", b"jpeg")
+    r.set("inflight:h", 1)
+    publish(r, "task:detect", {"image_hash": "h", "deadline": time.time() - 1}, lane="interactive")
+    LaneQueue(r, "task:detect", "detection").read(count=1, block_ms=None)
+    assert not r.exists("image:h", "image:refs:h", "inflight:h")
+
+def test_admit_unknown_lane_falls_back_to_interactive():
+    r = fakeredis.FakeRedis()
+    assert admit(r, "task:detect", "no-such-lane") == INTERACTIVE_LANE
+
+def test_admit_ignores_entries_held_by_a_dead_consumer():
+    r = fakeredis.FakeRedis()
+    queued_at = int((time.time() - 30) * 1000)  # well past the interactive wait limit
+    r.xadd("task:detect", {"task": json.dumps({"image_hash": "h0"})}, id=f"{queued_at}-0")
+    crashed = TaskQueue(r, "task:detect", "detection", consumer="a")
+    assert len(crashed.read(count=1, block_ms=None)) == 1  # read, never acked
+
+    # the pending entry waits for reclaim; new uploads are not pushed to bulk because of it
+    assert admit(r, "task:detect", "interactive") == INTERACTIVE_LANE
+
+    r.xadd("task:detect", {"task": json.dumps({"image_hash": "h1"})}, id=f"{queued_at}-1")
+    assert admit(r, "task:detect", "interactive") == BULK_LANE
+
+def test_entry_of_a_dead_consumer_is_reclaimed():
+    r = fakeredis.FakeRedis()
+    publish(r, "task:test", {"image_hash": "h"})
+    dead = TaskQueue(r, "task:test", "test", consumer="a", claim_idle_ms=50)
+    assert [task["image_hash"] for _, task in dead.read(block_ms=None)] == ["h"]
+
+    alive = TaskQueue(r, "task:test", "test", consumer="b", claim_idle_ms=50)
+    assert alive.read(block_ms=None) == []  # not idle long enough yet
+    time.sleep(0.1)
+    tasks = alive.read(block_ms=None)
+    assert [task["image_hash"] for _, task in tasks] == ["h"]
+    alive.ack(tasks[0][0])
+    assert r.xlen("task:test") == 0
+
+def test_entry_is_dropped_after_max_deliveries(monkeypatch):
+    monkeypatch.setattr(task_queue, "MAX_DELIVERIES", 2)
+    r = fakeredis.FakeRedis()
+    publish(r, "task:test", {"image_hash": "poison"})
+    delivered = []
+    for consumer in ("a", "b", "c"):
+        # each consumer takes the entry over from the previous one and dies on it
+        time.sleep(0.06)
+        queue = TaskQueue(r, "task:test", "test", consumer=consumer, claim_idle_ms=50)
+        delivered.append(len(queue.read(block_ms=None)))
+    assert delivered == [1, 1, 0]  # the third delivery would exceed the limit
+    assert r.xlen("task:test") == 0
+    assert r.xpending("task:test", "test")["pending"] == 0
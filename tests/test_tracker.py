@@ -0,0 +1,22 @@
+import numpy as np
+
+from utils.tracker import FaceTracker
+
+def test_weak_overlap_does_not_stop_a_centroid_match():
+    tracker = FaceTracker(iou_threshold=0.3, max_centroid_shift=0.5)
+    tracker.update([[0, 0, 100, 100], [1000, 0, 1100, 100]], 0)
+    # first face: slight overlap but too far off centre to be the same track (IoU ~0.09);
+    # second face: fast diagonal move, IoU ~0.27 but the centroid moved under half a box
+    seen = tracker.update([[60, 60, 160, 160], [1035, 35, 1135, 135]], 1)
+
+    by_id = {t.track_id: t.int_box() for t in seen}
+    assert by_id[1] == [1035, 35, 1135, 135]
+    assert by_id[2] == [60, 60, 160, 160]
+    assert 0 not in by_id
+
+def test_coasting_follows_velocity():
+    tracker = FaceTracker()
+    tracker.update([[0, 0, 100, 100]], 0)
+    tracker.update([[10, 0, 110, 100]], 2)
+    tracker.predict(3)
+    np.testing.assert_allclose(tracker.tracks[0].box, [15, 0, 115, 100])
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+import pytest
+
+from utils.worker_pool import SharedFrame, WorkerPool
+
+def total(image, offset):
+    return int(image.sum()) + offset
+
+def broken_init():
+    raise RuntimeError("model file missing")
+
+def wait_for(pool, jobs, timeout=30):
+    finished, deadline = [], time.time() + timeout
+    while len(finished) < jobs and time.time() < deadline:
+        finished += pool.poll(timeout=0.5)
+    return finished
+
+def test_workers_run_jobs_from_shared_frames():
+    pool = WorkerPool("TEST", 2, total)
+    pool.start()
+    frames = [SharedFrame.from_image(np.full((4, 4), i, dtype=np.uint8)) for i in range(4)]
+    try:
+        for job_id, frame in enumerate(frames[:2]):
+            pool.submit(job_id, frame, 100)
+        finished = wait_for(pool, 2)
+        for job_id, frame in enumerate(frames[2:], start=2):
+            pool.submit(job_id, frame, 100)
+        finished += wait_for(pool, 2)
+    finally:
+        for frame in frames:
+            frame.release()
+        pool.stop()
+    assert sorted(finished) == [(i, True, 16 * i + 100) for i in range(4)]
+
+def test_worker_failing_at_start_backs_off_then_gives_up():
+    pool = WorkerPool("TEST", 1, total, init=broken_init, restart_backoff_sec=0.2, max_quick_failures=3)
+    pool.start()
+    spawned, deadline = [time.time()], time.time() + 60
+    try:
+        with pytest.raises(RuntimeError):
+            while time.time() < deadline:
+                restarts = pool.workers[0]["restarts"]
+                pool.check_workers()
+                if pool.workers[0]["restarts"] > restarts:
+                    spawned.append(time.time())
+                time.sleep(0.02)
+    finally:
+        pool.stop()
+    assert pool.workers[0]["restarts"] == 2
+    gaps = np.diff(spawned)
+    assert gaps[0] >= 0.2 and gaps[1] >= 0.4  # doubling backoff between restarts
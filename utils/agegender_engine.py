@@ -0,0 +1,80 @@
+# batched age/gender inference: every crop is letterboxed to the model input size,
+# stacked into one tensor and pushed through the age and gender models once per batch
+import cv2
+import numpy as np
+
+from utils.face_cache import face_fingerprint
+
+GENDER_LABELS = ("woman", "man")  # DeepFace gender model output order
+
+def letterbox(face_crop, target_size=(224, 224)):
+    # same resize + zero padding that DeepFace applies before its attribute models
+    th, tw = target_size
+    h, w = face_crop.shape[:2]
+    factor = min(th / h, tw / w)
+    nh, nw = max(1, int(h * factor)), max(1, int(w * factor))
+    resized = cv2.resize(face_crop, (nw, nh))
+    out = np.zeros((th, tw, 3), dtype=np.float32)
+    top, left = (th - nh) // 2, (tw - nw) // 2
+    out[top:top + nh, left:left + nw] = resized
+    return out / 255.0
+
+def load_deepface_models():
+    from deepface import DeepFace
+    age_client = DeepFace.build_model(model_name="Age", task="facial_attribute")
+    gender_client = DeepFace.build_model(model_name="Gender", task="facial_attribute")
+
+    def age_model(batch):
+        return age_client.model(batch, training=False).numpy()
+
+    def gender_model(batch):
+        return gender_client.model(batch, training=False).numpy()
+    return age_model, gender_model
+
+class AgeGenderEngine:
+    def __init__(self, age_model=None, gender_model=None, target_size=(224, 224), max_batch=64, cache=None):
+        # age_model / gender_model take a (B, H, W, 3) float32 array and return
+        # (B, 101) age probabilities and (B, 2) gender scores; cache is an optional FaceAttributeCache
+        if age_model is None or gender_model is None:
+            from utils.inference import load_attribute_models
+            models = load_attribute_models()
+            age_model, gender_model = models.age, models.gender
+        self.age_model = age_model
+        self.gender_model = gender_model
+        self.target_size = target_size
+        self.max_batch = max_batch
+        self.cache = cache
+        self.age_bins = np.arange(101, dtype=np.float32)
+
+    def predict(self, crops):
+        if self.cache is None:
+            return self._run_models(crops)
+        # only crops without a cached near match go through the models
+        fingerprints = [face_fingerprint(c) for c in crops]
+        results = [self.cache.get(fp) for fp in fingerprints]
+        missing = [i for i, res in enumerate(results) if res is None]
+        for i, pred in zip(missing, self._run_models([crops[i] for i in missing])):
+            self.cache.put(fingerprints[i], pred)
+            results[i] = pred
+        return results
+
+    def _run_models(self, crops):
+        results = []
+        for start in range(0, len(crops), self.max_batch):
+            chunk = crops[start:start + self.max_batch]
+            batch = np.stack([letterbox(c, self.target_size) for c in chunk]).astype(np.float32)
+            ages = np.asarray(self.age_model(batch)) @ self.age_bins
+            genders = np.asarray(self.gender_model(batch)).argmax(axis=1)
+            for age, gender in zip(ages, genders):
+                results.append({"age": int(age), "gender": GENDER_LABELS[int(gender)]})
+        return results
+
+    def analyze(self, items):
+        # items: iterable of (key, face_index, crop) possibly spanning several images;
+        # returns {key: [{"face_index", "agegender"}, ...]} in input order
+        items = list(items)
+        predictions = self.predict([crop for _, _, crop in items]) if items else []
+        grouped = {}
+        for (key, idx, _), pred in zip(items, predictions):
+            grouped.setdefault(key, []).append({"face_index": idx, "agegender": pred})
+        return grouped
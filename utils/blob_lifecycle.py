@@ -0,0 +1,91 @@
+# lifecycle of image blobs in Redis: image:<hash> is held by every consumer listed in
+# image:refs:<hash> and deleted when the last one releases it; blobs, refs and stray
+# combined:/merged: keys all carry a TTL so nothing outlives a lost task
+import os
+import sys
+import redis
+
+BLOB_TTL_SEC = int(os.getenv("BLOB_TTL_SEC", 24 * 3600))
+ORPHAN_TTL_SEC = int(os.getenv("ORPHAN_TTL_SEC", 3600))
+CONSUMERS = ("landmark", "agegender", "storage")
+REPORT_PREFIXES = ("image:refs:", "image:", "combined:", "merged:", "result:", "inflight:", "task:")
+
+# KEYS: blob key, refs key; ARGV: consumer. Returns refs left, or -1 if the consumer held none.
+RELEASE_SCRIPT = """
+if redis.call('SREM', KEYS[2], ARGV[1]) == 0 then
+    return -1
+end
+local left = redis.call('SCARD', KEYS[2])
+if left == 0 then
+    redis.call('DEL', KEYS[1], KEYS[2])
+end
+return left
+"""
+
+class BlobLifecycle:
+    def __init__(self, r, ttl_sec=BLOB_TTL_SEC):
+        self.r = r
+        self.ttl_sec = ttl_sec
+        self.release_script = r.register_script(RELEASE_SCRIPT)
+
+    def store(self, image_hash, data, consumers=CONSUMERS, pipe=None):
+        # pass a pipeline to batch several uploads in one round trip
+        p = pipe if pipe is not None else self.r.pipeline()
+        refs_key = f"image:refs:{image_hash}"
+        p.set(f"image:{image_hash}", data, ex=self.ttl_sec)
+        p.delete(refs_key)
+        p.sadd(refs_key, *consumers)
+        p.expire(refs_key, self.ttl_sec)
+        if pipe is None:
+            p.execute()
+
+    def release(self, image_hash, consumer):
+        return self.release_script(keys=[f"image:{image_hash}", f"image:refs:{image_hash}"], args=[consumer])
+
+    def release_all(self, image_hash, pipe=None):
+        # drop the blob for every consumer at once, e.g. when it cannot be processed at all
+        (pipe or self.r).delete(f"image:{image_hash}", f"image:refs:{image_hash}")
+
+def collect_orphans(r, ttl_sec=ORPHAN_TTL_SEC, patterns=("combined:*", "merged:*")):
+    # give intermediates written without a TTL (e.g. by older versions) one, so they age out
+    fixed = 0
+    for pattern in patterns:
+        for key in r.scan_iter(match=pattern, count=500):
+            if r.ttl(key) == -1:
+                r.expire(key, ttl_sec)
+                fixed += 1
+    return fixed
+
+def memory_report(r, prefixes=REPORT_PREFIXES, sample=50):
+    # key counts per prefix plus an estimate of their memory from MEMORY USAGE on a sample
+    try:
+        info = r.info("memory")
+    except redis.ResponseError:  # e.g. fakeredis
+        info = {}
+    report = {"used_memory": info.get("used_memory"), "used_memory_human": info.get("used_memory_human"), "prefixes": {}}
+    counts = {p: 0 for p in prefixes}
+    sampled = {p: [] for p in prefixes}
+    for key in r.scan_iter(count=1000):
+        name = key.decode() if isinstance(key, bytes) else key
+        prefix = next((p for p in prefixes if name.startswith(p)), None)
+        if prefix is None:
+            continue
+        counts[prefix] += 1
+        if len(sampled[prefix]) < sample:
+            try:
+                sampled[prefix].append(r.memory_usage(key) or 0)
+            except redis.ResponseError:
+                sampled[prefix].append(0)
+    for prefix in prefixes:
+        sizes = sampled[prefix]
+        avg = sum(sizes) / len(sizes) if sizes else 0
+        report["prefixes"][prefix] = {"keys": counts[prefix], "approx_bytes": int(avg * counts[prefix])}
+    return report
+
+if __name__ == "__main__":
+    # python -m utils.blob_lifecycle [redis_url]
+    url = sys.argv[1] if len(sys.argv) > 1 else os.getenv("REDIS_URL", "redis://localhost:6379")
+    client = redis.Redis.from_url(url)
+    print(f"orphaned intermediates given a TTL: {collect_orphans(client)}")
+    for prefix, stats in memory_report(client)["prefixes"].items():
+        print(f"{prefix:<14} {stats['keys']:>8} keys  ~{stats['approx_bytes'] / 1024:.0f} KiB")
@@ -0,0 +1,51 @@
+# content-addressed image blobs: every image is stored once under its hash
+import os
+import tempfile
+
+class RedisBlobStore:
+    def __init__(self, r, prefix="image:"):
+        self.r = r
+        self.prefix = prefix
+
+    def key(self, image_hash):
+        return f"{self.prefix}{image_hash}"
+
+    def exists(self, image_hash):
+        return bool(self.r.exists(self.key(image_hash)))
+
+    def get(self, image_hash):
+        return self.r.get(self.key(image_hash))
+
+    def put(self, image_hash, data):
+        # SET NX: returns False when the blob was already there
+        return bool(self.r.set(self.key(image_hash), data, nx=True))
+
+class DiskBlobStore:
+    def __init__(self, directory, suffix=".jpg"):
+        self.directory = directory
+        self.suffix = suffix
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, image_hash):
+        return os.path.join(self.directory, f"{image_hash}{self.suffix}")
+
+    def exists(self, image_hash):
+        return os.path.exists(self.path(image_hash))
+
+    def get(self, image_hash):
+        try:
+            with open(self.path(image_hash), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, image_hash, data):
+        path = self.path(image_hash)
+        if os.path.exists(path):
+            return False
+        # write to a temp file and rename so readers never see a partial blob
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return True
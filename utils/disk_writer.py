@@ -0,0 +1,106 @@
+# bounded pool of writer threads for result files: writes to the same path are coalesced
+# (latest data wins) and, when fsync is on, every drained group is synced together.
+# Each path belongs to one thread, so a rewrite never overtakes a write of it still in progress.
+import os
+import tempfile
+import threading
+import zlib
+from collections import OrderedDict
+
+from utils import logger
+from utils import metrics
+
+class DiskWriter:
+    def __init__(self, threads=2, max_pending=1000, fsync=False, group_size=32, service="storage"):
+        self.service = service
+        self.max_pending = max_pending
+        self.fsync = fsync
+        self.group_size = group_size
+        self.queues = [OrderedDict() for _ in range(max(1, threads))]  # per thread: path -> (data, skip_existing, callbacks)
+        self.pending = 0
+        self.cond = threading.Condition()
+        self.closed = False
+        self.threads = [threading.Thread(target=self._run, args=(i,), daemon=True) for i in range(len(self.queues))]
+        for t in self.threads:
+            t.start()
+
+    def submit(self, path, data, skip_existing=False, on_done=None):
+        # blocks while the queue is full; on_done(ok) runs on a writer thread
+        queue = self.queues[zlib.crc32(path.encode()) % len(self.queues)]
+        with self.cond:
+            while self.pending >= self.max_pending and path not in queue:
+                self.cond.wait()
+            callbacks = []
+            if path in queue:
+                callbacks = queue[path][2]
+            else:
+                self.pending += 1
+            if on_done is not None:
+                callbacks.append(on_done)
+            queue[path] = (data, skip_existing, callbacks)
+            metrics.registry.set_gauge("disk_writer_pending", self.pending, service=self.service)
+            self.cond.notify_all()
+
+    def _take_group(self, i):
+        queue = self.queues[i]
+        with self.cond:
+            while not queue and not self.closed:
+                self.cond.wait()
+            group = []
+            while queue and len(group) < self.group_size:
+                group.append(queue.popitem(last=False))
+            self.pending -= len(group)
+            self.cond.notify_all()
+            return group
+
+    def _write(self, path, data, skip_existing):
+        if skip_existing and os.path.exists(path):
+            return None
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if self.fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        return directory
+
+    def _run(self, i):
+        while True:
+            group = self._take_group(i)
+            if not group:
+                return
+            results = []
+            directories = set()
+            for path, (data, skip_existing, callbacks) in group:
+                try:
+                    with metrics.timed("disk_write", self.service):
+                        directory = self._write(path, data, skip_existing)
+                    if directory:
+                        directories.add(directory)
+                    results.append((callbacks, True))
+                except Exception as e:
+                    logger.log_error("[WRITER] Failed to write %s: %s", path, e)
+                    results.append((callbacks, False))
+            if self.fsync:
+                # one directory sync per group makes all renames in it durable
+                for directory in directories:
+                    dir_fd = os.open(directory, os.O_RDONLY)
+                    try:
+                        os.fsync(dir_fd)
+                    finally:
+                        os.close(dir_fd)
+            for callbacks, ok in results:
+                for callback in callbacks:
+                    try:
+                        callback(ok)
+                    except Exception as e:
+                        logger.log_error("[WRITER] Completion callback failed: %s", e)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        for t in self.threads:
+            t.join()
@@ -0,0 +1,84 @@
+# per-face age/gender cache keyed on a perceptual hash of the resized crop, so faces
+# that keep reappearing skip the models; near matches are found by Hamming distance
+import json
+import os
+from collections import OrderedDict
+import cv2
+import numpy as np
+
+FACE_CACHE_ENABLED = os.getenv("FACE_CACHE", "0") == "1"
+FACE_CACHE_SIZE = int(os.getenv("FACE_CACHE_SIZE", 5000))
+FACE_CACHE_MAX_DISTANCE = int(os.getenv("FACE_CACHE_MAX_DISTANCE", 4))  # differing bits out of 64
+FACE_CACHE_REDIS_TTL_SEC = int(os.getenv("FACE_CACHE_REDIS_TTL_SEC", 24 * 3600))
+
+def face_fingerprint(face_crop):
+    # 64-bit pHash: low-frequency DCT block of a 32x32 grayscale crop, thresholded at its median
+    gray = cv2.cvtColor(face_crop, cv2.COLOR_BGR2GRAY) if face_crop.ndim == 3 else face_crop
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()[1:]  # drop the DC term
+    bits = np.append(low > np.median(low), False)
+    return int(np.packbits(bits).view(">u8")[0])
+
+def _popcount64(values):
+    return np.unpackbits(values.view(np.uint8).reshape(-1, 8), axis=1).sum(axis=1)
+
+class FaceAttributeCache:
+    def __init__(self, max_entries=FACE_CACHE_SIZE, max_distance=FACE_CACHE_MAX_DISTANCE, r=None,
+                 redis_ttl_sec=FACE_CACHE_REDIS_TTL_SEC):
+        # r: optional Redis client shared by all replicas (exact fingerprint matches only)
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.r = r
+        self.redis_ttl_sec = redis_ttl_sec
+        self.entries = OrderedDict()  # fingerprint -> {"age", "gender"}
+        self.hits = 0
+        self.misses = 0
+
+    def _nearest(self, fingerprint):
+        if fingerprint in self.entries:
+            return fingerprint
+        if not self.entries or self.max_distance <= 0:
+            return None
+        keys = np.fromiter(self.entries.keys(), dtype=np.uint64, count=len(self.entries))
+        distances = _popcount64(keys ^ np.uint64(fingerprint))
+        best = int(distances.argmin())
+        if distances[best] <= self.max_distance:
+            return int(keys[best])
+        return None
+
+    def get(self, fingerprint):
+        key = self._nearest(fingerprint)
+        if key is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        if self.r is not None:
+            raw = self.r.get(f"facecache:{fingerprint:016x}")
+            if raw is not None:
+                value = json.loads(raw)
+                self._store(fingerprint, value)
+                self.hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def _store(self, fingerprint, value):
+        self.entries[fingerprint] = value
+        self.entries.move_to_end(fingerprint)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def put(self, fingerprint, value):
+        self._store(fingerprint, value)
+        if self.r is not None:
+            self.r.set(f"facecache:{fingerprint:016x}", json.dumps(value), ex=self.redis_ttl_sec)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "max_distance": self.max_distance
+        }
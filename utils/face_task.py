@@ -0,0 +1,126 @@
+# helpers shared by the detection stage and the per-face workers
+import json
+import os
+import cv2
+import numpy as np
+
+DETECT_DECODE_MIN_SIDE = int(os.getenv("DETECT_DECODE_MIN_SIDE", 640))  # detector input size, long side
+DETECT_MIN_FACE_PX = int(os.getenv("DETECT_MIN_FACE_PX", 64))  # smallest face of interest, original pixels
+DETECT_MIN_FACE_DECODED = int(os.getenv("DETECT_MIN_FACE_DECODED", 16))  # ... and after reduced decoding
+REDUCED_FLAGS = {2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4, 8: cv2.IMREAD_REDUCED_COLOR_8}
+SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+def decode_image(image_bytes):
+    image_np = np.frombuffer(image_bytes, np.uint8)
+    return cv2.imdecode(image_np, cv2.IMREAD_COLOR)
+
+def jpeg_size(data):
+    # (width, height) from the JPEG frame header without decoding, None for anything else
+    if data[:2] != b"\xff\xd8":
+        return None
+    i = 2
+    while i + 9 < len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            i += 1
+            continue
+        if marker in SOF_MARKERS:
+            height = int.from_bytes(data[i + 5:i + 7], "big")
+            width = int.from_bytes(data[i + 7:i + 9], "big")
+            return width, height
+        i += 2 + int.from_bytes(data[i + 2:i + 4], "big")
+    return None
+
+def pick_reduction(width, height, min_side, min_face_px=None, min_face_decoded=None):
+    # largest JPEG DCT reduction (1/2, 1/4, 1/8) that keeps the long side >= min_side and,
+    # if given, a face of min_face_px original pixels at >= min_face_decoded pixels
+    for factor in (8, 4, 2):
+        if max(width, height) / factor < min_side:
+            continue
+        if min_face_px is not None and min_face_px / factor < min_face_decoded:
+            continue
+        return factor
+    return 1
+
+def decode_reduced(image_bytes, factor_for):
+    # factor_for(width, height) -> reduction; returns (image, scale, original (height, width)).
+    # Decoded pixel i covers original pixels [i * scale, (i + 1) * scale) on both axes; the
+    # decoded size is rounded up, so the original shape comes from the header, not image * scale
+    size = jpeg_size(image_bytes)
+    factor = factor_for(*size) if size else 1
+    if factor == 1:
+        image = decode_image(image_bytes)
+        return image, 1.0, image.shape[:2] if image is not None else None
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), REDUCED_FLAGS[factor])
+    if image is None:
+        return None, 1.0, None
+    width, height = size
+    if (image.shape[1] > image.shape[0]) != (width > height):  # EXIF rotation applied by imdecode
+        width, height = height, width
+    return image, float(factor), (height, width)
+
+def decode_for_detection(image_bytes):
+    # returns (image, scale, original (height, width)); boxes found on image are multiplied by scale
+    return decode_reduced(image_bytes, lambda w, h: pick_reduction(
+        w, h, DETECT_DECODE_MIN_SIDE, DETECT_MIN_FACE_PX, DETECT_MIN_FACE_DECODED))
+
+def decode_for_crops(image_bytes, faces, min_crop_side):
+    # the per-face models resize crops to ~min_crop_side anyway, so decode only as large as the
+    # smallest crop needs; returns (image, scale) for iter_crops
+    sides = [min(f["crop"]["x2"] - f["crop"]["x1"], f["crop"]["y2"] - f["crop"]["y1"]) for f in faces]
+    sides = [s for s in sides if s > 0]
+    if not sides:
+        return decode_image(image_bytes), 1.0
+    smallest = min(sides)
+    image, scale, _ = decode_reduced(image_bytes, lambda w, h: pick_reduction(smallest, smallest, min_crop_side))
+    return image, scale
+
+def scale_boxes(boxes, scale):
+    # boxes found on a reduced decode -> original pixel coordinates
+    if scale == 1.0:
+        return boxes
+    return np.rint(np.asarray(boxes, dtype=np.float64).reshape(-1, 4) * scale).astype(int)
+
+def clip_box(box, width, height):
+    x1, y1, x2, y2 = (int(v) for v in box)
+    x1, x2 = max(0, min(x1, width)), max(0, min(x2, width))
+    y1, y2 = max(0, min(y1, height)), max(0, min(y2, height))
+    return x1, y1, x2, y2
+
+def encode_task(image_hash, boxes, image_shape, traceparent=None, deadline=None):
+    height, width = image_shape[:2]
+    faces = []
+    for idx, box in enumerate(boxes):
+        x1, y1, x2, y2 = (int(v) for v in box)
+        cx1, cy1, cx2, cy2 = clip_box(box, width, height)
+        faces.append({
+            "face_index": idx,
+            "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+            "crop": {"x1": cx1, "y1": cy1, "x2": cx2, "y2": cy2}
+        })
+    task = {
+        "image_hash": image_hash,
+        "width": width,
+        "height": height,
+        "faces": faces
+    }
+    if traceparent:
+        task["traceparent"] = traceparent
+    if deadline:
+        task["deadline"] = deadline
+    return json.dumps(task)
+
+def iter_crops(image, faces, scale=1.0):
+    # scale: original pixels per pixel of image (see decode_for_crops)
+    for face in faces:
+        c = face["crop"]
+        if c["x2"] <= c["x1"] or c["y2"] <= c["y1"]:
+            continue
+        if scale == 1.0:
+            yield face, image[c["y1"]:c["y2"], c["x1"]:c["x2"]]
+            continue
+        x1, y1 = int(c["x1"] / scale), int(c["y1"] / scale)
+        x2, y2 = max(x1 + 1, int(np.ceil(c["x2"] / scale))), max(y1 + 1, int(np.ceil(c["y2"] / scale)))
+        yield face, image[y1:y2, x1:x2]
@@ -0,0 +1,303 @@
+# inference backends for the three models behind one small interface each:
+#   detector.detect(images) -> [(N, 4) int boxes], landmarker.landmarks(crop) -> (468, 2) in [0, 1] or None,
+#   attributes.age(batch) -> (B, 101), attributes.gender(batch) -> (B, 2)
+# "native" wraps ultralytics / mediapipe / DeepFace, "onnx" runs exported graphs on ONNX Runtime.
+# Frameworks are imported on load only, so a worker never pulls in the ones it does not use.
+# export + int8 quantization: python -m utils.inference export [--int8]
+import argparse
+import os
+import time
+import cv2
+import numpy as np
+
+from utils import logger
+from utils import metrics
+
+BACKEND = os.getenv("INFERENCE_BACKEND", "native")
+DETECT_BACKEND = os.getenv("DETECT_BACKEND", BACKEND)
+LANDMARK_BACKEND = os.getenv("LANDMARK_BACKEND", BACKEND)
+AGEGEN_BACKEND = os.getenv("AGEGEN_BACKEND", BACKEND)
+THREADS = int(os.getenv("INFERENCE_THREADS", 0))  # intra-op threads, 0 = framework default
+MODEL_DIR = os.getenv("MODEL_DIR", ".")
+ONNX_INT8 = os.getenv("ONNX_INT8", "0") == "1"
+DETECT_CONF = float(os.getenv("DETECT_CONF", 0.25))
+DETECT_IOU = float(os.getenv("DETECT_IOU", 0.45))
+DETECT_SIZE = int(os.getenv("DETECT_SIZE", 640))
+LANDMARK_MIN_SCORE = float(os.getenv("LANDMARK_MIN_SCORE", 0.5))
+
+YOLO_WEIGHTS = "model.pt"
+ONNX_FILES = {"detector": "model.onnx", "landmarker": "face_landmark.onnx",
+              "age": "age.onnx", "gender": "gender.onnx"}
+
+def model_path(name):
+    return os.path.join(MODEL_DIR, name)
+
+def onnx_session(name):
+    import onnxruntime as ort
+    path = model_path(ONNX_FILES[name])
+    quantized = path.replace(".onnx", ".int8.onnx")
+    if ONNX_INT8 and os.path.exists(quantized):
+        path = quantized
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    if THREADS:
+        options.intra_op_num_threads = THREADS
+        options.inter_op_num_threads = 1
+    return ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+
+def onnx_model(session):
+    # a single-input, single-output session called like the Keras models: model(batch) -> array
+    input_name = session.get_inputs()[0].name
+
+    def run(batch):
+        return session.run(None, {input_name: batch})[0]
+    return run
+
+class Backend:
+    model = ""
+    backend = ""
+
+    def __init__(self):
+        start = time.perf_counter()
+        self.load()
+        self.load_sec = time.perf_counter() - start
+        metrics.registry.set_gauge("model_load_seconds", self.load_sec, model=self.model, backend=self.backend)
+        logger.log_info("[INFER] %s (%s) loaded in %.2fs", self.model, self.backend, self.load_sec)
+
+    def load(self):
+        raise NotImplementedError
+
+    def _warmup(self):
+        raise NotImplementedError
+
+    def warmup(self):
+        # first call pays for graph initialization; do it before taking traffic
+        start = time.perf_counter()
+        self._warmup()
+        elapsed = time.perf_counter() - start
+        metrics.registry.set_gauge("model_warmup_seconds", elapsed, model=self.model, backend=self.backend)
+        logger.log_info("[INFER] %s (%s) warm-up took %.2fs", self.model, self.backend, elapsed)
+        return elapsed
+
+    def timed(self):
+        return metrics.registry.histogram("inference_latency_seconds", model=self.model, backend=self.backend)
+
+# --- detector ---
+
+class YoloDetector(Backend):
+    model = "detector"
+    backend = "native"
+
+    def load(self):
+        from ultralytics import YOLO
+        if THREADS:
+            import torch
+            torch.set_num_threads(THREADS)
+        self.yolo = YOLO(model_path(YOLO_WEIGHTS)).to("cpu")
+
+    def detect(self, images):
+        start = time.perf_counter()
+        results = self.yolo(images, verbose=False)
+        self.timed().observe(time.perf_counter() - start)
+        return [res.boxes.xyxy.cpu().numpy().astype(int) for res in results]
+
+    def _warmup(self):
+        self.detect([np.zeros((DETECT_SIZE, DETECT_SIZE, 3), dtype=np.uint8)])
+
+def letterbox_detect(image, size=DETECT_SIZE):
+    # YOLO input: resize keeping aspect, pad with gray to size x size, RGB CHW in [0, 1]
+    h, w = image.shape[:2]
+    scale = min(size / h, size / w)
+    nh, nw = int(round(h * scale)), int(round(w * scale))
+    top, left = (size - nh) // 2, (size - nw) // 2
+    canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+    canvas[top:top + nh, left:left + nw] = cv2.resize(image, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    tensor = cv2.cvtColor(canvas, cv2.COLOR_BGR2RGB).transpose(2, 0, 1).astype(np.float32) / 255.0
+    return tensor, scale, left, top
+
+class OnnxDetector(Backend):
+    model = "detector"
+    backend = "onnx"
+
+    def load(self):
+        self.session = onnx_session("detector")
+        meta = self.session.get_inputs()[0]
+        self.input_name = meta.name
+        self.fixed_batch = meta.shape[0] if isinstance(meta.shape[0], int) else None
+
+    def _postprocess(self, output, scale, left, top):
+        # output: (4 + classes, candidates) with cx, cy, w, h in letterboxed pixels
+        scores = output[4:].max(axis=0)
+        keep = scores >= DETECT_CONF
+        if not keep.any():
+            return np.zeros((0, 4), dtype=int)
+        cx, cy, bw, bh = output[:4, keep]
+        scores = scores[keep]
+        rects = np.stack([cx - bw / 2, cy - bh / 2, bw, bh], axis=1)
+        picked = cv2.dnn.NMSBoxes(rects.tolist(), scores.tolist(), DETECT_CONF, DETECT_IOU)
+        picked = np.asarray(picked, dtype=int).reshape(-1)
+        boxes = rects[picked].copy()
+        boxes[:, 2:] += boxes[:, :2]
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - left) / scale
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - top) / scale
+        return boxes.astype(int)
+
+    def detect(self, images):
+        prepared = [letterbox_detect(image) for image in images]
+        start = time.perf_counter()
+        if self.fixed_batch == 1:
+            outputs = [self.session.run(None, {self.input_name: t[None]})[0][0] for t, _, _, _ in prepared]
+        else:
+            outputs = self.session.run(None, {self.input_name: np.stack([t for t, _, _, _ in prepared])})[0]
+        self.timed().observe(time.perf_counter() - start)
+        return [self._postprocess(out, scale, left, top) for out, (_, scale, left, top) in zip(outputs, prepared)]
+
+    def _warmup(self):
+        self.detect([np.zeros((DETECT_SIZE, DETECT_SIZE, 3), dtype=np.uint8)])
+
+# --- landmarker ---
+
+class MediaPipeLandmarker(Backend):
+    model = "landmarker"
+    backend = "native"
+
+    def load(self):
+        import mediapipe as mp
+        self.face_mesh = mp.solutions.face_mesh.FaceMesh(static_image_mode=True, max_num_faces=1)
+
+    def landmarks(self, face_img):
+        from utils.landmarks import landmarks_to_array
+        start = time.perf_counter()
+        results = self.face_mesh.process(cv2.cvtColor(face_img, cv2.COLOR_BGR2RGB))
+        self.timed().observe(time.perf_counter() - start)
+        if results.multi_face_landmarks:
+            return landmarks_to_array(results.multi_face_landmarks[0].landmark)
+        return None
+
+    def _warmup(self):
+        self.landmarks(np.zeros((192, 192, 3), dtype=np.uint8))
+
+class OnnxLandmarker(Backend):
+    # the MediaPipe face landmark graph run straight on the detector's face crop
+    # (no second face detection pass): 192x192 RGB in [0, 1] -> 468 x (x, y, z) + face score logit
+    model = "landmarker"
+    backend = "onnx"
+
+    def load(self):
+        self.session = onnx_session("landmarker")
+        meta = self.session.get_inputs()[0]
+        self.input_name = meta.name
+        self.nchw = meta.shape[1] == 3
+        self.size = meta.shape[2] if self.nchw else meta.shape[1]
+
+    def landmarks(self, face_img):
+        rgb = cv2.cvtColor(cv2.resize(face_img, (self.size, self.size)), cv2.COLOR_BGR2RGB)
+        tensor = rgb.astype(np.float32)[None] / 255.0
+        if self.nchw:
+            tensor = tensor.transpose(0, 3, 1, 2)
+        start = time.perf_counter()
+        outputs = self.session.run(None, {self.input_name: tensor})
+        self.timed().observe(time.perf_counter() - start)
+        points, score = None, None
+        for out in outputs:
+            if out.size == 468 * 3:
+                points = out.reshape(468, 3)[:, :2]
+            elif out.size == 1:
+                score = float(out.reshape(-1)[0])
+        if points is None or (score is not None and 1 / (1 + np.exp(-score)) < LANDMARK_MIN_SCORE):
+            return None
+        return (points / self.size).astype(np.float32)
+
+    def _warmup(self):
+        self.landmarks(np.zeros((self.size, self.size, 3), dtype=np.uint8))
+
+# --- age / gender ---
+
+class DeepFaceAttributes(Backend):
+    model = "agegender"
+    backend = "native"
+
+    def load(self):
+        if THREADS:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(THREADS)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        from utils.agegender_engine import load_deepface_models
+        self.age_model, self.gender_model = load_deepface_models()
+
+    def age(self, batch):
+        start = time.perf_counter()
+        out = self.age_model(batch)
+        self.timed().observe(time.perf_counter() - start)
+        return out
+
+    def gender(self, batch):
+        return self.gender_model(batch)
+
+    def _warmup(self):
+        batch = np.zeros((1, 224, 224, 3), dtype=np.float32)
+        self.age(batch)
+        self.gender(batch)
+
+class OnnxAttributes(DeepFaceAttributes):
+    backend = "onnx"
+
+    def load(self):
+        self.age_model = onnx_model(onnx_session("age"))
+        self.gender_model = onnx_model(onnx_session("gender"))
+
+DETECTORS = {"native": YoloDetector, "onnx": OnnxDetector}
+LANDMARKERS = {"native": MediaPipeLandmarker, "onnx": OnnxLandmarker}
+ATTRIBUTES = {"native": DeepFaceAttributes, "onnx": OnnxAttributes}
+
+def load_detector(backend=None):
+    return DETECTORS[backend or DETECT_BACKEND]()
+
+def load_landmarker(backend=None):
+    return LANDMARKERS[backend or LANDMARK_BACKEND]()
+
+def load_attribute_models(backend=None):
+    return ATTRIBUTES[backend or AGEGEN_BACKEND]()
+
+# --- export ---
+
+def quantize(path):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    out = path.replace(".onnx", ".int8.onnx")
+    quantize_dynamic(path, out, weight_type=QuantType.QInt8)
+    logger.log_info("[INFER] Wrote int8 model %s", out)
+    return out
+
+def export_models(int8=False):
+    # each export needs the native framework plus its converter (ultralytics, tf2onnx)
+    written = []
+    from ultralytics import YOLO
+    exported = YOLO(model_path(YOLO_WEIGHTS)).export(format="onnx", dynamic=True, imgsz=DETECT_SIZE)
+    os.replace(exported, model_path(ONNX_FILES["detector"]))
+    written.append(model_path(ONNX_FILES["detector"]))
+
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+    for name, task_model in (("age", "Age"), ("gender", "Gender")):
+        client = DeepFace.build_model(model_name=task_model, task="facial_attribute")
+        spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+        tf2onnx.convert.from_keras(client.model, input_signature=spec, output_path=model_path(ONNX_FILES[name]))
+        written.append(model_path(ONNX_FILES[name]))
+
+    import mediapipe as mp
+    tflite = os.path.join(os.path.dirname(mp.__file__), "modules", "face_landmark", "face_landmark.tflite")
+    tf2onnx.convert.from_tflite(tflite, output_path=model_path(ONNX_FILES["landmarker"]))
+    written.append(model_path(ONNX_FILES["landmarker"]))
+
+    if int8:
+        written += [quantize(path) for path in list(written)]
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["export"])
+    parser.add_argument("--int8", action="store_true", help="also write dynamically quantized *.int8.onnx models")
+    args = parser.parse_args()
+    for path in export_models(args.int8):
+        print(path)
@@ -0,0 +1,136 @@
+# bulk ingestion: images from directories, tar/zip archives or a tar stream are hashed
+# and enqueued in pipelined batches, keeping the original bytes when they are already JPEG
+import hashlib
+import os
+import sys
+import tarfile
+import time
+import zipfile
+import cv2
+import numpy as np
+
+from utils import logger
+from utils import tracing
+from utils.blob_lifecycle import BlobLifecycle
+from utils.result_cache import STATS_KEY
+from utils.task_queue import BULK_LANE, inflight_ttl, lane_stream, publish
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+JPEG_MAGIC = b"\xff\xd8\xff"
+DETECT_QUEUE = "task:detect"
+
+def is_image_name(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+def iter_directory(path):
+    for root, _, files in os.walk(path):
+        for name in sorted(files):
+            if is_image_name(name):
+                with open(os.path.join(root, name), "rb") as f:
+                    yield os.path.join(root, name), f.read()
+
+def iter_tar(path=None, fileobj=None):
+    # streaming mode, so archives (or stdin) are never loaded whole
+    with tarfile.open(name=path, fileobj=fileobj, mode="r|*") as tar:
+        for member in tar:
+            if member.isfile() and is_image_name(member.name):
+                yield member.name, tar.extractfile(member).read()
+
+def iter_zip(path):
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if is_image_name(name):
+                yield name, archive.read(name)
+
+def iter_source(source):
+    if source == "-":
+        return iter_tar(fileobj=sys.stdin.buffer)
+    if os.path.isdir(source):
+        return iter_directory(source)
+    if zipfile.is_zipfile(source):
+        return iter_zip(source)
+    if tarfile.is_tarfile(source):
+        return iter_tar(path=source)
+    raise ValueError(f"Unsupported ingestion source: {source}")
+
+def ensure_jpeg(data):
+    if data[:3] == JPEG_MAGIC:
+        return data
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    ok, encoded = cv2.imencode(".jpg", image)
+    return encoded.tobytes() if ok else None
+
+class Ingester:
+    def __init__(self, r, batch_size=100, max_queue_depth=5000, poll_interval_sec=0.5, lane=BULK_LANE):
+        self.r = r
+        self.lane = lane
+        self.batch_size = batch_size
+        self.max_queue_depth = max_queue_depth
+        self.poll_interval_sec = poll_interval_sec
+        self.blobs = BlobLifecycle(r)
+        self.stats = {"seen": 0, "queued": 0, "cached": 0, "coalesced": 0, "invalid": 0, "throttled_sec": 0.0}
+
+    def wait_for_capacity(self, incoming):
+        # backpressure: hold off while the detection queue is too deep; a batch larger than the
+        # limit waits for an empty queue instead of forever
+        incoming = min(incoming, self.max_queue_depth)
+        while self.r.xlen(lane_stream(DETECT_QUEUE, self.lane)) + incoming > self.max_queue_depth:
+            time.sleep(self.poll_interval_sec)
+            self.stats["throttled_sec"] += self.poll_interval_sec
+
+    def enqueue_batch(self, images):
+        # images: list of (name, encoded bytes); two Redis round trips per batch
+        batch = {}
+        for name, data in images:
+            self.stats["seen"] += 1
+            data = ensure_jpeg(data)
+            if data is None:
+                logger.log_warning("[INGEST] Skipping undecodable image %s", name)
+                self.stats["invalid"] += 1
+                continue
+            batch.setdefault(hashlib.md5(data).hexdigest(), data)
+        if not batch:
+            return
+        hashes = list(batch)
+        self.wait_for_capacity(len(hashes))
+
+        pipe = self.r.pipeline(transaction=False)
+        for h in hashes:
+            pipe.exists(f"result:{h}")
+            pipe.set(f"inflight:{h}", 1, nx=True, ex=inflight_ttl(self.lane))
+        replies = pipe.execute()
+
+        pipe = self.r.pipeline(transaction=False)
+        for i, h in enumerate(hashes):
+            cached, owned = replies[2 * i], replies[2 * i + 1]
+            if cached:
+                if owned:
+                    pipe.delete(f"inflight:{h}")
+                pipe.hincrby(STATS_KEY, "hits", 1)
+                self.stats["cached"] += 1
+            elif not owned:
+                pipe.hincrby(STATS_KEY, "coalesced", 1)
+                self.stats["coalesced"] += 1
+            else:
+                pipe.hincrby(STATS_KEY, "misses", 1)
+                self.blobs.store(h, batch[h], pipe=pipe)
+                span = tracing.Span("ingest", "ingest", image_hash=h)
+                publish(pipe, DETECT_QUEUE, {"image_hash": h, "traceparent": span.traceparent}, lane=self.lane)
+                span.end()
+                self.stats["queued"] += 1
+        pipe.execute()
+
+    def ingest(self, images):
+        # images: any iterable of (name, encoded bytes)
+        batch = []
+        for item in images:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                self.enqueue_batch(batch)
+                batch = []
+                logger.log_info("[INGEST] Progress: %s", self.stats)
+        if batch:
+            self.enqueue_batch(batch)
+        return self.stats
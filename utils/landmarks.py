@@ -0,0 +1,32 @@
+# landmark arrays: MediaPipe output -> (P, 2) normalized arrays, projected to image
+# coordinates for all faces of an image in one operation, and drawn in one pass
+import numpy as np
+
+# pixel offsets of a filled radius-1 dot, matching cv2.circle(img, pt, 1, color, -1)
+DOT_OFFSETS = np.array([(0, 0), (1, 0), (-1, 0), (0, 1), (0, -1)], dtype=np.int32)
+
+def landmarks_to_array(landmarks):
+    # landmarks: a MediaPipe landmark sequence (e.g. multi_face_landmarks[0].landmark)
+    n = len(landmarks)
+    coords = np.fromiter((c for lm in landmarks for c in (lm.x, lm.y)), dtype=np.float32, count=2 * n)
+    return coords.reshape(n, 2)
+
+def project_landmarks(normalized, crops):
+    # normalized: (N, P, 2) in [0, 1] crop space; crops: (N, 4) x1, y1, x2, y2 -> (N, P, 2) int32 pixels
+    normalized = np.asarray(normalized, dtype=np.float32)
+    crops = np.asarray(crops, dtype=np.float32).reshape(-1, 4)
+    origin = crops[:, None, 0:2]
+    size = crops[:, None, 2:4] - origin
+    return (normalized * size + origin).astype(np.int32)
+
+def draw_landmarks(image, points, color=(0, 0, 255)):
+    # points: (..., 2) int array of x, y; draws every point in one vectorized write
+    pts = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+    if not len(pts):
+        return image
+    dots = (pts[:, None, :] + DOT_OFFSETS[None, :, :]).reshape(-1, 2)
+    h, w = image.shape[:2]
+    inside = (dots[:, 0] >= 0) & (dots[:, 0] < w) & (dots[:, 1] >= 0) & (dots[:, 1] < h)
+    dots = dots[inside]
+    image[dots[:, 1], dots[:, 0]] = color
+    return image
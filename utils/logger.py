@@ -1,26 +1,168 @@
+# non-blocking logging: call sites only put the unformatted record on a bounded queue, a background
+# listener formats it (JSON lines to a size-rotated file, plain text to the console) and writes it.
+# Messages take %-style args so formatting happens on the listener thread, not in the hot path.
+# One file per service (LOG_NAME, the script name by default). Rotation renames the file, which is
+# only safe with a single writer, so worker processes forward_to() their supervisor's serve_queue().
+import atexit
+import functools
+import json
 import logging
+import logging.handlers
 import os
+import queue
+import random
+import re
+import sys
+import threading
+import time
 from datetime import datetime
 
-LOG_DIR = "logs"
+def _script_name():
+    script = sys.argv[0] if sys.argv and sys.argv[0] else ""
+    name = os.path.splitext(os.path.basename(script))[0]
+    if name == "__main__":  # python -m <package>
+        name = os.path.basename(os.path.dirname(os.path.abspath(script)))
+    return name or "python"
+
+LOG_DIR = os.getenv("LOG_DIR", "logs")
+LOG_NAME = os.getenv("LOG_NAME") or _script_name()
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # file format: json or text
+LOG_CONSOLE = os.getenv("LOG_CONSOLE", "1") == "1"
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", 50 * 1024 * 1024))
+LOG_BACKUPS = int(os.getenv("LOG_BACKUPS", 5))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 20))  # records/sec per message template, 0 = unlimited
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 0.05))  # share of log_sampled() records kept
+
 os.makedirs(LOG_DIR, exist_ok=True)
 
-log_path = os.path.join(LOG_DIR, f"log_{datetime.now().strftime('%Y-%m-%d')}.log")
+log_path = os.path.join(LOG_DIR, f"log_{LOG_NAME}.log")
+
+STAGE_RE = re.compile(r"^\[(\w+)\]\s*")
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+@functools.lru_cache(maxsize=4096)
+def _template_stage(template):
+    # "[LANDMARK] Found %s face(s)" -> ("landmark", length of the prefix); looked up once per call site
+    match = STAGE_RE.match(template) if isinstance(template, str) else None
+    return (match.group(1).lower(), match.end()) if match else (None, 0)
+
+class JsonFormatter(logging.Formatter):
+    # stage and image_hash are fields passed by the call site (log_info(..., image_hash=h)); stage
+    # defaults to the "[PREFIX]" of the message template, which is dropped from msg
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, "fields", None) or {}
+        entry = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "pid": record.process,
+        }
+        stage, prefix = _template_stage(record.msg)
+        if stage:
+            entry["stage"] = stage
+            message = message[prefix:]
+        entry["msg"] = message
+        entry.update((k, v) for k, v in fields.items() if v not in (None, ""))
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RateLimitFilter(logging.Filter):
+    # token bucket per message template; the next record that passes reports how many were dropped
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0 or record.levelno >= logging.ERROR:
+            return True
+        key = (record.levelno, record.msg)
+        now = time.monotonic()
+        with self.lock:
+            tokens, last, dropped = self.buckets.get(key, (self.rate, now, 0))
+            tokens = min(self.rate, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now, dropped + 1)
+                return False
+            self.buckets[key] = (tokens - 1, now, 0)
+        if dropped:
+            record.fields = dict(getattr(record, "fields", None) or {}, suppressed=dropped)
+        return True
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # keep msg/args unformatted; the listener formats in its own thread
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _build_handlers():
+    # delay: processes that forward their records never open the file
+    file_handler = logging.handlers.RotatingFileHandler(log_path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, delay=True)
+    file_handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler]
+    if LOG_CONSOLE:
+        console = logging.StreamHandler()
+        console.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(console)
+    return handlers
+
+_queue = queue.Queue(LOG_QUEUE_SIZE)
+queue_handler = NonBlockingQueueHandler(_queue)
+queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT))
+listener = logging.handlers.QueueListener(_queue, *_build_handlers(), respect_handler_level=True)
+
+root = logging.getLogger()
+root.handlers[:] = [queue_handler]
+root.setLevel(LOG_LEVEL)
+listener.start()
+atexit.register(listener.stop)
+
+def forward_to(q):
+    # worker processes: send records to the parent (serve_queue) instead of writing the file
+    # themselves; records are formatted here, as they must cross the process boundary
+    atexit.unregister(listener.stop)
+    listener.stop()
+    root.handlers[:] = [logging.handlers.QueueHandler(q)]
+
+def serve_queue(q):
+    # parent side of forward_to(): records arriving on q go through this process's handlers
+    forwarded = logging.handlers.QueueListener(q, queue_handler)
+    forwarded.start()
+    return forwarded
+
+def _log(level, msg, args, fields):
+    if root.isEnabledFor(level):
+        root.log(level, msg, *args, extra={"fields": fields} if fields else None)
+
+def log_debug(msg, *args, **fields):
+    _log(logging.DEBUG, msg, args, fields)
+
+def log_info(msg, *args, **fields):
+    _log(logging.INFO, msg, args, fields)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    handlers=[
-        logging.FileHandler(log_path),
-        logging.StreamHandler()
-    ]
-)
+def log_warning(msg, *args, **fields):
+    _log(logging.WARNING, msg, args, fields)
 
-def log_info(msg):
-    logging.info(msg)
+def log_error(msg, *args, **fields):
+    _log(logging.ERROR, msg, args, fields)
 
-def log_error(msg):
-    logging.error(msg)
+def log_sampled(msg, *args, **fields):
+    # per-face chatter: only LOG_SAMPLE_RATE of these records are kept
+    if LOG_SAMPLE_RATE >= 1 or random.random() < LOG_SAMPLE_RATE:
+        _log(logging.INFO, msg, args, fields)
 
-def log_warning(msg):
-    logging.warning(msg)
+def set_level(level):
+    root.setLevel(level)
@@ -0,0 +1,101 @@
+# merge engine for the storage service: recording a part and checking completeness is a
+# single Lua call, so of two parts arriving together exactly one caller gets the merge
+import os
+
+MERGE_TTL_MS = 60000
+PART_TTL_MS = int(os.getenv("ORPHAN_TTL_SEC", 3600)) * 1000
+
+# KEYS: merged:<hash>:landmarks, merged:<hash>:agegender, merged:<hash>:claim, the key of this part
+# ARGV: part payload, claim ttl in ms, part ttl in ms (a part whose partner never arrives ages out)
+MERGE_SCRIPT = """
+redis.call('SET', KEYS[4], ARGV[1], 'PX', ARGV[3])
+local landmarks = redis.call('GET', KEYS[1])
+local agegender = redis.call('GET', KEYS[2])
+if landmarks and agegender then
+    if redis.call('SET', KEYS[3], '1', 'NX', 'PX', ARGV[2]) then
+        return {landmarks, agegender}
+    end
+end
+return false
+"""
+
+def part_keys(image_hash):
+    return (
+        f"merged:{image_hash}:landmarks",
+        f"merged:{image_hash}:agegender",
+        f"merged:{image_hash}:claim",
+    )
+
+class MergeEngine:
+    def __init__(self, r, claim_ttl_ms=MERGE_TTL_MS):
+        self.r = r
+        self.claim_ttl_ms = claim_ttl_ms
+        self.script = r.register_script(MERGE_SCRIPT)
+
+    def record_part(self, image_hash, part_type, payload):
+        # returns (landmarks_raw, agegender_raw) to the one caller that completed the pair, else None
+        keys = part_keys(image_hash)
+        result = self.script(keys=[*keys, f"merged:{image_hash}:{part_type}"], args=[payload, self.claim_ttl_ms, PART_TTL_MS])
+        return tuple(result) if result else None
+
+    def complete(self, image_hash):
+        self.r.delete(*part_keys(image_hash))
+
+    def release(self, image_hash):
+        # saving failed: drop the claim so a redelivered part can merge again
+        self.r.delete(part_keys(image_hash)[2])
+
+def box_iou(a, b):
+    ix1, iy1 = max(a["x1"], b["x1"]), max(a["y1"], b["y1"])
+    ix2, iy2 = min(a["x2"], b["x2"]), min(a["y2"], b["y2"])
+    inter = max(0, ix2 - ix1) * max(0, iy2 - iy1)
+    area_a = max(0, a["x2"] - a["x1"]) * max(0, a["y2"] - a["y1"])
+    area_b = max(0, b["x2"] - b["x1"]) * max(0, b["y2"] - b["y1"])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+def join_faces(landmark_faces, agegender_faces, iou_threshold=0.5):
+    # match on face_index first; faces whose index has no partner fall back to best box IoU
+    by_index = {f.get("face_index"): f for f in agegender_faces}
+    used = set()
+    merged = []
+    unmatched = []
+    for l_face in landmark_faces:
+        match = by_index.get(l_face.get("face_index"))
+        if match is not None and id(match) not in used:
+            used.add(id(match))
+        else:
+            match = None
+            unmatched.append(len(merged))
+        merged.append({
+            "face_index": l_face.get("face_index"),
+            "box": l_face.get("box"),
+            "landmarks": l_face.get("landmarks"),
+            "agegender": match.get("agegender", {}) if match else {}
+        })
+
+    leftovers = [f for f in agegender_faces if id(f) not in used and f.get("box")]
+    for pos in unmatched:
+        box = merged[pos]["box"]
+        if not box or not leftovers:
+            continue
+        best = max(leftovers, key=lambda f: box_iou(box, f["box"]))
+        if box_iou(box, best["box"]) >= iou_threshold:
+            merged[pos]["agegender"] = best.get("agegender", {})
+            leftovers.remove(best)
+    return merged
+
+class AsyncMergeEngine:
+    # same protocol as MergeEngine on a redis.asyncio client
+    def __init__(self, r, claim_ttl_ms=MERGE_TTL_MS):
+        self.r = r
+        self.claim_ttl_ms = claim_ttl_ms
+        self.script = r.register_script(MERGE_SCRIPT)
+
+    async def record_part(self, image_hash, part_type, payload):
+        keys = part_keys(image_hash)
+        result = await self.script(keys=[*keys, f"merged:{image_hash}:{part_type}"], args=[payload, self.claim_ttl_ms, PART_TTL_MS])
+        return tuple(result) if result else None
+
+    async def release(self, image_hash):
+        await self.r.delete(part_keys(image_hash)[2])
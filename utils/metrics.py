@@ -0,0 +1,213 @@
+# in-process metrics with a Prometheus text endpoint: per-stage latency histograms,
+# counters and gauges, plus collectors evaluated at scrape time (e.g. queue depths).
+# Worker processes drain() their registry with every result and the supervisor merge()s it,
+# so one endpoint covers the whole pool.
+import bisect
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from utils import logger
+
+METRICS_PORT_TRIES = int(os.getenv("METRICS_PORT_TRIES", 10))  # replicas on one host take the next free port
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.bounds = list(buckets)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.bounds, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.counts), self.sum, self.count
+
+    def drain(self):
+        with self.lock:
+            drained = self.counts, self.sum, self.count
+            self.counts, self.sum, self.count = [0] * len(self.counts), 0.0, 0
+        return drained
+
+    def merge(self, counts, total, count):
+        with self.lock:
+            for i, c in enumerate(counts):
+                self.counts[i] += c
+            self.sum += total
+            self.count += count
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}  # (name, labels) -> Histogram
+        self.counters = {}    # (name, labels) -> float
+        self.gauges = {}      # (name, labels) -> float
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        hist = self.histograms.get(key)
+        if hist is None:
+            with self.lock:
+                hist = self.histograms.setdefault(key, Histogram())
+        return hist
+
+    def inc(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_gauge(self, name, delta, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def drain(self):
+        # everything recorded since the last drain (gauges: current values), for merge() elsewhere
+        with self.lock:
+            counters, self.counters = self.counters, {}
+            histograms = list(self.histograms.items())
+            gauges = dict(self.gauges)
+        drained = ((key, hist.drain()) for key, hist in histograms)
+        return {
+            "histograms": {key: h for key, h in drained if h[2]},
+            "counters": counters,
+            "gauges": gauges,
+        }
+
+    def merge(self, drained, **labels):
+        # histograms and counters add up across processes; gauges get labels (e.g. worker=...)
+        # so that each process keeps its own value
+        for (name, key), (counts, total, count) in drained["histograms"].items():
+            self.histogram(name, **dict(key)).merge(counts, total, count)
+        for (name, key), value in drained["counters"].items():
+            self.inc(name, value, **dict(key))
+        for (name, key), value in drained["gauges"].items():
+            self.set_gauge(name, value, **dict(key, **labels))
+
+    def add_collector(self, fn):
+        # fn(registry) runs on every scrape and typically calls set_gauge
+        self.collectors.append(fn)
+
+    def render(self):
+        for fn in self.collectors:
+            try:
+                fn(self)
+            except Exception as e:
+                logger.log_error("[METRICS] Collector failed: %s", e)
+        lines = []
+        typed = set()
+
+        def declare(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(self.counters.items()):
+            declare(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            declare(name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda kv: kv[0]):
+            declare(name, "histogram")
+            counts, total, count = hist.snapshot()
+            cumulative = 0
+            for bound, c in zip(hist.bounds + ["+Inf"], counts):
+                cumulative += c
+                lines.append(f"{name}_bucket{_labels(labels + (('le', str(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+def _labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+registry = Registry()
+
+def observe(stage, seconds, service=""):
+    registry.histogram("stage_latency_seconds", service=service, stage=stage).observe(seconds)
+
+@contextmanager
+def timed(stage, service=""):
+    hist = registry.histogram("stage_latency_seconds", service=service, stage=stage)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        hist.observe(time.perf_counter() - start)
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, **labels)
+
+@contextmanager
+def in_flight(service):
+    registry.add_gauge("in_flight_requests", 1, service=service)
+    try:
+        yield
+    finally:
+        registry.add_gauge("in_flight_requests", -1, service=service)
+
+def add_queue_collector(r, streams):
+    # streams: {stream name: consumer group}; exports depth and entries in flight per queue
+    def collect(reg):
+        pipe = r.pipeline(transaction=False)
+        for stream, group in streams.items():
+            pipe.xlen(stream)
+            pipe.xpending(stream, group)
+        replies = pipe.execute(raise_on_error=False)
+        for i, stream in enumerate(streams):
+            depth, pending = replies[2 * i], replies[2 * i + 1]
+            if not isinstance(depth, Exception):
+                reg.set_gauge("task_queue_depth", depth, queue=stream)
+            if isinstance(pending, dict):
+                reg.set_gauge("task_queue_in_flight", pending.get("pending", 0), queue=stream)
+    registry.add_collector(collect)
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip("/") not in ("/metrics", ""):
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+def start_metrics_server(port):
+    # a busy port (another replica on this host) moves on to the next one; the service keeps
+    # running without an endpoint if none of METRICS_PORT_TRIES ports is free
+    if not port:
+        return None
+    for candidate in range(port, port + max(1, METRICS_PORT_TRIES)):
+        try:
+            server = ThreadingHTTPServer(("0.0.0.0", candidate), _Handler)
+        except OSError as e:
+            logger.log_warning("[METRICS] Port %s unavailable: %s", candidate, e)
+            continue
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        logger.log_info("[METRICS] Serving metrics on :%s/metrics", candidate)
+        return server
+    logger.log_error("[METRICS] No free port in %s-%s, metrics are not served", port, port + max(1, METRICS_PORT_TRIES) - 1)
+    return None
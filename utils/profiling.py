@@ -0,0 +1,98 @@
+# on-demand profiling of a running service: SIGUSR1 (or PROFILE=1 at start) switches the profiler on,
+# the next SIGUSR1 switches it off and writes the profile to PROFILE_DIR.
+# PROFILE_MODE=cprofile profiles the main thread (the worker loops) and writes a .prof for pstats/snakeviz;
+# PROFILE_MODE=sample samples every thread's stack and writes folded stacks for flamegraph tools
+import atexit
+import cProfile
+import os
+import signal
+import sys
+import threading
+import time
+from collections import Counter
+
+from utils import logger
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join("logs", "profiles"))
+PROFILE_MODE = os.getenv("PROFILE_MODE", "cprofile")
+PROFILE_ON_START = os.getenv("PROFILE", "0") == "1"
+SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", 10))
+
+class StackSampler:
+    def __init__(self, interval_ms=SAMPLE_INTERVAL_MS):
+        self.interval = interval_ms / 1000.0
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self.stop_event.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def enable(self):
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def disable(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def dump_stats(self, path):
+        with open(path, "w") as f:
+            for stack, n in self.stacks.most_common():
+                f.write(f"{stack} {n}\n")
+
+class Profiler:
+    def __init__(self, service, mode=PROFILE_MODE):
+        self.service = service
+        self.mode = mode
+        self.active = None
+        self.started = 0.0
+        self.lock = threading.RLock()
+
+    def start(self):
+        with self.lock:
+            if self.active is not None:
+                return
+            self.active = StackSampler() if self.mode == "sample" else cProfile.Profile()
+            self.active.enable()
+            self.started = time.time()
+        logger.log_info("[PROFILE] %s: %s profiling started (pid %s)", self.service, self.mode, os.getpid())
+
+    def stop(self):
+        with self.lock:
+            if self.active is None:
+                return None
+            profiler, self.active = self.active, None
+            profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        suffix = "folded" if self.mode == "sample" else "prof"
+        path = os.path.join(PROFILE_DIR, f"{self.service}_{os.getpid()}_{int(self.started)}.{suffix}")
+        profiler.dump_stats(path)
+        logger.log_info("[PROFILE] %s: %.1fs profile written to %s", self.service, time.time() - self.started, path)
+        return path
+
+    def toggle(self, *_):
+        if self.active is None:
+            self.start()
+        else:
+            self.stop()
+
+def install(service):
+    # call from the main thread; signal handlers can only be set there
+    profiler = Profiler(service)
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, profiler.toggle)
+    if PROFILE_ON_START:
+        profiler.start()
+    atexit.register(profiler.stop)
+    return profiler
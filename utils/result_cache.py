@@ -0,0 +1,96 @@
+# result cache in front of the pipeline, keyed on the image hash: finished results are
+# indexed in Redis (result:<hash>, with TTL) and mirrored in a small in-process LRU, and
+# uploads of a hash that is still being processed attach to the running job
+import os
+import time
+from collections import OrderedDict
+
+from utils.result_codec import RESULT_EXTENSIONS
+from utils.segment_store import is_segment_path
+from utils.task_queue import INTERACTIVE_LANE, inflight_ttl
+
+RESULT_TTL_SEC = int(os.getenv("RESULT_CACHE_TTL_SEC", 7 * 24 * 3600))
+LOCAL_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", 10000))
+STATS_KEY = "cache:stats"
+
+def _exists(path):
+    # records in the segment store are never deleted, only superseded
+    return is_segment_path(path) or os.path.exists(path)
+
+class ResultCache:
+    def __init__(self, r, save_dir="saved_data", max_entries=LOCAL_MAX_ENTRIES,
+                 ttl_sec=RESULT_TTL_SEC, inflight_ttl_sec=None):
+        # inflight_ttl_sec: fixed in-flight marker TTL; by default it follows the lane (inflight_ttl)
+        self.r = r
+        self.save_dir = save_dir
+        self.max_entries = max_entries
+        self.ttl_sec = ttl_sec
+        self.inflight_ttl_sec = inflight_ttl_sec
+        self.local = OrderedDict()  # image_hash -> (result path, expires_at)
+
+    def _remember(self, image_hash, path):
+        self.local[image_hash] = (path, time.time() + self.ttl_sec)
+        self.local.move_to_end(image_hash)
+        while len(self.local) > self.max_entries:
+            self.local.popitem(last=False)
+
+    def _find(self, image_hash):
+        entry = self.local.get(image_hash)
+        if entry is not None:
+            path, expires_at = entry
+            if expires_at > time.time() and _exists(path):
+                self.local.move_to_end(image_hash)
+                return path
+            del self.local[image_hash]
+
+        path = self.r.get(f"result:{image_hash}")
+        if path is not None:
+            path = path.decode() if isinstance(path, bytes) else path
+            if _exists(path):
+                self._remember(image_hash, path)
+                return path
+            self.r.delete(f"result:{image_hash}")
+
+        # results saved before the index existed
+        for ext in set(RESULT_EXTENSIONS.values()):
+            path = os.path.join(self.save_dir, f"{image_hash}{ext}")
+            if os.path.exists(path):
+                self.mark_done(image_hash, path)
+                self._remember(image_hash, path)
+                return path
+        return None
+
+    def lookup(self, image_hash):
+        path = self._find(image_hash)
+        self.r.hincrby(STATS_KEY, "hits" if path else "misses", 1)
+        return path
+
+    def _inflight_ttl(self, lane):
+        return self.inflight_ttl_sec or inflight_ttl(lane)
+
+    def begin(self, image_hash, lane=INTERACTIVE_LANE):
+        # True if the caller owns a new job, False if the hash is already in flight
+        if self.r.set(f"inflight:{image_hash}", 1, nx=True, ex=self._inflight_ttl(lane)):
+            return True
+        self.r.hincrby(STATS_KEY, "coalesced", 1)
+        return False
+
+    def extend(self, image_hash, lane, pipe=None):
+        # the job was admitted to another lane than begin() assumed
+        (pipe or self.r).expire(f"inflight:{image_hash}", self._inflight_ttl(lane))
+
+    def abort(self, image_hash, pipe=None):
+        (pipe or self.r).delete(f"inflight:{image_hash}")
+
+    def mark_done(self, image_hash, path):
+        pipe = self.r.pipeline()
+        pipe.set(f"result:{image_hash}", path, ex=self.ttl_sec)
+        pipe.delete(f"inflight:{image_hash}")
+        pipe.execute()
+
+    def stats(self):
+        raw = self.r.hgetall(STATS_KEY)
+        stats = {k.decode() if isinstance(k, bytes) else k: int(v) for k, v in raw.items()}
+        for name in ("hits", "misses", "coalesced"):
+            stats.setdefault(name, 0)
+        return stats
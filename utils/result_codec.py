@@ -0,0 +1,119 @@
+# result encodings for worker parts, merged:* intermediates and saved result files.
+#   json    - the original pretty-printed layout, landmarks as {"x", "y"} dicts
+#   orjson  - same schema, compact and much faster to encode/decode
+#   msgpack - binary container with landmarks packed as int16/int32 arrays
+import json
+import os
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+RESULT_FORMAT = os.getenv("RESULT_FORMAT", "json")
+RESULT_EXTENSIONS = {"json": ".json", "orjson": ".json", "msgpack": ".msgpack"}
+JSON_WHITESPACE = b" \t\r\n"
+
+def result_extension(fmt=None):
+    return RESULT_EXTENSIONS[fmt or RESULT_FORMAT]
+
+def _landmark_array(landmarks):
+    if isinstance(landmarks, np.ndarray):
+        return landmarks
+    return np.array([(p["x"], p["y"]) for p in landmarks], dtype=np.int32).reshape(-1, 2)
+
+def _pack_array(arr):
+    arr = np.asarray(arr)
+    if arr.size and arr.min() >= -32768 and arr.max() <= 32767:
+        arr = arr.astype("<i2")
+    else:
+        arr = arr.astype("<i4")
+    return {"dtype": arr.dtype.str, "shape": list(arr.shape), "data": arr.tobytes()}
+
+def _pack_landmarks(landmarks):
+    return _pack_array(_landmark_array(landmarks))
+
+def _unpack_array(packed):
+    return np.frombuffer(packed["data"], dtype=np.dtype(packed["dtype"])).reshape(packed["shape"])
+
+def _map_landmarks(data, fn):
+    faces = []
+    for face in data.get("faces", []):
+        if face.get("landmarks") is not None:
+            face = dict(face, landmarks=fn(face["landmarks"]))
+        faces.append(face)
+    return dict(data, faces=faces)
+
+def landmarks_as_dicts(landmarks):
+    if isinstance(landmarks, np.ndarray):
+        return [{"x": int(x), "y": int(y)} for x, y in landmarks.tolist()]
+    return landmarks
+
+def _json_default(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def encode_result(data, fmt=None):
+    fmt = fmt or RESULT_FORMAT
+    if fmt == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("RESULT_FORMAT=msgpack requires the msgpack package")
+        packed = _map_landmarks(data, _pack_landmarks)
+        return msgpack.packb(packed, use_bin_type=True, default=_json_default)
+    data = _map_landmarks(data, landmarks_as_dicts)
+    if fmt == "orjson" and orjson is not None:
+        return orjson.dumps(data, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+    if fmt == "orjson":
+        return json.dumps(data, default=_json_default, separators=(",", ":")).encode()
+    return json.dumps(data, indent=2, default=_json_default).encode()
+
+def _is_json(raw):
+    # JSON results are objects; a msgpack map never starts with a whitespace byte or "{"
+    for byte in raw:
+        if byte not in JSON_WHITESPACE:
+            return byte == 0x7B  # "{"
+    return False
+
+def decode_result(raw, arrays=False):
+    # format is detected from the payload; with arrays=True landmarks come back as (N, 2) arrays
+    if isinstance(raw, str):
+        raw = raw.encode()
+    if _is_json(raw):
+        data = orjson.loads(raw) if orjson is not None else json.loads(raw)
+        return _map_landmarks(data, _landmark_array) if arrays else data
+    if msgpack is None:
+        raise RuntimeError("Decoding a msgpack result requires the msgpack package")
+    data = msgpack.unpackb(raw, raw=False)
+    data = _map_landmarks(data, _unpack_array)
+    return data if arrays else _map_landmarks(data, landmarks_as_dicts)
+
+def load_result(path, arrays=False):
+    with open(path, "rb") as f:
+        return decode_result(f.read(), arrays=arrays)
+
+def result_arrays(data):
+    # stack a decoded result into NumPy arrays: boxes (F, 4), landmarks (F, P, 2), ages (F,)
+    faces = data.get("faces", [])
+    boxes = np.array(
+        [[f["box"][k] for k in ("x1", "y1", "x2", "y2")] for f in faces], dtype=np.int32
+    ).reshape(-1, 4)
+    landmarks = [_landmark_array(f["landmarks"]) for f in faces if f.get("landmarks") is not None]
+    same_size = len({lm.shape for lm in landmarks}) <= 1
+    return {
+        "face_index": np.array([f.get("face_index", -1) for f in faces], dtype=np.int32),
+        "boxes": boxes,
+        "landmarks": np.stack(landmarks) if landmarks and same_size else landmarks,
+        "ages": np.array([f.get("agegender", {}).get("age", -1) for f in faces], dtype=np.int32),
+        "genders": [f.get("agegender", {}).get("gender", "") for f in faces],
+    }
@@ -0,0 +1,135 @@
+# SQLite index over the saved results, written by storage at save time so readers can page and
+# filter without listing saved_data/: one row per image plus one row per face (age, gender).
+# WAL mode lets the viewer read while storage writes.
+# backfill from existing files: python -m utils.results_index [saved_data] [--segments]
+import os
+import sqlite3
+import sys
+import threading
+
+from utils.result_codec import RESULT_EXTENSIONS, decode_result, load_result
+from utils.segment_store import SegmentStore, segment_path
+
+INDEX_FILE = "index.sqlite3"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    image_hash TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    num_faces INTEGER NOT NULL,
+    image_path TEXT NOT NULL,
+    result_path TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS faces (
+    image_hash TEXT NOT NULL,
+    face_index INTEGER NOT NULL,
+    age INTEGER,
+    gender TEXT,
+    PRIMARY KEY (image_hash, face_index)
+);
+DROP INDEX IF EXISTS results_timestamp;
+CREATE INDEX IF NOT EXISTS results_timestamp_hash ON results (timestamp, image_hash);
+CREATE INDEX IF NOT EXISTS results_num_faces ON results (num_faces);
+CREATE INDEX IF NOT EXISTS faces_age ON faces (age);
+CREATE INDEX IF NOT EXISTS faces_gender ON faces (gender, age);
+"""
+
+class ResultsIndex:
+    def __init__(self, save_dir="saved_data", path=None):
+        self.save_dir = save_dir
+        self.path = path or os.getenv("RESULTS_INDEX") or os.path.join(save_dir, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(SCHEMA)
+
+    def add(self, image_hash, data, result_path):
+        faces = data.get("faces", [])
+        rows = []
+        for face in faces:
+            ag = face.get("agegender") or {}
+            age = ag.get("age")
+            rows.append((image_hash, face.get("face_index", 0), int(age) if age is not None else None, ag.get("gender")))
+        with self.lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (image_hash, data.get("timestamp", ""), len(faces), data.get("image_path", ""), result_path)
+            )
+            self.db.execute("DELETE FROM faces WHERE image_hash = ?", (image_hash,))
+            self.db.executemany("INSERT INTO faces VALUES (?, ?, ?, ?)", rows)
+
+    def _where(self, since=None, until=None, min_faces=None, max_faces=None,
+               min_age=None, max_age=None, gender=None):
+        clauses, params = [], []
+        for column, op, value in (("timestamp", ">=", since), ("timestamp", "<=", until),
+                                  ("num_faces", ">=", min_faces), ("num_faces", "<=", max_faces)):
+            if value is not None:
+                clauses.append(f"r.{column} {op} ?")
+                params.append(value)
+        # age and gender filters must hold for the same face
+        face_clauses, face_params = [], []
+        for column, op, value in (("age", ">=", min_age), ("age", "<=", max_age), ("gender", "=", gender)):
+            if value is not None:
+                face_clauses.append(f"f.{column} {op} ?")
+                face_params.append(value)
+        if face_clauses:
+            clauses.append("EXISTS (SELECT 1 FROM faces f WHERE f.image_hash = r.image_hash AND "
+                           + " AND ".join(face_clauses) + ")")
+            params.extend(face_params)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def query(self, after=None, limit=20, newest_first=True, **filters):
+        # keyset paging: after is the (timestamp, image_hash) of the last row already seen, so a
+        # page walks the (timestamp, image_hash) index from there instead of sorting and skipping
+        where, params = self._where(**filters)
+        order = "DESC" if newest_first else "ASC"
+        if after is not None:
+            where += (" AND " if where else " WHERE ") + f"(r.timestamp, r.image_hash) {'<' if newest_first else '>'} (?, ?)"
+            params += list(after)
+        sql = (f"SELECT image_hash, timestamp, num_faces, image_path, result_path FROM results r{where} "
+               f"ORDER BY r.timestamp {order}, r.image_hash {order} LIMIT ?")
+        with self.lock:
+            rows = self.db.execute(sql, params + [limit]).fetchall()
+        keys = ("image_hash", "timestamp", "num_faces", "image_path", "result_path")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def count(self, **filters):
+        where, params = self._where(**filters)
+        with self.lock:
+            return self.db.execute(f"SELECT COUNT(*) FROM results r{where}", params).fetchone()[0]
+
+    def rebuild(self, segments=None):
+        # one pass over saved_data/ (and the segment store, if given) for results written
+        # before the index existed
+        suffixes = tuple(set(RESULT_EXTENSIONS.values()))
+        added = 0
+        for entry in os.scandir(self.save_dir):
+            if not entry.name.endswith(suffixes):
+                continue
+            try:
+                data = load_result(entry.path)
+            except Exception:
+                continue
+            self.add(os.path.splitext(entry.name)[0], data, entry.path)
+            added += 1
+        for name in (segments.names() if segments else ()):
+            if not name.endswith(suffixes):
+                continue
+            try:
+                data = decode_result(segments.get(name))
+            except Exception:
+                continue
+            self.add(os.path.splitext(name)[0], data, segment_path(name))
+            added += 1
+        return added
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+if __name__ == "__main__":
+    args = [a for a in sys.argv[1:] if a != "--segments"]
+    index = ResultsIndex(args[0] if args else "saved_data")
+    segments = SegmentStore(readonly=True) if "--segments" in sys.argv else None
+    print(f"indexed {index.rebuild(segments)} result(s) into {index.path}")
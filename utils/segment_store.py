@@ -0,0 +1,415 @@
+# log-structured storage for saved images and results: records are appended to size-capped
+# segment files in hash-sharded directories (<dir>/<first chars of name>/<seq>.seg), each record
+# keyed by its flat file name (<hash>.jpg, <hash>.json). A later put of the same name supersedes
+# the earlier record; compaction copies the live records out of mostly-dead segments.
+# Lookups go through an in-memory offset index per shard, loaded lazily from the .idx file
+# written when a segment is sealed (or by scanning segments that have none), reads through mmap.
+# One writer process (storage), any number of readers; readers pick up new records on a miss.
+#   python -m utils.segment_store stats|compact|export [--dir saved_data/segments] [--dest saved_data]
+import argparse
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+
+SEGMENT_DIR = os.getenv("SEGMENT_DIR", os.path.join("saved_data", "segments"))
+SEGMENT_MAX_BYTES = int(os.getenv("SEGMENT_MAX_BYTES", 256 * 1024 * 1024))
+SEGMENT_SHARD_CHARS = int(os.getenv("SEGMENT_SHARD_CHARS", 2))
+SEGMENT_COMPACT_RATIO = float(os.getenv("SEGMENT_COMPACT_RATIO", 0.5))  # dead fraction that triggers compaction
+SEGMENT_FSYNC = os.getenv("SEGMENT_FSYNC", "0") == "1"
+SEGMENT_SCHEME = "segment:"
+
+# magic, crc32 of name + data, data length, write time, name length; then name, then data
+RECORD = struct.Struct("<4sIIdH")
+RECORD_MAGIC = b"FSG1"
+# hint file: magic, size of the segment it describes, crc32 of the entries; then the entries,
+# each offset of the data, data length, write time, name length; then name
+HINT_HEADER = struct.Struct("<4sQI")
+HINT_MAGIC = b"FSH1"
+HINT = struct.Struct("<QIdH")
+
+def segment_path(name):
+    return f"{SEGMENT_SCHEME}{name}"
+
+def is_segment_path(path):
+    return isinstance(path, str) and path.startswith(SEGMENT_SCHEME)
+
+def segment_name(path):
+    return path[len(SEGMENT_SCHEME):]
+
+def _record_size(name_len, length):
+    return RECORD.size + name_len + length
+
+class _Shard:
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.RLock()
+        self.index = {}      # name -> (seq, data offset, length, write time)
+        self.segments = {}   # seq -> [bytes, live bytes]
+        self.scanned = {}    # seq -> offset up to which the index covers the segment
+        self.maps = {}       # seq -> mmap
+        self.fd = None       # append fd of the active segment (writer only)
+        self.loaded = False
+
+    def seg_path(self, seq):
+        return os.path.join(self.directory, f"{seq:08d}.seg")
+
+    def hint_path(self, seq):
+        return os.path.join(self.directory, f"{seq:08d}.idx")
+
+    def active_seq(self):
+        return max(self.segments) if self.segments else 0
+
+class SegmentStore:
+    def __init__(self, directory=SEGMENT_DIR, max_bytes=SEGMENT_MAX_BYTES, readonly=False,
+                 fsync=SEGMENT_FSYNC, shard_chars=SEGMENT_SHARD_CHARS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        self.fsync = fsync
+        self.shard_chars = shard_chars
+        self.shards = {}
+        self.shards_lock = threading.Lock()
+        self.lock_file = None
+        if not readonly:
+            os.makedirs(directory, exist_ok=True)
+            self.lock_file = open(os.path.join(directory, "LOCK"), "a")
+            try:
+                fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self.lock_file.close()
+                raise RuntimeError(f"segment store {directory} is already open for writing")
+
+    # shards and index loading
+
+    def _shard(self, name):
+        key = name[:self.shard_chars].lower() or "_"
+        shard = self.shards.get(key)
+        if shard is None:
+            with self.shards_lock:
+                shard = self.shards.setdefault(key, _Shard(os.path.join(self.directory, key)))
+        if not shard.loaded:
+            with shard.lock:
+                if not shard.loaded:
+                    self._load(shard)
+        return shard
+
+    def _all_shards(self):
+        if os.path.isdir(self.directory):
+            for entry in sorted(os.scandir(self.directory), key=lambda e: e.name):
+                if entry.is_dir():
+                    self._shard(entry.name)
+        return list(self.shards.values())
+
+    def _load(self, shard):
+        # brings the shard's index up to date with what is on disk; cheap when nothing changed
+        try:
+            seqs = sorted(int(n[:-4]) for n in os.listdir(shard.directory) if n.endswith(".seg"))
+        except FileNotFoundError:
+            seqs = []
+        if any(seq not in seqs for seq in shard.segments):
+            # segments were compacted away by the writer: start over
+            self._unmap(shard)
+            shard.index, shard.segments, shard.scanned = {}, {}, {}
+        active = seqs[-1] if seqs else None
+        for seq in seqs:
+            if seq not in shard.scanned and seq != active and self._load_hints(shard, seq):
+                continue
+            end = self._scan(shard, seq, shard.scanned.get(seq, 0))
+            if not self.readonly:
+                path = shard.seg_path(seq)
+                if seq == active and os.path.getsize(path) > end:
+                    # torn record from a crash mid-append
+                    os.truncate(path, end)
+                elif seq != active:
+                    # missing, stale or corrupt hints: the scan just rebuilt them
+                    self._write_hints(shard, seq)
+        shard.loaded = True
+
+    def _add_entry(self, shard, name, seq, offset, length, written):
+        old = shard.index.get(name)
+        if old is not None and old[0] in shard.segments:
+            shard.segments[old[0]][1] -= _record_size(len(name.encode()), old[2])
+        size = _record_size(len(name.encode()), length)
+        shard.index[name] = (seq, offset, length, written)
+        shard.segments.setdefault(seq, [0, 0])[1] += size
+
+    def _scan(self, shard, seq, start):
+        path = shard.seg_path(seq)
+        shard.segments.setdefault(seq, [0, 0])
+        pos = start
+        with open(path, "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    break
+                magic, crc, length, written, name_len = RECORD.unpack(header)
+                body = f.read(name_len + length)
+                if magic != RECORD_MAGIC or len(body) < name_len + length or zlib.crc32(body) != crc:
+                    break
+                name = body[:name_len].decode()
+                self._add_entry(shard, name, seq, pos + RECORD.size + name_len, length, written)
+                pos += RECORD.size + name_len + length
+        shard.segments[seq][0] = pos
+        shard.scanned[seq] = pos
+        return pos
+
+    def _load_hints(self, shard, seq):
+        # False when the hints cannot be trusted (missing, damaged, or written for a segment of
+        # another size); the caller scans the segment instead
+        try:
+            with open(shard.hint_path(seq), "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return False
+        if len(raw) < HINT_HEADER.size:
+            return False
+        magic, segment_size, crc = HINT_HEADER.unpack_from(raw)
+        size = os.path.getsize(shard.seg_path(seq))
+        if magic != HINT_MAGIC or segment_size != size or zlib.crc32(raw[HINT_HEADER.size:]) != crc:
+            return False
+        pos = HINT_HEADER.size
+        while pos + HINT.size <= len(raw):
+            offset, length, written, name_len = HINT.unpack_from(raw, pos)
+            pos += HINT.size
+            name = raw[pos:pos + name_len].decode()
+            pos += name_len
+            self._add_entry(shard, name, seq, offset, length, written)
+        shard.segments.setdefault(seq, [0, 0])[0] = size
+        shard.scanned[seq] = size
+        return True
+
+    def _write_hints(self, shard, seq):
+        # all records of a sealed segment; loading replays them in order, so later segments win
+        records = sorted((entry[1], name, entry) for name, entry in shard.index.items() if entry[0] == seq)
+        parts = []
+        for _, name, (_, offset, length, written) in records:
+            raw_name = name.encode()
+            parts.append(HINT.pack(offset, length, written, len(raw_name)) + raw_name)
+        entries = b"".join(parts)
+        fd, tmp_path = tempfile.mkstemp(dir=shard.directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(HINT_HEADER.pack(HINT_MAGIC, shard.segments[seq][0], zlib.crc32(entries)))
+            f.write(entries)
+        os.replace(tmp_path, shard.hint_path(seq))
+
+    # writes
+
+    def _open_active(self, shard, needed):
+        seq = shard.active_seq()
+        size = shard.segments.get(seq, [0, 0])[0]
+        if size and size + needed > self.max_bytes:
+            # seal the full segment and roll over
+            if shard.fd is not None:
+                os.close(shard.fd)
+                shard.fd = None
+            self._write_hints(shard, seq)
+            seq += 1
+        if shard.fd is None:
+            os.makedirs(shard.directory, exist_ok=True)
+            shard.fd = os.open(shard.seg_path(seq), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            shard.segments.setdefault(seq, [0, 0])
+            shard.scanned.setdefault(seq, shard.segments[seq][0])
+        return seq
+
+    def _append(self, shard, name, data, written):
+        raw_name = name.encode()
+        body = raw_name + data
+        record = RECORD.pack(RECORD_MAGIC, zlib.crc32(body), len(data), written, len(raw_name)) + body
+        seq = self._open_active(shard, len(record))
+        os.write(shard.fd, record)
+        if self.fsync:
+            os.fsync(shard.fd)
+        offset = shard.segments[seq][0]
+        shard.segments[seq][0] += len(record)
+        shard.scanned[seq] = shard.segments[seq][0]
+        self._add_entry(shard, name, seq, offset + RECORD.size + len(raw_name), len(data), written)
+
+    def put(self, name, data):
+        # returns the segment: path of the record, usable wherever a file path is stored
+        if self.readonly:
+            raise RuntimeError("segment store opened read-only")
+        shard = self._shard(name)
+        with shard.lock:
+            self._append(shard, name, bytes(data), time.time())
+        return segment_path(name)
+
+    # reads
+
+    def _unmap(self, shard, seq=None):
+        for s in ([seq] if seq is not None else list(shard.maps)):
+            mm = shard.maps.pop(s, None)
+            if mm is not None:
+                mm.close()
+
+    def _read(self, shard, seq, offset, length):
+        mm = shard.maps.get(seq)
+        if mm is None or len(mm) < offset + length:
+            # the active segment grows: remap when a record lies past the current mapping
+            self._unmap(shard, seq)
+            with open(shard.seg_path(seq), "rb") as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            shard.maps[seq] = mm
+        return mm[offset:offset + length]
+
+    def _entry(self, shard, name):
+        entry = shard.index.get(name)
+        if entry is None and self.readonly:
+            # written by the storage service since this reader loaded the shard
+            self._load(shard)
+            entry = shard.index.get(name)
+        return entry
+
+    def get(self, name):
+        shard = self._shard(name)
+        with shard.lock:
+            entry = self._entry(shard, name)
+            if entry is None:
+                return None
+            try:
+                return self._read(shard, entry[0], entry[1], entry[2])
+            except (FileNotFoundError, ValueError):
+                if not self.readonly:
+                    raise
+            # compacted away under a reader
+            self._load(shard)
+            entry = shard.index.get(name)
+            return None if entry is None else self._read(shard, entry[0], entry[1], entry[2])
+
+    def exists(self, name):
+        shard = self._shard(name)
+        with shard.lock:
+            return self._entry(shard, name) is not None
+
+    def mtime(self, name):
+        shard = self._shard(name)
+        with shard.lock:
+            entry = self._entry(shard, name)
+            return None if entry is None else entry[3]
+
+    def names(self):
+        for shard in self._all_shards():
+            with shard.lock:
+                if self.readonly:
+                    self._load(shard)
+                names = list(shard.index)
+            yield from names
+
+    # maintenance
+
+    def compact(self, ratio=SEGMENT_COMPACT_RATIO):
+        # rewrites the live records of sealed segments whose dead fraction is at least ratio;
+        # returns (segments removed, bytes reclaimed)
+        if self.readonly:
+            raise RuntimeError("segment store opened read-only")
+        removed = reclaimed = 0
+        for shard in self._all_shards():
+            with shard.lock:
+                active = shard.active_seq()
+                for seq, (size, live) in sorted(shard.segments.items()):
+                    if seq == active or size == 0 or (size - live) / size < ratio:
+                        continue
+                    moved = sorted((entry[1], name, entry) for name, entry in shard.index.items() if entry[0] == seq)
+                    for _, name, (_, offset, length, written) in moved:
+                        self._append(shard, name, self._read(shard, seq, offset, length), written)
+                    if self.fsync and shard.fd is not None:
+                        os.fsync(shard.fd)
+                    self._unmap(shard, seq)
+                    for path in (shard.seg_path(seq), shard.hint_path(seq)):
+                        if os.path.exists(path):
+                            os.remove(path)
+                    del shard.segments[seq]
+                    shard.scanned.pop(seq, None)
+                    removed += 1
+                    reclaimed += size - live
+        return removed, reclaimed
+
+    def export(self, dest, overwrite=False):
+        # writes every live record as dest/<name>: the flat saved_data/ layout
+        os.makedirs(dest, exist_ok=True)
+        written = 0
+        for name in self.names():
+            path = os.path.join(dest, name)
+            if not overwrite and os.path.exists(path):
+                continue
+            data = self.get(name)
+            if data is None:
+                continue
+            fd, tmp_path = tempfile.mkstemp(dir=dest, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+            written += 1
+        return written
+
+    def stats(self):
+        shards = self._all_shards()
+        stats = {"shards": len(shards), "segments": 0, "records": 0, "bytes": 0, "live_bytes": 0}
+        for shard in shards:
+            with shard.lock:
+                stats["segments"] += len(shard.segments)
+                stats["records"] += len(shard.index)
+                stats["bytes"] += sum(size for size, _ in shard.segments.values())
+                stats["live_bytes"] += sum(live for _, live in shard.segments.values())
+        return stats
+
+    def close(self):
+        for shard in list(self.shards.values()):
+            with shard.lock:
+                self._unmap(shard)
+                if shard.fd is not None:
+                    os.close(shard.fd)
+                    shard.fd = None
+        if self.lock_file is not None:
+            self.lock_file.close()
+            self.lock_file = None
+
+class SegmentBlobStore:
+    # DiskBlobStore interface over a segment store: path() returns a segment: path
+    def __init__(self, store, suffix=".jpg"):
+        self.store = store
+        self.suffix = suffix
+
+    def path(self, image_hash):
+        return segment_path(f"{image_hash}{self.suffix}")
+
+    def exists(self, image_hash):
+        return self.store.exists(f"{image_hash}{self.suffix}")
+
+    def get(self, image_hash):
+        return self.store.get(f"{image_hash}{self.suffix}")
+
+    def put(self, image_hash, data):
+        if self.exists(image_hash):
+            return False
+        self.store.put(f"{image_hash}{self.suffix}", data)
+        return True
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect, compact or export a segment store")
+    parser.add_argument("command", choices=("stats", "compact", "export"))
+    parser.add_argument("--dir", default=SEGMENT_DIR)
+    parser.add_argument("--dest", default="saved_data", help="export target directory")
+    parser.add_argument("--ratio", type=float, default=SEGMENT_COMPACT_RATIO)
+    parser.add_argument("--overwrite", action="store_true", help="export over existing files")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        store = SegmentStore(args.dir)
+        removed, reclaimed = store.compact(args.ratio)
+        print(f"compacted {removed} segment(s), reclaimed {reclaimed / 1024 / 1024:.1f} MiB")
+    elif args.command == "export":
+        store = SegmentStore(args.dir, readonly=True)
+        print(f"exported {store.export(args.dest, overwrite=args.overwrite)} file(s) to {args.dest}")
+    else:
+        store = SegmentStore(args.dir, readonly=True)
+        print(store.stats())
+    store.close()
+
+if __name__ == "__main__":
+    main()
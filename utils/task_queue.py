@@ -0,0 +1,283 @@
+# Redis Streams work queue: one consumer group per stage, explicit acks and
+# reclaim of entries left pending by consumers that died mid-task.
+# Every queue is split into priority lanes, one stream per lane: the first lane keeps the
+# plain stream name (task:detect), the others get a suffix (task:detect:bulk). LaneQueue
+# drains them by weight, drops tasks whose deadline has passed, and admit() decides at
+# upload time which lane a task may still enter.
+import json
+import math
+import os
+import socket
+import time
+import redis
+
+from utils import logger
+from utils import metrics
+from utils.blob_lifecycle import CONSUMERS, BlobLifecycle
+
+CLAIM_IDLE_MS = int(os.getenv("TASK_CLAIM_IDLE_MS", 60000))
+MAX_DELIVERIES = int(os.getenv("TASK_MAX_DELIVERIES", 5))
+
+def _lane_setting(value, cast=float):
+    # "interactive:8,bulk:1" -> {"interactive": 8.0, "bulk": 1.0}
+    pairs = (item.split(":") for item in value.split(",") if item.strip())
+    return {name.strip(): cast(v) for name, v in pairs}
+
+LANE_WEIGHTS = _lane_setting(os.getenv("TASK_LANES", "interactive:8,bulk:1"))
+LANES = tuple(LANE_WEIGHTS)
+INTERACTIVE_LANE, BULK_LANE = LANES[0], LANES[-1]
+LANE_DEADLINE_SEC = _lane_setting(os.getenv("TASK_LANE_DEADLINE_SEC", "interactive:120"))
+LANE_MAX_DEPTH = _lane_setting(os.getenv("TASK_LANE_MAX_DEPTH", "interactive:200,bulk:20000"), int)
+LANE_MAX_WAIT_SEC = _lane_setting(os.getenv("TASK_LANE_MAX_WAIT_SEC", "interactive:15"))
+INFLIGHT_TTL_SEC = int(os.getenv("INFLIGHT_TTL_SEC", 600))  # processing time of a stage once dequeued
+INFLIGHT_QUEUED_TTL_SEC = int(os.getenv("INFLIGHT_QUEUED_TTL_SEC", 24 * 3600))  # longest wait in a lane without a deadline
+
+def default_consumer_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+def known_lane(lane):
+    # unconfigured lane names fall back to the interactive lane
+    return lane if lane in LANE_WEIGHTS else INTERACTIVE_LANE
+
+def lane_stream(stream, lane=None):
+    lane = known_lane(lane)
+    return stream if lane == LANES[0] else f"{stream}:{lane}"
+
+def lane_streams(stream):
+    return [lane_stream(stream, lane) for lane in LANES]
+
+def lane_deadline(lane, now=None):
+    sec = LANE_DEADLINE_SEC.get(known_lane(lane), 0)
+    return (now or time.time()) + sec if sec > 0 else None
+
+def inflight_ttl(lane=None):
+    # the inflight:<hash> marker has to outlive a wait in the lane's queue plus the stage's work:
+    # a lane with a deadline drops the task by then, one without may hold it far longer.
+    # Every stage sets it again when it dequeues the task.
+    sec = LANE_DEADLINE_SEC.get(known_lane(lane), 0)
+    return int((sec if sec > 0 else INFLIGHT_QUEUED_TTL_SEC) + INFLIGHT_TTL_SEC)
+
+def entry_age(msg_id, now=None):
+    # stream ids start with the enqueue time in ms
+    if isinstance(msg_id, bytes):
+        msg_id = msg_id.decode()
+    return (now or time.time()) - int(msg_id.split("-")[0]) / 1000.0
+
+def publish(client, stream, payload, lane=None):
+    # client may be a Redis connection or a pipeline; dict payloads get the lane and its deadline
+    if lane and isinstance(payload, dict):
+        lane = known_lane(lane)
+        payload = dict(payload, lane=lane)
+        deadline = lane_deadline(lane)
+        if deadline and "deadline" not in payload:
+            payload["deadline"] = deadline
+    if not isinstance(payload, (str, bytes)):
+        payload = json.dumps(payload)
+    return client.xadd(lane_stream(stream, lane), {"task": payload})
+
+def _id_parts(msg_id):
+    if isinstance(msg_id, bytes):
+        msg_id = msg_id.decode()
+    ms, seq = msg_id.split("-")
+    return int(ms), int(seq)
+
+def _undelivered(length, groups):
+    # acked entries are deleted, so a stream holds the entries pending in its group plus the ones
+    # not delivered yet; returns (undelivered count, first id they can start at). Pending entries
+    # are being worked on (or wait for reclaim after a crash) and do not hold new tasks back.
+    if isinstance(groups, Exception) or not groups:
+        return length, "-"
+    group = min(groups, key=lambda g: _id_parts(g["last-delivered-id"]))
+    ms, seq = _id_parts(group["last-delivered-id"])
+    return max(0, length - group["pending"]), f"{ms}-{seq + 1}"
+
+def admit(r, stream, lane=None):
+    # returns the lane a new task may enter, or None to reject it: a lane over its depth or
+    # head-of-line wait limit hands the task down to the next one. Both count only entries no
+    # consumer has received yet; the oldest of them is the one that has waited longest.
+    lanes = LANES[LANES.index(known_lane(lane)):]
+    pipe = r.pipeline(transaction=False)
+    for candidate in lanes:
+        pipe.xlen(lane_stream(stream, candidate))
+        pipe.xinfo_groups(lane_stream(stream, candidate))
+    replies = pipe.execute(raise_on_error=False)  # XINFO fails on a stream that does not exist yet
+    backlog = [_undelivered(replies[2 * i], replies[2 * i + 1]) for i in range(len(lanes))]
+    pipe = r.pipeline(transaction=False)
+    for candidate, (_, start) in zip(lanes, backlog):
+        pipe.xrange(lane_stream(stream, candidate), min=start, count=1)
+    heads = pipe.execute()
+    now = time.time()
+    for candidate, (depth, _), head in zip(lanes, backlog, heads):
+        wait = entry_age(head[0][0], now) if head else 0.0
+        max_depth, max_wait = LANE_MAX_DEPTH.get(candidate, 0), LANE_MAX_WAIT_SEC.get(candidate, 0)
+        if (max_depth and depth >= max_depth) or (max_wait and wait >= max_wait):
+            metrics.inc("tasks_shed_total", queue=stream, lane=candidate,
+                        reason="downgraded" if candidate != lanes[-1] else "rejected")
+            continue
+        return candidate
+    return None
+
+class TaskQueue:
+    def __init__(self, r, stream, group, consumer=None, claim_idle_ms=CLAIM_IDLE_MS):
+        self.r = r
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or default_consumer_name()
+        self.claim_idle_ms = claim_idle_ms
+        self.next_reclaim = 0.0
+        self.ensure_group()
+
+    def ensure_group(self):
+        try:
+            self.r.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def _decode(self, entries):
+        tasks = []
+        for msg_id, fields in entries:
+            if fields is None:  # entry was deleted while pending
+                continue
+            raw = fields.get(b"task", fields.get("task"))
+            if isinstance(raw, bytes):
+                raw = raw.decode()
+            tasks.append((msg_id, json.loads(raw)))
+        return tasks
+
+    def reclaim(self, count=10):
+        # take over entries another consumer read but never acked
+        _, entries, *_ = self.r.xautoclaim(
+            self.stream, self.group, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=count
+        )
+        tasks = []
+        for msg_id, task in self._decode(entries):
+            pending = self.r.xpending_range(self.stream, self.group, min=msg_id, max=msg_id, count=1)
+            if pending and pending[0]["times_delivered"] > MAX_DELIVERIES:
+                logger.log_error("[QUEUE] Dropping %s entry %s after %s deliveries: %s", self.stream, msg_id, MAX_DELIVERIES, task)
+                self.ack(msg_id)
+                continue
+            tasks.append((msg_id, task))
+        if tasks:
+            logger.log_warning("[QUEUE] Reclaimed %s stale entr(ies) from %s", len(tasks), self.stream)
+        return tasks
+
+    def read(self, count=1, block_ms=5000):
+        # pending entries can only go stale after claim_idle_ms, so look for them at half that rate
+        if time.time() >= self.next_reclaim:
+            self.next_reclaim = time.time() + self.claim_idle_ms / 2000.0
+            tasks = self.reclaim(count)
+            if tasks:
+                return tasks
+        response = self.r.xreadgroup(self.group, self.consumer, {self.stream: ">"}, count=count, block=block_ms)
+        if not response:
+            return []
+        return self._decode(response[0][1])
+
+    def ack(self, *msg_ids):
+        if not msg_ids:
+            return
+        pipe = self.r.pipeline()
+        pipe.xack(self.stream, self.group, *msg_ids)
+        pipe.xdel(self.stream, *msg_ids)
+        pipe.execute()
+
+class LaneQueue:
+    # TaskQueue interface over all lanes of a stream; message ids are (lane index, stream id).
+    # holder is the image blob reference this stage owns (None for detection, which owns none)
+    def __init__(self, r, stream, group, consumer=None, lanes=None, holder=None):
+        self.r = r
+        self.holder = holder
+        self.blobs = BlobLifecycle(r)
+        self.stream = stream
+        self.group = group
+        self.lanes = list(lanes or LANES)
+        self.weights = [LANE_WEIGHTS.get(lane, 1.0) for lane in self.lanes]
+        self.queues = [TaskQueue(r, lane_stream(stream, lane), group, consumer) for lane in self.lanes]
+        self.by_stream = {q.stream.encode(): i for i, q in enumerate(self.queues)}
+        self.passes = [0.0] * len(self.lanes)  # service received per unit of weight (stride scheduling)
+        self.buffered = []  # delivered by a blocking read beyond the requested count
+
+    def _accept(self, i, entries):
+        # drops entries past their deadline. The stage gives up its own blob reference and the
+        # storage one (the merge can no longer complete); whoever releases last deletes the blob,
+        # and then the in-flight marker goes too so a re-upload starts over. Detection holds no
+        # reference of its own, so a task it drops releases every downstream one.
+        lane, now = self.lanes[i], time.time()
+        wait_hist = metrics.registry.histogram("task_wait_seconds", queue=self.stream, lane=lane)
+        tasks, stale = [], []
+        for msg_id, task in entries:
+            wait_hist.observe(max(0.0, entry_age(msg_id, now)))
+            deadline = task.get("deadline")
+            if deadline and now > deadline:
+                stale.append((msg_id, task))
+                continue
+            task.setdefault("lane", lane)
+            tasks.append(((i, msg_id), task))
+        if stale:
+            metrics.inc("tasks_shed_total", len(stale), queue=self.stream, lane=lane, reason="deadline")
+            logger.log_warning("[QUEUE] Dropped %s %s task(s) past their deadline from %s", len(stale), lane, self.stream)
+            holders = (self.holder, "storage") if self.holder else CONSUMERS
+            for _, task in stale:
+                h = task["image_hash"]
+                for holder in holders:
+                    self.blobs.release(h, holder)
+                if not self.r.exists(f"image:refs:{h}"):
+                    self.r.delete(f"inflight:{h}")
+            self.queues[i].ack(*[msg_id for msg_id, _ in stale])
+        if tasks:
+            # the job is alive: its in-flight marker must last through this stage and the next queue
+            pipe = self.r.pipeline(transaction=False)
+            for _, task in tasks:
+                if "image_hash" in task:
+                    pipe.expire(f"inflight:{task['image_hash']}", inflight_ttl(task["lane"]))
+            pipe.execute()
+        return tasks
+
+    def read(self, count=1, block_ms=5000):
+        # the lane furthest behind its weighted share reads first, taking its share of count;
+        # a lane that comes up short is empty for this round
+        tasks, self.buffered = self.buffered[:count], self.buffered[count:]
+        active = list(range(len(self.queues)))
+        served, empty = set(), set()
+        while len(tasks) < count and active:
+            i = min(active, key=lambda j: self.passes[j])
+            want = count - len(tasks)
+            if len(active) > 1:
+                want = max(1, math.floor(want * self.weights[i] / sum(self.weights[j] for j in active)))
+            entries = self.queues[i].read(count=want, block_ms=None)
+            if entries:
+                served.add(i)
+                self.passes[i] += len(entries) / self.weights[i]
+            else:
+                empty.add(i)
+            if len(entries) < want:
+                active.remove(i)
+            tasks.extend(self._accept(i, entries))
+        if served:
+            # lanes found empty do not bank credit for a later burst
+            floor = min(self.passes[i] for i in served)
+            for i in empty:
+                self.passes[i] = max(self.passes[i], floor)
+        if tasks or served or not block_ms:
+            return tasks
+
+        # everything empty: block on all lanes at once
+        streams = {q.stream: ">" for q in self.queues}
+        response = self.r.xreadgroup(self.group, self.queues[0].consumer, streams, count=1, block=block_ms)
+        for stream, entries in response or []:
+            i = self.by_stream[stream if isinstance(stream, bytes) else stream.encode()]
+            decoded = self.queues[i]._decode(entries)
+            self.passes[i] += len(decoded) / self.weights[i]
+            tasks.extend(self._accept(i, decoded))
+        # one entry per lane may come back; keep the surplus for the next read
+        self.buffered = tasks[count:]
+        return tasks[:count]
+
+    def ack(self, *msg_ids):
+        by_lane = {}
+        for i, msg_id in msg_ids:
+            by_lane.setdefault(i, []).append(msg_id)
+        for i, ids in by_lane.items():
+            self.queues[i].ack(*ids)
@@ -0,0 +1,93 @@
+# per-image tracing: a W3C-style traceparent ("00-<trace id>-<span id>-<flags>") is created at upload,
+# carried in the task payloads ("traceparent" field) and in gRPC metadata, and every stage records a
+# span under it; sampled spans are appended to TRACE_FILE as JSON lines (one file for all services)
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("logs", "traces.jsonl"))
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 1.0))
+METADATA_KEY = "traceparent"
+
+_fd = None
+_fd_lock = threading.Lock()
+
+def parse(traceparent):
+    # -> (trace_id, span_id, sampled) or None for a missing/malformed header
+    if not traceparent:
+        return None
+    parts = traceparent.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    return parts[1], parts[2], parts[3] == "01"
+
+def _write(record):
+    global _fd
+    if not TRACE_FILE:
+        return
+    line = (json.dumps(record) + "\n").encode()
+    with _fd_lock:
+        if _fd is None:
+            directory = os.path.dirname(TRACE_FILE)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            _fd = os.open(TRACE_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        # a single O_APPEND write per span keeps lines from several processes intact
+        os.write(_fd, line)
+
+class Span:
+    def __init__(self, name, service, parent=None, start=None, **attrs):
+        context = parse(parent)
+        if context is None:
+            self.trace_id, self.parent_id, self.sampled = os.urandom(16).hex(), None, random.random() < SAMPLE_RATE
+        else:
+            self.trace_id, self.parent_id, self.sampled = context
+        self.span_id = os.urandom(8).hex()
+        self.name = name
+        self.service = service
+        self.attrs = attrs
+        self.start = time.time() if start is None else start
+
+    @property
+    def traceparent(self):
+        # context handed to the next stage so its spans become children of this one
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self, end=None, **attrs):
+        if not self.sampled:
+            return
+        end = time.time() if end is None else end
+        self.attrs.update(attrs)
+        _write({
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "service": self.service,
+            "start": round(self.start, 6),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            **self.attrs
+        })
+
+@contextmanager
+def span(name, service, parent=None, **attrs):
+    s = Span(name, service, parent, **attrs)
+    try:
+        yield s
+    except Exception as e:
+        s.attrs["error"] = str(e)
+        raise
+    finally:
+        s.end()
+
+def grpc_metadata(traceparent):
+    return ((METADATA_KEY, traceparent),) if traceparent else ()
+
+def from_grpc_context(context):
+    for key, value in context.invocation_metadata() or ():
+        if key == METADATA_KEY:
+            return value
+    return None
@@ -0,0 +1,119 @@
+# lightweight face tracker for video mode: detections are matched to tracks by box IoU
+# (falling back to centroid distance), and between detector runs tracks coast on a
+# constant-velocity estimate
+import numpy as np
+
+def iou_matrix(a, b):
+    # a: (N, 4), b: (M, 4) boxes as x1, y1, x2, y2 -> (N, M)
+    a = np.asarray(a, dtype=np.float32).reshape(-1, 1, 4)
+    b = np.asarray(b, dtype=np.float32).reshape(1, -1, 4)
+    ix1, iy1 = np.maximum(a[..., 0], b[..., 0]), np.maximum(a[..., 1], b[..., 1])
+    ix2, iy2 = np.minimum(a[..., 2], b[..., 2]), np.minimum(a[..., 3], b[..., 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    union = area_a + area_b - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+class Track:
+    def __init__(self, track_id, box, frame_idx):
+        self.track_id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.detected_box = self.box
+        self.velocity = np.zeros(4, dtype=np.float32)
+        self.first_frame = frame_idx
+        self.last_frame = frame_idx
+        self.last_detected = frame_idx
+        self.hits = 1
+        self.landmarks = None
+        self.landmark_frame = None
+        self.ages = []
+        self.genders = []
+        self.agegender_frame = None
+
+    def int_box(self):
+        return [int(v) for v in self.box]
+
+    def agegender(self):
+        if not self.ages:
+            return {}
+        gender = max(set(self.genders), key=self.genders.count)
+        return {"age": int(round(sum(self.ages) / len(self.ages))), "gender": gender}
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, max_centroid_shift=0.5, max_missed=30):
+        # max_centroid_shift is relative to the track's box size; max_missed is in frames
+        self.iou_threshold = iou_threshold
+        self.max_centroid_shift = max_centroid_shift
+        self.max_missed = max_missed
+        self.tracks = []
+        self.finished = []
+        self.next_id = 0
+
+    def predict(self, frame_idx):
+        # coast every track one frame on its velocity (used on frames without detection)
+        for track in self.tracks:
+            track.box = track.box + track.velocity
+            track.last_frame = frame_idx
+
+    def _match(self, boxes):
+        if not self.tracks or not len(boxes):
+            return [], list(range(len(self.tracks))), list(range(len(boxes)))
+        track_boxes = np.stack([t.box for t in self.tracks])
+        scores = iou_matrix(track_boxes, boxes)
+
+        # centroid fallback for fast motion where boxes no longer overlap
+        tc = (track_boxes[:, None, :2] + track_boxes[:, None, 2:]) / 2
+        dc = (boxes[None, :, :2] + boxes[None, :, 2:]) / 2
+        size = np.maximum(track_boxes[:, 2] - track_boxes[:, 0], track_boxes[:, 3] - track_boxes[:, 1])
+        shift = np.linalg.norm(tc - dc, axis=2) / np.maximum(size[:, None], 1.0)
+        fallback = (scores < self.iou_threshold) & (shift < self.max_centroid_shift)
+        scores = np.where(fallback, self.iou_threshold * (1.0 - shift / self.max_centroid_shift), scores)
+
+        matches = []
+        used_t, used_d = set(), set()
+        # greedy assignment, best pairs first
+        for flat in np.argsort(-scores, axis=None):
+            ti, di = np.unravel_index(flat, scores.shape)
+            if scores[ti, di] <= 0:
+                break
+            # a centroid fallback pair scores below the threshold, so weaker pairs may still follow
+            if (scores[ti, di] < self.iou_threshold and not fallback[ti, di]) or ti in used_t or di in used_d:
+                continue
+            matches.append((ti, di))
+            used_t.add(ti)
+            used_d.add(di)
+        return (matches,
+                [i for i in range(len(self.tracks)) if i not in used_t],
+                [j for j in range(len(boxes)) if j not in used_d])
+
+    def update(self, boxes, frame_idx):
+        # boxes: (M, 4) detections for this frame; returns the tracks seen in it
+        boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        matches, _, unmatched = self._match(boxes)
+        seen = []
+        for ti, di in matches:
+            track = self.tracks[ti]
+            gap = max(1, frame_idx - track.last_detected)
+            track.velocity = (boxes[di] - track.detected_box) / gap
+            track.box = track.detected_box = boxes[di]
+            track.last_frame = track.last_detected = frame_idx
+            track.hits += 1
+            seen.append(track)
+        for di in unmatched:
+            track = Track(self.next_id, boxes[di], frame_idx)
+            self.next_id += 1
+            self.tracks.append(track)
+            seen.append(track)
+
+        alive = []
+        for track in self.tracks:
+            if frame_idx - track.last_detected > self.max_missed:
+                self.finished.append(track)
+            else:
+                alive.append(track)
+        self.tracks = alive
+        return seen
+
+    def all_tracks(self):
+        return sorted(self.finished + self.tracks, key=lambda t: t.track_id)
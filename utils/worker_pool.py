@@ -0,0 +1,229 @@
+# supervisor mode: a pool of model-loaded worker processes fed with frames that the
+# parent decoded once into shared memory; only the handle and the face boxes cross processes.
+# Workers send their metrics back with each result, so the supervisor's endpoint serves them
+import multiprocessing as mp
+import os
+import queue as queue_lib
+import time
+from multiprocessing import shared_memory
+import numpy as np
+
+from utils import logger
+from utils import metrics
+from utils import profiling
+from utils import tracing
+from utils.face_task import decode_for_crops, decode_image
+
+REPORT_INTERVAL_SEC = 60
+# a worker that dies within WORKER_QUICK_FAILURE_SEC of starting (e.g. in init) is restarted after
+# an exponential backoff; after WORKER_MAX_QUICK_FAILURES of those in a row the pool gives up
+WORKER_QUICK_FAILURE_SEC = float(os.getenv("WORKER_QUICK_FAILURE_SEC", 30))
+WORKER_RESTART_BACKOFF_SEC = float(os.getenv("WORKER_RESTART_BACKOFF_SEC", 1))
+WORKER_RESTART_BACKOFF_MAX_SEC = float(os.getenv("WORKER_RESTART_BACKOFF_MAX_SEC", 60))
+WORKER_MAX_QUICK_FAILURES = int(os.getenv("WORKER_MAX_QUICK_FAILURES", 5))
+
+class SharedFrame:
+    def __init__(self, shm, shape, dtype):
+        self.shm = shm
+        self.shape = shape
+        self.dtype = dtype
+
+    @classmethod
+    def from_image(cls, image):
+        shm = shared_memory.SharedMemory(create=True, size=max(1, image.nbytes))
+        np.ndarray(image.shape, dtype=image.dtype, buffer=shm.buf)[:] = image
+        return cls(shm, image.shape, image.dtype.str)
+
+    def handle(self):
+        return self.shm.name, self.shape, self.dtype
+
+    def release(self):
+        self.shm.close()
+        self.shm.unlink()
+
+def _worker_main(name, worker_id, handler, init, jobs, results, log_queue):
+    logger.forward_to(log_queue)  # the supervisor writes the service's log file
+    profiling.install(f"{name.lower()}-worker{worker_id}")
+    if init is not None:
+        init()  # load and warm the models before the first job arrives
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, (shm_name, shape, dtype), args = job
+        start = time.time()
+        shm = shared_memory.SharedMemory(name=shm_name)
+        image = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        try:
+            ok, result = True, handler(image, *args)
+        except Exception as e:
+            ok, result = False, str(e)
+        finally:
+            del image
+            shm.close()
+        results.put((worker_id, job_id, ok, result, time.time() - start, metrics.registry.drain()))
+
+class WorkerPool:
+    def __init__(self, name, size, handler, start_method="spawn", init=None,
+                 restart_backoff_sec=WORKER_RESTART_BACKOFF_SEC, max_quick_failures=WORKER_MAX_QUICK_FAILURES):
+        # handler(image, *args) and init() must be module-level functions so they can be pickled
+        self.name = name
+        self.size = size
+        self.handler = handler
+        self.init = init
+        self.restart_backoff_sec = restart_backoff_sec
+        self.max_quick_failures = max_quick_failures
+        self.ctx = mp.get_context(start_method)
+        self.results = self.ctx.Queue()
+        self.log_queue = self.ctx.Queue()
+        self.log_listener = None
+        self.workers = {}
+        self.last_report = time.time()
+
+    def _spawn(self, worker_id):
+        jobs = self.ctx.Queue()
+        process = self.ctx.Process(
+            target=_worker_main, daemon=True,
+            args=(self.name, worker_id, self.handler, self.init, jobs, self.results, self.log_queue)
+        )
+        process.start()
+        previous = self.workers.get(worker_id, {})
+        self.workers[worker_id] = {
+            "process": process, "jobs": jobs, "job": None, "busy": 0.0, "done": 0,
+            "restarts": previous.get("restarts", 0), "failures": previous.get("failures", 0),
+            "started": time.time(), "restart_at": None
+        }
+
+    def start(self):
+        self.log_listener = logger.serve_queue(self.log_queue)
+        for worker_id in range(self.size):
+            self._spawn(worker_id)
+        logger.log_info("[%s] Started pool of %s worker process(es)", self.name, self.size)
+
+    def idle_workers(self):
+        return [wid for wid, w in self.workers.items() if w["job"] is None and w["process"].is_alive()]
+
+    def submit(self, job_id, frame, *args):
+        worker_id = self.idle_workers()[0]
+        self.workers[worker_id]["job"] = job_id
+        self.workers[worker_id]["jobs"].put((job_id, frame.handle(), args))
+
+    def poll(self, timeout):
+        finished = []
+        block = True
+        while True:
+            try:
+                worker_id, job_id, ok, result, busy, drained = self.results.get(block, timeout)
+            except queue_lib.Empty:
+                break
+            metrics.registry.merge(drained, worker=f"{self.name.lower()}-{worker_id}")
+            worker = self.workers[worker_id]
+            worker["job"] = None
+            worker["busy"] += busy
+            worker["done"] += 1
+            finished.append((job_id, ok, result))
+            block = False
+        return finished
+
+    def check_workers(self):
+        # restart crashed workers, backing off while they keep dying right after start; their
+        # in-flight jobs are returned as lost. Raises once a worker keeps failing that way.
+        lost = []
+        now = time.time()
+        for worker_id, worker in list(self.workers.items()):
+            if worker["process"].is_alive():
+                continue
+            if worker["restart_at"] is None:
+                quick = now - worker["started"] < WORKER_QUICK_FAILURE_SEC
+                worker["failures"] = worker["failures"] + 1 if quick else 0
+                if worker["failures"] >= self.max_quick_failures:
+                    logger.log_error("[%s] Worker %s failed %s times in a row right after starting, giving up",
+                                     self.name, worker_id, worker["failures"])
+                    raise RuntimeError(f"{self.name} worker {worker_id} keeps failing (exit code {worker['process'].exitcode})")
+                delay = 0.0
+                if worker["failures"]:
+                    delay = min(WORKER_RESTART_BACKOFF_MAX_SEC, self.restart_backoff_sec * 2 ** (worker["failures"] - 1))
+                logger.log_error("[%s] Worker %s exited with code %s, restarting in %.1fs",
+                                 self.name, worker_id, worker['process'].exitcode, delay)
+                if worker["job"] is not None:
+                    lost.append(worker["job"])
+                    worker["job"] = None
+                worker["restart_at"] = now + delay
+            if now >= worker["restart_at"]:
+                worker["restarts"] += 1
+                self._spawn(worker_id)
+        return lost
+
+    def report(self):
+        now = time.time()
+        elapsed = now - self.last_report
+        if elapsed < REPORT_INTERVAL_SEC:
+            return
+        for worker_id, worker in sorted(self.workers.items()):
+            logger.log_info(
+                "[%s] Worker %s: %.0f%% busy, %s job(s), %s restart(s)", self.name, worker_id, 100 * worker['busy'] / elapsed, worker['done'], worker['restarts']
+            )
+            worker["busy"] = 0.0
+            worker["done"] = 0
+        self.last_report = now
+
+    def stop(self):
+        for worker in self.workers.values():
+            worker["jobs"].put(None)
+        for worker in self.workers.values():
+            worker["process"].join(timeout=5)
+        if self.log_listener is not None:
+            self.log_listener.stop()
+            self.log_listener = None
+
+def supervise(pool, task_queue, fetch_image, finish, stage=None, crop_min_side=None):
+    # fetch_image(task) -> encoded bytes or None; finish(task, image_bytes, result) -> True to ack;
+    # each task is traced as one `stage` span from dispatch to finish, task["traceparent"] pointing at it;
+    # with crop_min_side the frame is decoded only as large as the face crops need and the handler
+    # gets the decode scale as an extra argument
+    pool.start()
+    pending = {}
+    try:
+        while True:
+            for msg_id in pool.check_workers():
+                _, _, frame, span = pending.pop(msg_id)
+                frame.release()
+                span.end(error="worker exited")  # left unacked, the stream hands it out again after the claim timeout
+
+            free = len(pool.idle_workers())
+            if free:
+                for msg_id, task in task_queue.read(count=free, block_ms=50 if pending else 5000):
+                    span = tracing.Span(stage or pool.name.lower(), stage or pool.name.lower(),
+                                        task.get("traceparent"), image_hash=task["image_hash"], worker_pool=True)
+                    task["traceparent"] = span.traceparent
+                    image_bytes = fetch_image(task)
+                    image, scale = None, 1.0
+                    with metrics.timed("decode", stage or pool.name.lower()):
+                        if image_bytes and crop_min_side:
+                            image, scale = decode_for_crops(image_bytes, task["faces"], crop_min_side)
+                        elif image_bytes:
+                            image = decode_image(image_bytes)
+                    if image is None:
+                        task_queue.ack(msg_id)
+                        continue
+                    frame = SharedFrame.from_image(image)
+                    args = (task["faces"], task["image_hash"]) + ((scale,) if crop_min_side else ())
+                    pool.submit(msg_id, frame, *args)
+                    pending[msg_id] = (task, image_bytes, frame, span)
+
+            for msg_id, ok, result in pool.poll(timeout=0.05 if free else 0.5):
+                task, image_bytes, frame, span = pending.pop(msg_id)
+                frame.release()
+                if not ok:
+                    logger.log_error("[%s] Worker failed on image %s: %s", pool.name, task['image_hash'], result, image_hash=task['image_hash'])
+                    span.end(error=result)
+                    continue
+                if finish(task, image_bytes, result):
+                    task_queue.ack(msg_id)
+                span.end()
+
+            pool.report()
+    finally:
+        for _, _, frame, _ in pending.values():
+            frame.release()
+        pool.stop()
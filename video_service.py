@@ -0,0 +1,162 @@
+# video / frame-sequence mode: decodes locally, runs the detector every K frames, tracks
+# faces in between and computes landmarks and age/gender per track instead of per frame
+# usage: python video_service.py <video file | frame directory> [--detect-every 5]
+import argparse
+import hashlib
+import os
+import time
+from datetime import datetime
+import cv2
+
+from utils import inference
+from utils import logger
+from utils.agegender_engine import AgeGenderEngine
+from utils.face_task import clip_box
+from utils.ingest import is_image_name
+from utils.landmarks import project_landmarks
+from utils.result_codec import encode_result, result_extension
+from utils.tracker import FaceTracker
+
+# not saved_data: the viewer indexes every result there as a single image
+SAVE_DIR = os.getenv("VIDEO_SAVE_DIR", "video_results")
+DETECT_EVERY = int(os.getenv("VIDEO_DETECT_EVERY", 5))
+AGEGENDER_REFRESH = int(os.getenv("VIDEO_AGEGENDER_REFRESH", 150))  # frames between age/gender updates of a track
+LANDMARK_REFRESH = int(os.getenv("VIDEO_LANDMARK_REFRESH", 30))  # frames between landmark updates of a track
+MAX_MISSED = int(os.getenv("VIDEO_MAX_MISSED", 30))
+
+def iter_frames(source):
+    if os.path.isdir(source):
+        for name in sorted(n for n in os.listdir(source) if is_image_name(n)):
+            frame = cv2.imread(os.path.join(source, name), cv2.IMREAD_COLOR)
+            if frame is not None:
+                yield frame
+        return
+    capture = cv2.VideoCapture(source)
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            yield frame
+    finally:
+        capture.release()
+
+def source_hash(source):
+    md5 = hashlib.md5()
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            md5.update(name.encode())
+            md5.update(str(os.path.getsize(os.path.join(source, name))).encode())
+    else:
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                md5.update(chunk)
+    return md5.hexdigest()
+
+class VideoAnalyzer:
+    def __init__(self, detect_every=DETECT_EVERY, agegender_refresh=AGEGENDER_REFRESH,
+                 landmark_refresh=LANDMARK_REFRESH, max_missed=MAX_MISSED):
+        self.detect_every = max(1, detect_every)
+        self.agegender_refresh = agegender_refresh
+        self.landmark_refresh = landmark_refresh
+        self.tracker = FaceTracker(max_missed=max_missed)
+        self.detector = inference.load_detector()
+        self.landmarker = inference.load_landmarker()
+        self.engine = AgeGenderEngine()
+        self.counters = {"frames": 0, "detector_runs": 0, "mesh_runs": 0, "agegender_faces": 0}
+
+    def detect(self, frame):
+        boxes = self.detector.detect([frame])[0]
+        self.counters["detector_runs"] += 1
+        return boxes
+
+    def update_landmarks(self, frame, frame_idx, tracks):
+        h, w = frame.shape[:2]
+        for track in tracks:
+            if track.landmark_frame is not None and frame_idx - track.landmark_frame < self.landmark_refresh:
+                continue
+            x1, y1, x2, y2 = clip_box(track.int_box(), w, h)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            crop = frame[y1:y2, x1:x2]
+            normalized = self.landmarker.landmarks(crop)
+            self.counters["mesh_runs"] += 1
+            if normalized is not None:
+                track.landmarks = project_landmarks(normalized[None], [[x1, y1, x2, y2]])[0]
+                track.landmark_frame = frame_idx
+
+    def update_agegender(self, frame, frame_idx, tracks):
+        # only new tracks and tracks whose estimate is older than the refresh interval
+        h, w = frame.shape[:2]
+        due, crops = [], []
+        for track in tracks:
+            if track.agegender_frame is not None and frame_idx - track.agegender_frame < self.agegender_refresh:
+                continue
+            x1, y1, x2, y2 = clip_box(track.int_box(), w, h)
+            if x2 <= x1 or y2 <= y1:
+                continue
+            due.append(track)
+            crops.append(frame[y1:y2, x1:x2])
+        if not crops:
+            return
+        for track, pred in zip(due, self.engine.predict(crops)):
+            track.ages.append(pred["age"])
+            track.genders.append(pred["gender"])
+            track.agegender_frame = frame_idx
+        self.counters["agegender_faces"] += len(crops)
+
+    def process(self, frames):
+        for frame_idx, frame in enumerate(frames):
+            self.counters["frames"] += 1
+            if frame_idx % self.detect_every:
+                self.tracker.predict(frame_idx)
+                continue
+            seen = self.tracker.update(self.detect(frame), frame_idx)
+            self.update_landmarks(frame, frame_idx, seen)
+            self.update_agegender(frame, frame_idx, seen)
+        return self.tracker.all_tracks()
+
+def tracks_to_result(source, tracks):
+    faces = []
+    for track in tracks:
+        x1, y1, x2, y2 = track.int_box()
+        faces.append({
+            "face_index": track.track_id,
+            "box": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+            "landmarks": track.landmarks,
+            "agegender": track.agegender(),
+            "track": {"first_frame": track.first_frame, "last_frame": track.last_frame, "detections": track.hits}
+        })
+    return {
+        "timestamp": datetime.utcnow().isoformat(),
+        "image_path": source,
+        "redis_key": None,
+        "num_faces": len(faces),
+        "faces": faces
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze faces in a video or frame sequence")
+    parser.add_argument("source", help="video file or directory of frames")
+    parser.add_argument("--detect-every", type=int, default=DETECT_EVERY, help="run the detector every K frames")
+    parser.add_argument("--agegender-refresh", type=int, default=AGEGENDER_REFRESH,
+                        help="frames between age/gender refreshes of a track")
+    args = parser.parse_args()
+
+    analyzer = VideoAnalyzer(detect_every=args.detect_every, agegender_refresh=args.agegender_refresh)
+    start = time.time()
+    tracks = analyzer.process(iter_frames(args.source))
+    duration = time.time() - start
+
+    os.makedirs(SAVE_DIR, exist_ok=True)
+    result_path = os.path.join(SAVE_DIR, f"{source_hash(args.source)}{result_extension()}")
+    with open(result_path, "wb") as f:
+        f.write(encode_result(tracks_to_result(args.source, tracks)))
+
+    frames = analyzer.counters["frames"]
+    logger.log_info(
+        "[VIDEO] %s track(s) over %s frame(s) in %.1fs (%.1f fps): %s — saved to %s", len(tracks), frames, duration, frames / max(duration, 1e-9), analyzer.counters, result_path
+    )
+
+if __name__ == "__main__":
+    main()